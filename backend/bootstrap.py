@@ -0,0 +1,65 @@
+"""The bundle a client needs for its first page, as one response
+
+Instead of the full catalog (descriptions and all), then a populate and
+a re-fetch if it was empty, then one request per image at its original
+size, a client fetches a single bundle:
+
+    fields     names of the values in each breeds row
+    breeds     one row per breed: the fields a card shows and filters on,
+               then its image variants (see images.py)
+    variants   name -> width and height of each image variant
+    facets     field -> [{value, count}] for the filters, plus ranked
+               health conditions
+
+The bundle is encoded once per catalog version. Its ETag is a hash of the
+body, so every worker gives the same version the same tag, and the Link
+header lets the browser connect to the image hosts and fetch the first
+cards' images while it is still parsing the bundle.
+"""
+import hashlib
+from typing import NamedTuple
+
+from catalog_store import CatalogStore
+from conditions import ConditionIndex
+from facets import FACET_FIELDS, encode, ranked_facet_counts
+from images import VARIANTS, image_origins, image_variants
+
+SUMMARY_FIELDS = (
+    "id", "name", "size", "temperament", "origin", "lifespan", "care_level", "breed_group", "image_url",
+)
+# Card images preloaded through the Link header; the rest load as the grid renders
+PRELOAD_IMAGES = 4
+PRECONNECT_ORIGINS = 3
+
+
+class Bundle(NamedTuple):
+    body: bytes
+    etag: str
+    link: str
+
+
+def build_bundle(store: CatalogStore, conditions: ConditionIndex) -> Bundle:
+    """Encode the bundle for one catalog version"""
+    breeds = []
+    for row in store.rows():
+        values = [store.value(row, field) for field in SUMMARY_FIELDS]
+        breeds.append(values + [image_variants(store.value(row, "image_url"))])
+    facets = {
+        field: [{"value": value, "count": count} for value, count in ranked_facet_counts(store, field)]
+        for field in FACET_FIELDS
+    }
+    facets["health_conditions"] = [
+        {"value": condition.id, "name": condition.name, "count": len(condition.breed_ids)}
+        for condition in conditions.ranked()
+    ]
+    body = encode({
+        "count": len(breeds),
+        "fields": list(SUMMARY_FIELDS) + ["images"],
+        "breeds": breeds,
+        "variants": {name: {"width": width, "height": height} for name, (width, height) in VARIANTS.items()},
+        "facets": facets,
+    })
+    image_urls = [breed[-1]["card"]["url"] for breed in breeds]
+    links = [f"<{origin}>; rel=preconnect" for origin in image_origins(image_urls, PRECONNECT_ORIGINS)]
+    links += [f"<{url}>; rel=preload; as=image" for url in image_urls[:PRELOAD_IMAGES]]
+    return Bundle(body, f'"{hashlib.sha256(body).hexdigest()[:16]}"', ", ".join(links))
@@ -0,0 +1,452 @@
+"""Compact in-memory breed catalog
+
+A list of DogBreed models repeats every category string ("Large",
+"Sporting", "Hip Dysplasia") once per breed and pays object overhead for
+each field of each breed. CatalogStore keeps the catalog column by
+column instead:
+
+- low-cardinality fields are dictionary-encoded: an array of small
+  integer codes over a list of interned values
+- list-like fields (health issues, temperament words) are codes plus
+  per-breed offsets into them
+- free text (IDs, names, descriptions) is one UTF-8 buffer per field
+  with an offsets array
+- categorical and tag columns carry facet postings: the rows holding
+  each value
+
+Rows are turned back into plain dicts only when a response needs them;
+the caller validates those into models at the response boundary.
+
+Every column is a handful of flat buffers plus a small vocabulary, so a
+store can be written to a file and used straight from a memory map
+(see snapshot.py); buffers may be arrays, bytes or memoryviews.
+"""
+import bisect
+import itertools
+import sys
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+FIELDS = (
+    "id", "name", "size", "temperament", "origin", "lifespan", "weight", "height",
+    "care_level", "exercise_needs", "good_with_kids", "good_with_pets", "grooming_needs",
+    "image_url", "description", "health_issues", "breed_group", "created_at",
+)
+TEXT_FIELDS = ("id", "name", "description")
+# Separator for fields stored as tags; None for fields that are lists
+TAG_FIELDS = {"temperament": ", ", "health_issues": None}
+REQUIRED_FIELDS = tuple(f for f in FIELDS if f != "created_at")
+CATEGORY_FIELDS = tuple(f for f in FIELDS if f not in TEXT_FIELDS and f not in TAG_FIELDS and f != "created_at")
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_MISSING = -(2 ** 63)
+
+
+def _code_type(count: int) -> str:
+    """Smallest array typecode that can index count values"""
+    return "B" if count <= 0x100 else "H" if count <= 0x10000 else "I"
+
+
+def _offsets(lengths: Iterable[int]) -> array:
+    positions = [0]
+    for length in lengths:
+        positions.append(positions[-1] + length)
+    return array("I" if positions[-1] < 2 ** 32 else "Q", positions)
+
+
+def _encode(values: Iterable[Any], vocabulary: Dict[Any, int]) -> List[int]:
+    codes = []
+    for value in values:
+        code = vocabulary.get(value)
+        if code is None:
+            code = vocabulary[value] = len(vocabulary)
+        codes.append(code)
+    return codes
+
+
+def _interned(values: Iterable[Any]) -> List[Any]:
+    return [sys.intern(value) if isinstance(value, str) else value for value in values]
+
+
+def _nbytes(*buffers) -> int:
+    return sum(buffer.itemsize * len(buffer) for buffer in buffers)
+
+
+def nested_buffers(name: str, part: Any) -> Dict[str, Any]:
+    """A part's buffers keyed "name.buffer"; a plain buffer is keyed name"""
+    if hasattr(part, "buffers"):
+        return {f"{name}.{key}": buffer for key, buffer in part.buffers().items()}
+    return {name: part}
+
+
+def sub_buffers(buffers: Dict[str, Any], name: str) -> Dict[str, Any]:
+    """The buffers nested_buffers() stored under name, prefix removed"""
+    prefix = f"{name}."
+    return {key[len(prefix):]: buffer for key, buffer in buffers.items() if key.startswith(prefix)}
+
+
+def _postings(row_codes: Iterable[Iterable[int]], values: int, rows: int) -> Tuple[array, array]:
+    """Offsets and row numbers listing, for each code, the rows that hold it"""
+    buckets: List[List[int]] = [[] for _ in range(values)]
+    for row, codes in enumerate(row_codes):
+        for code in codes:
+            buckets[code].append(row)
+    return _offsets(map(len, buckets)), array(_code_type(rows), itertools.chain.from_iterable(buckets))
+
+
+class _Facet:
+    """Dictionary-coded column with per-value row postings"""
+    __slots__ = ()
+
+    def code(self, value: Any) -> Optional[int]:
+        try:
+            return self.values.index(value)
+        except ValueError:
+            return None
+
+    def rows(self, value: Any) -> List[int]:
+        """Rows holding value, in row order"""
+        code = self.code(value)
+        if code is None:
+            return []
+        return list(self.posting_rows[self.posting_offsets[code]:self.posting_offsets[code + 1]])
+
+    def count(self, value: Any) -> int:
+        code = self.code(value)
+        return 0 if code is None else self.posting_offsets[code + 1] - self.posting_offsets[code]
+
+
+class TextColumn:
+    """Strings packed into one UTF-8 buffer"""
+    __slots__ = ("data", "offsets")
+    kind = "text"
+
+    def __init__(self, data: bytes, offsets: array):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_buffers(cls, meta: dict, buffers: Dict[str, Any]) -> "TextColumn":
+        return cls(buffers["data"], buffers["offsets"])
+
+    def meta(self) -> dict:
+        return {}
+
+    def buffers(self) -> Dict[str, Any]:
+        return {"data": self.data, "offsets": self.offsets}
+
+    @classmethod
+    def build(cls, values: Iterable[str]) -> "TextColumn":
+        encoded = [value.encode() for value in values]
+        return cls(b"".join(encoded), _offsets(map(len, encoded)))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        # str() rather than .decode() so a memoryview slice works too
+        return str(self.data[self.offsets[row]:self.offsets[row + 1]], "utf-8")
+
+    def slice(self, start: int, stop: int) -> "TextSlice":
+        return TextSlice(self, start, stop)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + _nbytes(self.offsets)
+
+
+class TextSlice(Sequence[str]):
+    """Read-only run of a text column's strings, decoded on access"""
+    __slots__ = ("column", "start", "stop")
+
+    def __init__(self, column: TextColumn, start: int, stop: int):
+        self.column = column
+        self.start = start
+        self.stop = stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.column[row] for row in range(self.start, self.stop)[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.column[self.start + index]
+
+    def __iter__(self):
+        column = self.column
+        return (column[row] for row in range(self.start, self.stop))
+
+
+class CategoryColumn(_Facet):
+    """One dictionary code per row"""
+    __slots__ = ("values", "codes", "posting_offsets", "posting_rows")
+    kind = "category"
+
+    def __init__(self, values: List[Any], codes: array, posting_offsets: array, posting_rows: array):
+        self.values = values
+        self.codes = codes
+        self.posting_offsets = posting_offsets
+        self.posting_rows = posting_rows
+
+    @classmethod
+    def build(cls, values: Iterable[Any]) -> "CategoryColumn":
+        vocabulary: Dict[Any, int] = {}
+        codes = _encode(values, vocabulary)
+        postings = _postings(((code,) for code in codes), len(vocabulary), len(codes))
+        return cls(_interned(vocabulary), array(_code_type(len(vocabulary)), codes), *postings)
+
+    @classmethod
+    def from_buffers(cls, meta: dict, buffers: Dict[str, Any]) -> "CategoryColumn":
+        return cls(_interned(meta["values"]), buffers["codes"], buffers["posting_offsets"], buffers["posting_rows"])
+
+    def meta(self) -> dict:
+        return {"values": self.values}
+
+    def buffers(self) -> Dict[str, Any]:
+        return {"codes": self.codes, "posting_offsets": self.posting_offsets, "posting_rows": self.posting_rows}
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, row: int) -> Any:
+        return self.values[self.codes[row]]
+
+    @property
+    def nbytes(self) -> int:
+        return _nbytes(self.codes, self.posting_offsets, self.posting_rows)
+
+
+class TagsColumn(_Facet):
+    """A variable number of dictionary codes per row
+
+    With a separator the field is a string of tags (temperament); values
+    that would not split and rejoin to the same text are kept whole.
+    """
+    __slots__ = ("values", "codes", "offsets", "separator", "posting_offsets", "posting_rows")
+    kind = "tags"
+
+    def __init__(self, values: List[str], codes: array, offsets: array, separator: Optional[str],
+                 posting_offsets: array, posting_rows: array):
+        self.values = values
+        self.codes = codes
+        self.offsets = offsets
+        self.separator = separator
+        self.posting_offsets = posting_offsets
+        self.posting_rows = posting_rows
+
+    @classmethod
+    def build(cls, values: Iterable[Any], separator: Optional[str] = None) -> "TagsColumn":
+        vocabulary: Dict[str, int] = {}
+        codes: List[int] = []
+        lengths = []
+        for value in values:
+            tags = value
+            if separator is not None:
+                tags = value.split(separator)
+                if separator.join(tags) != value:
+                    tags = [value]
+            codes.extend(_encode(tags, vocabulary))
+            lengths.append(len(tags))
+        offsets = _offsets(lengths)
+        row_codes = (set(codes[offsets[row]:offsets[row + 1]]) for row in range(len(lengths)))
+        postings = _postings(row_codes, len(vocabulary), len(lengths))
+        return cls(_interned(vocabulary), array(_code_type(len(vocabulary)), codes), offsets, separator, *postings)
+
+    @classmethod
+    def from_buffers(cls, meta: dict, buffers: Dict[str, Any]) -> "TagsColumn":
+        return cls(_interned(meta["values"]), buffers["codes"], buffers["offsets"], meta["separator"],
+                   buffers["posting_offsets"], buffers["posting_rows"])
+
+    def meta(self) -> dict:
+        return {"values": self.values, "separator": self.separator}
+
+    def buffers(self) -> Dict[str, Any]:
+        return {"codes": self.codes, "offsets": self.offsets,
+                "posting_offsets": self.posting_offsets, "posting_rows": self.posting_rows}
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def tags(self, row: int) -> List[str]:
+        values = self.values
+        return [values[code] for code in self.codes[self.offsets[row]:self.offsets[row + 1]]]
+
+    def __getitem__(self, row: int) -> Any:
+        tags = self.tags(row)
+        return tags if self.separator is None else self.separator.join(tags)
+
+    @property
+    def nbytes(self) -> int:
+        return _nbytes(self.codes, self.offsets, self.posting_offsets, self.posting_rows)
+
+
+class TimestampColumn:
+    """Naive UTC datetimes as integer microseconds since the epoch"""
+    __slots__ = ("micros",)
+    kind = "timestamp"
+
+    def __init__(self, micros: array):
+        self.micros = micros
+
+    @classmethod
+    def from_buffers(cls, meta: dict, buffers: Dict[str, Any]) -> "TimestampColumn":
+        return cls(buffers["micros"])
+
+    def meta(self) -> dict:
+        return {}
+
+    def buffers(self) -> Dict[str, Any]:
+        return {"micros": self.micros}
+
+    @classmethod
+    def build(cls, values: Iterable[Optional[datetime]]) -> "TimestampColumn":
+        micros = array("q")
+        for value in values:
+            if value is None:
+                micros.append(_MISSING)
+                continue
+            if value.tzinfo is not None:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            micros.append((value - _EPOCH) // _MICROSECOND)
+        return cls(micros)
+
+    def __len__(self) -> int:
+        return len(self.micros)
+
+    def __getitem__(self, row: int) -> Optional[datetime]:
+        value = self.micros[row]
+        return None if value == _MISSING else _EPOCH + timedelta(microseconds=value)
+
+    @property
+    def nbytes(self) -> int:
+        return _nbytes(self.micros)
+
+
+COLUMN_KINDS = {column.kind: column for column in (TextColumn, CategoryColumn, TagsColumn, TimestampColumn)}
+
+
+class CatalogStore:
+    """Columnar, read-only snapshot of the breed catalog"""
+    __slots__ = ("columns", "by_id")
+
+    def __init__(self, columns: Dict[str, Any], by_id: array):
+        self.columns = columns
+        self.by_id = by_id  # rows in ID order, for binary search
+
+    @classmethod
+    def build(cls, breeds: Sequence[dict]) -> "CatalogStore":
+        """Store of every breed document that has all the fields a DogBreed needs"""
+        # Incomplete documents could not be materialized anyway; lookups of
+        # their IDs miss, and callers fall back to the database
+        breeds = [breed for breed in breeds if all(breed.get(field) is not None for field in REQUIRED_FIELDS)]
+
+        def column(field):
+            return (breed[field] for breed in breeds)
+
+        columns: Dict[str, Any] = {}
+        for field in FIELDS:
+            if field in TEXT_FIELDS:
+                columns[field] = TextColumn.build(column(field))
+            elif field in TAG_FIELDS:
+                columns[field] = TagsColumn.build(column(field), TAG_FIELDS[field])
+            elif field == "created_at":
+                columns[field] = TimestampColumn.build(breed.get(field) for breed in breeds)
+            else:
+                columns[field] = CategoryColumn.build(column(field))
+        order = sorted(range(len(breeds)), key=lambda row: breeds[row]["id"])
+        return cls(columns, array(_code_type(len(breeds)), order))
+
+    @classmethod
+    def from_buffers(cls, meta: dict, buffers: Dict[str, Any]) -> "CatalogStore":
+        """Reassemble a store from meta() and buffers() output, without copying buffers"""
+        columns = {
+            field: COLUMN_KINDS[column_meta["kind"]].from_buffers(column_meta, sub_buffers(buffers, field))
+            for field, column_meta in meta["columns"].items()
+        }
+        return cls(columns, buffers["by_id"])
+
+    def meta(self) -> dict:
+        """JSON-serializable description of the columns: kinds and vocabularies"""
+        return {
+            "count": len(self),
+            "columns": {field: {"kind": column.kind, **column.meta()} for field, column in self.columns.items()},
+        }
+
+    def buffers(self) -> Dict[str, Any]:
+        """Every flat buffer of the store, keyed "field.name" (plus "by_id")"""
+        buffers = {"by_id": self.by_id}
+        for field, column in self.columns.items():
+            buffers.update(nested_buffers(field, column))
+        return buffers
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def __contains__(self, breed_id: str) -> bool:
+        return self.index(breed_id) is not None
+
+    def index(self, breed_id: str) -> Optional[int]:
+        """Row of the breed with this ID, if present"""
+        ids = self.columns["id"]
+        data, offsets = ids.data, ids.offsets
+
+        def key(row: int) -> str:
+            return str(data[offsets[row]:offsets[row + 1]], "utf-8")
+
+        position = bisect.bisect_left(self.by_id, breed_id, key=key)
+        if position < len(self.by_id) and key(self.by_id[position]) == breed_id:
+            return self.by_id[position]
+        return None
+
+    def rows(self) -> Iterable[int]:
+        """Every row, in storage order"""
+        return range(len(self))
+
+    def value(self, row: int, field: str) -> Any:
+        return self.columns[field][row]
+
+    def tags(self, row: int, field: str) -> List[Any]:
+        """A categorical field's values in the row: its tags, or its one value"""
+        column = self.facet(field)
+        return column.tags(row) if isinstance(column, TagsColumn) else [column[row]]
+
+    def record(self, row: int) -> dict:
+        """The row as a breed document; missing timestamps are left out"""
+        record = {field: column[row] for field, column in self.columns.items()}
+        if record["created_at"] is None:
+            del record["created_at"]
+        return record
+
+    def records(self, rows: Iterable[int]) -> List[dict]:
+        return [self.record(row) for row in rows]
+
+    def get(self, breed_id: str) -> Optional[dict]:
+        row = self.index(breed_id)
+        return None if row is None else self.record(row)
+
+    def facet(self, field: str) -> _Facet:
+        column = self.columns[field]
+        if not isinstance(column, _Facet):
+            raise ValueError(f"{field} is not a categorical field")
+        return column
+
+    def rows_where(self, field: str, value: Any) -> List[int]:
+        """Rows whose categorical field equals value, or whose tags include it"""
+        return self.facet(field).rows(value)
+
+    def facet_counts(self, field: str) -> Dict[Any, int]:
+        """Breeds per value of a categorical field"""
+        facet = self.facet(field)
+        offsets = facet.posting_offsets
+        return {value: offsets[code + 1] - offsets[code] for code, value in enumerate(facet.values)}
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held in column buffers (vocabularies not included)"""
+        return sum(column.nbytes for column in self.columns.values()) + _nbytes(self.by_id)
@@ -0,0 +1,304 @@
+"""Catalog change feed: a shared log of breed deltas fanned out to clients
+
+Every catalog write appends compact deltas to a change log collection,
+numbered from a counter document so versions are global across server
+processes:
+
+    {"_id": 42, "op": "create", "id": "...", "breed": {...}}
+    {"_id": 43, "op": "update", "id": "...", "fields": {...only what changed}}
+    {"_id": 44, "op": "delete", "id": "..."}
+    {"_id": 90, "op": "reset", "first": 45, "count": 312}    # bulk write
+
+The same counter numbers breed revisions: every breed document carries
+the version of the change that last wrote it, and deletes leave
+tombstones with theirs. A bulk write (populate, import) revises many
+breeds but logs one reset covering its whole range of versions; clients
+catch up on it through GET /api/breeds/changes.
+
+Each process runs one ChangeBroadcaster. It tails the log, encodes each
+change once, and hands the encoded frame to every subscriber, so the
+cost of a change doesn't grow with the number of connected clients.
+Subscribers reconnecting with the last version they saw catch up from
+recent history, or from the log. If the log no longer reaches back that
+far, they get a reset and re-fetch the catalog.
+
+Versions are allocated before the breeds are written and logged after,
+so a concurrent writer can leave a short gap. The broadcaster waits
+gap_timeout seconds for a gap to fill before skipping it.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Deque, List, NamedTuple, Optional, Set
+
+from pymongo import ReturnDocument
+
+from catalog_store import FIELDS
+from metrics import CHANGE_EVENTS, CHANGE_SUBSCRIBERS, CHANGE_SUBSCRIBERS_DROPPED
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _public(document: dict) -> dict:
+    return {field: document[field] for field in FIELDS if field in document}
+
+
+def breed_delta(before: Optional[dict], after: Optional[dict]) -> Optional[dict]:
+    """Compact change record for one breed write; None if nothing visible changed"""
+    if before is None and after is None:
+        return None
+    if before is None:
+        return {"op": "create", "id": after["id"], "breed": _public(after)}
+    if after is None:
+        return {"op": "delete", "id": before["id"]}
+    old, new = _public(before), _public(after)
+    fields = {field: value for field, value in new.items() if old.get(field) != value}
+    if not fields:
+        return None
+    return {"op": "update", "id": after["id"], "fields": fields}
+
+
+class ChangeLog:
+    """Versioned catalog changes in MongoDB, expiring after retention seconds"""
+
+    def __init__(self, retention: float = 86400):
+        self.retention = retention
+        self.collection = None
+        self.counters = None
+
+    def attach(self, collection, counters):
+        """Use collection for the log and a document in counters for versions"""
+        self.collection = collection
+        self.counters = counters
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def allocate(self, count: int = 1) -> int:
+        """Reserve count consecutive versions; returns the first"""
+        counter = await self.counters.find_one_and_update(
+            {"_id": "catalog_changes"}, {"$inc": {"version": count}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        return counter["version"] - count + 1
+
+    async def append(self, changes: List[dict]):
+        """Store changes, each under the version allocated for it as "_id" """
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.retention)
+        await self.collection.insert_many([{**change, "at": now, "expires_at": expires_at} for change in changes])
+
+    async def latest(self) -> int:
+        counter = await self.counters.find_one({"_id": "catalog_changes"})
+        return counter["version"] if counter else 0
+
+    async def horizon(self) -> int:
+        """Versions up to this one may have lost tombstones; see raise_horizon"""
+        counter = await self.counters.find_one({"_id": "catalog_changes"})
+        return counter.get("horizon", 0) if counter else 0
+
+    async def raise_horizon(self, version: int):
+        """Record that tombstones up to version were pruned"""
+        await self.counters.update_one({"_id": "catalog_changes"}, {"$max": {"horizon": version}}, upsert=True)
+
+    async def read(self, after: int, limit: int) -> List[dict]:
+        """Changes with versions above after, oldest first"""
+        return await self.collection.find(
+            {"_id": {"$gt": after}}, {"at": 0, "expires_at": 0}
+        ).sort("_id", 1).to_list(limit)
+
+
+class Change(NamedTuple):
+    version: int
+    first: int  # first version covered; below version only for bulk resets
+    op: str
+    payload: str  # JSON text, as sent over WebSockets
+    frame: bytes  # the same as a server-sent event
+
+    @classmethod
+    def encode(cls, version: int, op: str, data: dict) -> "Change":
+        payload = json.dumps({"version": version, "op": op, **data}, default=_json_default)
+        frame = f"id: {version}\nevent: {op}\ndata: {payload}\n\n".encode()
+        return cls(version, data.get("first", version), op, payload, frame)
+
+    @classmethod
+    def from_document(cls, document: dict) -> "Change":
+        data = dict(document)
+        return cls.encode(data.pop("_id"), data.pop("op"), data)
+
+
+class Subscription:
+    def __init__(self, size: int):
+        self.queue: "asyncio.Queue[Change]" = asyncio.Queue(size)
+        # Set when the subscriber fell too far behind and was dropped
+        self.overflowed = False
+
+
+class ChangeBroadcaster:
+    """Tails the change log and fans each change out to this process's subscribers"""
+
+    def __init__(self, log: ChangeLog, history: int = 1000, queue_size: int = 256,
+                 poll_interval: float = 1.0, gap_timeout: float = 5.0, batch_size: int = 500):
+        self.log = log
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.gap_timeout = gap_timeout
+        self.batch_size = batch_size
+        self.version = 0  # last change delivered
+        self._history: Deque[Change] = deque(maxlen=history)
+        self._subscribers: Set[Subscription] = set()
+        self._wake = asyncio.Event()
+        self._gap_since: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Follow the log from its current end"""
+        self.version = await self.log.latest()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def record(self, changes: List[dict]):
+        """Append changes to the log and deliver them here without waiting for a poll"""
+        if not changes:
+            return
+        await self.log.append(changes)
+        self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                while await self.poll() == self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Reading the catalog change log failed")
+
+    async def poll(self) -> int:
+        """Deliver changes newer than the last one delivered; returns how many were read"""
+        documents = await self.log.read(self.version, self.batch_size)
+        for document in documents:
+            change = Change.from_document(document)
+            if change.first != self.version + 1:
+                now = time.monotonic()
+                if self._gap_since is None:
+                    self._gap_since = now
+                if now - self._gap_since < self.gap_timeout:
+                    # An earlier version is still being written; wait for it
+                    return 0
+                logger.warning("Skipping catalog change versions %d-%d", self.version + 1, change.first - 1)
+            self._gap_since = None
+            self._deliver(change)
+        return len(documents)
+
+    def _deliver(self, change: Change):
+        self.version = change.version
+        self._history.append(change)
+        CHANGE_EVENTS.labels(change.op).inc()
+        for subscription in list(self._subscribers):
+            try:
+                subscription.queue.put_nowait(change)
+            except asyncio.QueueFull:
+                # It reconnects and catches up from the log instead
+                subscription.overflowed = True
+                self._unsubscribe(subscription)
+                CHANGE_SUBSCRIBERS_DROPPED.inc()
+
+    def _subscribe(self) -> Subscription:
+        subscription = Subscription(self.queue_size)
+        self._subscribers.add(subscription)
+        CHANGE_SUBSCRIBERS.inc()
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        if subscription in self._subscribers:
+            self._subscribers.discard(subscription)
+            CHANGE_SUBSCRIBERS.dec()
+
+    def reset(self) -> Change:
+        """Tells a client to re-fetch the catalog and continue from the current version"""
+        return Change.encode(self.version, "reset", {})
+
+    async def backlog(self, since: int) -> Optional[List[Change]]:
+        """Changes after since up to the current version, or None if they are gone"""
+        until = self.version
+        if since >= until:
+            return []
+        if self._history and self._history[0].first <= since + 1:
+            return [change for change in self._history if since < change.version <= until]
+        limit = self._history.maxlen or self.batch_size
+        documents = await self.log.read(since, limit + 1)
+        changes = [Change.from_document(document) for document in documents]
+        if not changes or changes[0].first != since + 1 or len(changes) > limit:
+            return None
+        return [change for change in changes if change.version <= until]
+
+    async def stream(self, since: Optional[int] = None, heartbeat: float = 15.0) -> AsyncIterator[Optional[Change]]:
+        """Changes after since (default: from now), then live ones
+
+        Yields None after heartbeat seconds without a change. Ends if the
+        subscriber falls queue_size changes behind; the client reconnects
+        with the last version it saw.
+        """
+        # Subscribed before reading the backlog so nothing falls in between
+        subscription = self._subscribe()
+        try:
+            sent = self.version if since is None else since
+            if since is not None:
+                if since > self.version:
+                    backlog = None
+                else:
+                    backlog = await self.backlog(since)
+                if backlog is None:
+                    change = self.reset()
+                    sent = change.version
+                    yield change
+                else:
+                    for change in backlog:
+                        sent = change.version
+                        yield change
+            while not subscription.overflowed:
+                try:
+                    change = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if change.version > sent:
+                    sent = change.version
+                    yield change
+        finally:
+            self._unsubscribe(subscription)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+
+def broadcaster_from_env() -> ChangeBroadcaster:
+    """CHANGE_RETENTION (seconds changes stay in the log), CHANGE_HISTORY
+    (recent changes kept in memory for catch-up), CHANGE_QUEUE_SIZE
+    (changes a subscriber may lag before it is dropped), CHANGE_POLL
+    (seconds between checks for other processes' changes)"""
+    return ChangeBroadcaster(
+        ChangeLog(retention=float(os.environ.get("CHANGE_RETENTION", "86400"))),
+        history=int(os.environ.get("CHANGE_HISTORY", "1000")),
+        queue_size=int(os.environ.get("CHANGE_QUEUE_SIZE", "256")),
+        poll_interval=float(os.environ.get("CHANGE_POLL", "1")),
+    )
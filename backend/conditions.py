@@ -0,0 +1,123 @@
+"""Canonical health conditions and the condition -> breeds reverse index"""
+import itertools
+import re
+from array import array
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from catalog_store import TextColumn, nested_buffers, sub_buffers
+
+# Canonical names for variants that the generic suffix rule can't merge
+CONDITION_ALIASES = {
+    "luxating patella": "Patellar Luxation",
+    "brachycephalic syndrome": "Brachycephalic Airway Syndrome",
+    "brachycephalic obstructive airway syndrome": "Brachycephalic Airway Syndrome",
+    "breathing problems": "Brachycephalic Airway Syndrome",
+    "bloat": "Gastric Dilatation-Volvulus (Bloat)",
+    "gastric torsion": "Gastric Dilatation-Volvulus (Bloat)",
+    "von willebrand's disease": "Von Willebrand Disease",
+    "pra": "Progressive Retinal Atrophy",
+}
+
+# "Heart Disease", "Heart Problems" and "Heart Conditions" share the stem "heart"
+_GENERIC_SUFFIX = re.compile(r"\s+(disease|diseases|problems|conditions|disorders|issues)$")
+
+# Preferred display name per stem
+STEM_NAMES = {
+    "heart": "Heart Disease",
+    "eye": "Eye Disorders",
+    "dental": "Dental Disease",
+    "kidney": "Kidney Disease",
+    "skin": "Skin Disorders",
+    "neurological": "Neurological Disorders",
+    "autoimmune": "Autoimmune Disorders",
+}
+
+
+def slugify(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", text.lower().replace("'", "")).strip("-")
+
+
+def canonical_name(issue: str) -> str:
+    """Canonical display name for a free-text health issue"""
+    key = " ".join(issue.lower().split())
+    if key in CONDITION_ALIASES:
+        return CONDITION_ALIASES[key]
+    stem = _GENERIC_SUFFIX.sub("", key)
+    if stem != key:
+        return STEM_NAMES.get(stem, issue.strip())
+    return issue.strip()
+
+
+def condition_id(issue: str) -> str:
+    """Stable ID of the canonical condition for a free-text health issue"""
+    return slugify(canonical_name(issue))
+
+
+def condition_ids(health_issues: Iterable[str]) -> List[str]:
+    """Distinct condition IDs for a breed, in first-seen order"""
+    return list(dict.fromkeys(condition_id(issue) for issue in health_issues or ()))
+
+
+class Condition(NamedTuple):
+    id: str
+    name: str
+    variants: List[str]
+    breed_ids: Sequence[str]
+
+
+class ConditionIndex:
+    """Condition ID -> canonical entity and the breeds prone to it
+
+    Breed IDs of every condition share one text column, so the index can
+    be mapped from a snapshot; see snapshot.py.
+    """
+
+    def __init__(self, entries: List[dict], breed_ids: TextColumn, offsets: Sequence[int]):
+        # entries (id, name, variants) are ranked, most common first
+        self._entries = entries
+        self._breed_ids = breed_ids
+        self._offsets = offsets
+        self._ranked = [
+            Condition(entry["id"], entry["name"], entry["variants"], breed_ids.slice(offsets[i], offsets[i + 1]))
+            for i, entry in enumerate(entries)
+        ]
+        self._conditions = {condition.id: condition for condition in self._ranked}
+
+    @classmethod
+    def build(cls, breeds: Iterable[dict]) -> "ConditionIndex":
+        conditions: Dict[str, Condition] = {}
+        for breed in breeds:
+            for issue in breed.get("health_issues") or ():
+                cid = condition_id(issue)
+                condition = conditions.get(cid)
+                if condition is None:
+                    condition = conditions[cid] = Condition(cid, canonical_name(issue), [], [])
+                if issue not in condition.variants:
+                    condition.variants.append(issue)
+                if not condition.breed_ids or condition.breed_ids[-1] != breed["id"]:
+                    condition.breed_ids.append(breed["id"])
+        ranked = sorted(conditions.values(), key=lambda c: (-len(c.breed_ids), c.name))
+        breed_ids = TextColumn.build(itertools.chain.from_iterable(c.breed_ids for c in ranked))
+        offsets = list(itertools.accumulate((len(c.breed_ids) for c in ranked), initial=0))
+        entries = [{"id": c.id, "name": c.name, "variants": c.variants} for c in ranked]
+        return cls(entries, breed_ids, array(breed_ids.offsets.typecode, offsets))
+
+    @classmethod
+    def from_buffers(cls, meta: dict, buffers: Dict[str, Any]) -> "ConditionIndex":
+        return cls(meta["conditions"], TextColumn.from_buffers({}, sub_buffers(buffers, "breed_ids")), buffers["offsets"])
+
+    def meta(self) -> dict:
+        return {"conditions": self._entries}
+
+    def buffers(self) -> Dict[str, Any]:
+        return {**nested_buffers("breed_ids", self._breed_ids), "offsets": self._offsets}
+
+    def __len__(self) -> int:
+        return len(self._conditions)
+
+    def get(self, cid: str) -> Optional[Condition]:
+        return self._conditions.get(cid)
+
+    def ranked(self) -> List[Condition]:
+        """All conditions, most common first"""
+        return self._ranked
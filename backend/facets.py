@@ -0,0 +1,22 @@
+"""Filter facets and the compact JSON encoding shared by the bootstrap
+bundle (bootstrap.py) and the static export (static_export.py)
+"""
+import json
+from typing import Any, List, Tuple
+
+from catalog_store import CatalogStore
+
+# Categorical fields clients filter on
+FACET_FIELDS = (
+    "size", "breed_group", "origin", "care_level", "exercise_needs",
+    "grooming_needs", "good_with_kids", "good_with_pets",
+)
+
+
+def encode(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def ranked_facet_counts(store: CatalogStore, field: str) -> List[Tuple[Any, int]]:
+    """A field's values and their breed counts, most common first"""
+    return sorted(store.facet_counts(field).items(), key=lambda item: (-item[1], str(item[0])))
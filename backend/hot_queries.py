@@ -0,0 +1,143 @@
+"""Search query frequencies and precomputed results for the hottest queries
+
+Search traffic is skewed: a few queries ("lab", "golden", "small") make
+up most of it. QueryCounter keeps approximate counts of the most
+frequent normalized queries in bounded memory, and HotQueries re-runs the
+top ones whenever the catalog changes, so their results are cached
+before anyone asks again.
+"""
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCount(NamedTuple):
+    key: Hashable
+    count: int
+    error: int  # count may be overstated by up to this much
+
+
+class QueryCounter:
+    """Space-Saving counts of the most frequent queries
+
+    At most capacity queries are tracked. A new query takes the place of
+    the least counted one and inherits its count (recorded as the error),
+    so any query seen more than total / capacity times is always tracked.
+    Observing is O(1): queries are bucketed by count.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.total = 0
+        self._counts: Dict[Hashable, List[int]] = {}  # key -> [count, error]
+        self._buckets: Dict[int, "OrderedDict[Hashable, None]"] = {}
+        self._lowest = 0
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def observe(self, key: Hashable):
+        self.total += 1
+        entry = self._counts.get(key)
+        if entry is None:
+            floor = 0
+            if len(self._counts) >= self.capacity:
+                floor = self._lowest
+                victim, _ = self._buckets[floor].popitem(last=False)
+                if not self._buckets[floor]:
+                    del self._buckets[floor]
+                del self._counts[victim]
+            entry = self._counts[key] = [floor, floor]
+            self._buckets.setdefault(floor, OrderedDict())[key] = None
+            self._lowest = floor
+        count = entry[0]
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if self._lowest == count:
+                self._lowest = count + 1
+        entry[0] = count + 1
+        self._buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+    def top(self, limit: int) -> List[QueryCount]:
+        ranked = sorted(self._counts.items(), key=lambda item: -item[1][0])[:limit]
+        return [QueryCount(key, count, error) for key, (count, error) in ranked]
+
+
+class HotQueries:
+    """Counts queries and refreshes the top ones' results after catalog changes
+
+    refresh(keys) recomputes and caches results for the given query keys.
+    It runs shortly after each change (bursts are coalesced over settle
+    seconds) and every interval seconds, so precomputed results don't
+    expire between changes.
+    """
+
+    def __init__(self, counter: QueryCounter, top: int = 20, interval: float = 120.0, settle: float = 0.5):
+        self.counter = counter
+        self.top = top
+        self.interval = interval
+        self.settle = settle
+        self.refreshes = 0
+        self._changed = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def observe(self, key: Hashable):
+        self.counter.observe(key)
+
+    def start(self, changes: Callable[[], AsyncIterator[Optional[object]]],
+              refresh: Callable[[List[Hashable]], Awaitable[None]]):
+        """Follow changes() (a change stream, reopened when it ends) and refresh on each change"""
+        if self.top <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._follow(changes)), loop.create_task(self._run(refresh))]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _follow(self, changes):
+        while True:
+            try:
+                async for change in changes():
+                    if change is not None:
+                        self._changed.set()
+            except Exception:
+                logger.exception("Following catalog changes for hot queries failed")
+                await asyncio.sleep(self.interval)
+
+    async def _run(self, refresh):
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), self.interval)
+                # Let a burst of changes finish before recomputing
+                await asyncio.sleep(self.settle)
+            except asyncio.TimeoutError:
+                pass
+            self._changed.clear()
+            keys = [entry.key for entry in self.counter.top(self.top)]
+            if not keys:
+                continue
+            try:
+                await refresh(keys)
+                self.refreshes += 1
+            except Exception:
+                logger.exception("Refreshing hot query results failed")
+
+
+def hot_queries_from_env() -> HotQueries:
+    """SEARCH_HOT_QUERIES (top queries kept precomputed; 0 disables),
+    SEARCH_QUERY_STATS (distinct queries counted) and SEARCH_HOT_REFRESH
+    (seconds between refreshes without catalog changes)"""
+    return HotQueries(
+        QueryCounter(int(os.environ.get("SEARCH_QUERY_STATS", "1000"))),
+        top=int(os.environ.get("SEARCH_HOT_QUERIES", "20")),
+        interval=float(os.environ.get("SEARCH_HOT_REFRESH", "120")),
+    )
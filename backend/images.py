@@ -0,0 +1,57 @@
+"""Resized variants of breed images
+
+Breed images are hot-linked from Unsplash and Pexels, whose CDNs resize
+and recompress on the fly given query parameters. A card only needs a
+400x300 crop of what may be a 5000 pixel original, so clients get URLs
+for fixed-size variants, with their dimensions to reserve layout space
+before the image arrives. Images on other hosts are passed through as
+their only variant, with no known dimensions.
+"""
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Variant name -> (width, height); "card_2x" is the card on dense screens
+VARIANTS: Dict[str, Tuple[int, int]] = {
+    "card": (400, 300),
+    "card_2x": (800, 600),
+    "detail": (1200, 800),
+}
+
+# Host -> query parameters for a cropped, recompressed image of a size
+_RESIZERS = {
+    "images.unsplash.com": lambda width, height: {
+        "w": width, "h": height, "fit": "crop", "auto": "format", "q": 75,
+    },
+    "images.pexels.com": lambda width, height: {
+        "auto": "compress", "cs": "tinysrgb", "w": width, "h": height, "fit": "crop",
+    },
+}
+
+
+def image_variants(url: str) -> Dict[str, dict]:
+    """Variant name -> {"url", "width", "height"} for an image URL"""
+    parts = urlsplit(url)
+    resize = _RESIZERS.get(parts.netloc)
+    if resize is None:
+        return {name: {"url": url, "width": None, "height": None} for name in VARIANTS}
+    query = dict(parse_qsl(parts.query))
+    variants = {}
+    for name, (width, height) in VARIANTS.items():
+        params = {**query, **resize(width, height)}
+        variants[name] = {
+            "url": urlunsplit(parts._replace(query=urlencode(params))),
+            "width": width,
+            "height": height,
+        }
+    return variants
+
+
+def image_origins(urls: List[str], limit: Optional[int] = None) -> List[str]:
+    """Distinct scheme://host origins of urls, most used first"""
+    counts: Dict[str, int] = {}
+    for url in urls:
+        parts = urlsplit(url)
+        if parts.scheme and parts.netloc:
+            origin = f"{parts.scheme}://{parts.netloc}"
+            counts[origin] = counts.get(origin, 0) + 1
+    return sorted(counts, key=lambda origin: -counts[origin])[:limit]
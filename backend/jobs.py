@@ -0,0 +1,323 @@
+"""Background jobs persisted in MongoDB and run by a pool of asyncio workers
+
+A job is a document in the jobs collection. Workers claim the oldest
+queued job with an atomic update, so any number of server processes can
+share one queue. Handlers report progress through their JobContext; the
+same call picks up cancellation requests, which are cooperative: a
+handler stops at its next progress report.
+
+Jobs in the same group (catalog writes, say) run one at a time, in every
+process: a worker first takes its group's document in the locks
+collection, a lease its heartbeat renews and which lapses after
+stale_after seconds if the worker dies.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ("queued", "running", "succeeded", "failed", "cancelled")
+FINISHED = ("succeeded", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler once its job has been cancelled"""
+
+
+class JobError(Exception):
+    """Raised for submissions the queue cannot accept"""
+
+
+class JobContext:
+    """A running job's handle for reporting progress and checking for cancellation
+
+    Without a queue (a handler called directly) every call is a no-op.
+    """
+
+    def __init__(self, queue: Optional["JobQueue"] = None, job_id: Optional[str] = None):
+        self.queue = queue
+        self.job_id = job_id
+        self.cancel_requested = False
+        self._reported_at = 0.0
+
+    def check_cancelled(self):
+        if self.cancel_requested:
+            raise JobCancelled(self.job_id)
+
+    async def progress(self, done: int, total: Optional[int] = None, message: Optional[str] = None):
+        """Record progress (at most a few writes a second) and stop if cancelled"""
+        self.check_cancelled()
+        if self.queue is None:
+            return
+        now = time.monotonic()
+        if now - self._reported_at < self.queue.progress_interval and done != total:
+            return
+        self._reported_at = now
+        update = {"progress.done": done, "heartbeat_at": datetime.utcnow()}
+        if total is not None:
+            update["progress.total"] = total
+        if message is not None:
+            update["message"] = message
+        job = await self.queue.collection.find_one_and_update(
+            {"id": self.job_id}, {"$set": update}, projection={"cancel_requested": 1}
+        )
+        # Another process may have asked for the cancellation
+        if job and job.get("cancel_requested"):
+            self.cancel_requested = True
+        self.check_cancelled()
+
+
+Handler = Callable[..., Awaitable[Optional[dict]]]
+
+
+class _Kind(NamedTuple):
+    handler: Handler
+    group: str
+
+
+class JobQueue:
+    """Worker pool executing registered job kinds from the jobs collection"""
+
+    def __init__(self, workers: int = 2, poll_interval: float = 1.0, progress_interval: float = 0.5,
+                 heartbeat_interval: float = 10.0, stale_after: float = 120.0):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.progress_interval = progress_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.collection = None
+        self.locks = None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._kinds: Dict[str, _Kind] = {}
+        self._running: Dict[str, JobContext] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._reaped_at = 0.0
+
+    def register(self, kind: str, handler: Handler, group: Optional[str] = None):
+        """Run handler(context, **params) for jobs of this kind"""
+        self._kinds[kind] = _Kind(handler, group or kind)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def ensure_indexes(self, collection):
+        await collection.create_index("id", unique=True)
+        await collection.create_index([("status", 1), ("created_at", 1)])
+        # Finished jobs are kept for a week
+        await collection.create_index("finished_at", expireAfterSeconds=7 * 86400)
+
+    def start(self, collection, locks):
+        """Start the workers against the jobs and group locks collections
+        (call from the running loop)"""
+        if self._tasks:
+            return
+        self.collection = collection
+        self.locks = locks
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.get_running_loop().create_task(self._worker(), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self):
+        """Stop the workers; jobs they were running are marked failed"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def submit(self, kind: str, params: Optional[dict] = None) -> dict:
+        if kind not in self._kinds:
+            raise JobError(f"Unknown job kind {kind!r}")
+        if self.collection is None:
+            raise JobError("Job queue is not running")
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "group": self._kinds[kind].group,
+            "params": params or {},
+            "status": "queued",
+            "progress": {"done": 0, "total": None},
+            "message": None,
+            "result": None,
+            "error": None,
+            "cancel_requested": False,
+            "owner": None,
+            "created_at": datetime.utcnow(),
+            "started_at": None,
+            "finished_at": None,
+            "heartbeat_at": None,
+        }
+        await self.collection.insert_one(dict(job))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def submit_once(self, kind: str, params: Optional[dict] = None) -> dict:
+        """The queued or running job of this kind, or a new one
+
+        Two processes asking at the same moment may both submit; handlers
+        used this way must tolerate running twice.
+        """
+        job = await self.collection.find_one(
+            {"kind": kind, "status": {"$in": ["queued", "running"]}}, {"_id": 0}
+        ) if self.collection is not None else None
+        return job if job is not None else await self.submit(kind, params)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"id": job_id}, {"_id": 0})
+
+    async def recent(self, status: Optional[str] = None, limit: int = 50) -> List[dict]:
+        query = {"status": status} if status else {}
+        return await self.collection.find(query, {"_id": 0}).sort("created_at", -1).to_list(limit)
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        """Cancel a queued job outright, or ask a running one to stop"""
+        now = datetime.utcnow()
+        job = await self.collection.find_one_and_update(
+            {"id": job_id, "status": "queued"},
+            {"$set": {"status": "cancelled", "cancel_requested": True, "finished_at": now}},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+        )
+        if job is not None:
+            return job
+        job = await self.collection.find_one_and_update(
+            {"id": job_id, "status": "running"},
+            {"$set": {"cancel_requested": True}},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+        )
+        if job is not None and job_id in self._running:
+            self._running[job_id].cancel_requested = True
+        return job if job is not None else await self.get(job_id)
+
+    async def _lock(self, group: str, job_id: str) -> bool:
+        """Take group's lease for job_id; False while another job holds it"""
+        now = datetime.utcnow()
+        try:
+            # The upsert inserts a free group's document; a held one makes
+            # the filter miss and the insert collide with its _id
+            await self.locks.find_one_and_update(
+                {"_id": group, "expires_at": {"$lt": now}},
+                {"$set": {"job_id": job_id, "owner": self.owner,
+                          "expires_at": now + timedelta(seconds=self.stale_after)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def _unlock(self, group: str, job_id: str):
+        await self.locks.delete_one({"_id": group, "job_id": job_id})
+
+    async def _claim(self) -> Optional[dict]:
+        queued = await self.collection.find(
+            {"status": "queued", "kind": {"$in": list(self._kinds)}}, {"_id": 0, "id": 1, "group": 1}
+        ).sort("created_at", 1).to_list(100)
+        tried = set()
+        for candidate in queued:
+            # Only the oldest queued job of a group may start
+            if candidate["group"] in tried:
+                continue
+            tried.add(candidate["group"])
+            if not await self._lock(candidate["group"], candidate["id"]):
+                continue
+            now = datetime.utcnow()
+            job = await self.collection.find_one_and_update(
+                {"id": candidate["id"], "status": "queued"},
+                {"$set": {"status": "running", "owner": self.owner, "started_at": now, "heartbeat_at": now}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if job is not None:
+                return job
+            # Cancelled or claimed since the find
+            await self._unlock(candidate["group"], candidate["id"])
+        return None
+
+    async def _reap(self):
+        # Running jobs whose worker stopped sending heartbeats are failed so
+        # their group is not blocked forever
+        if time.monotonic() - self._reaped_at < self.stale_after / 2:
+            return
+        self._reaped_at = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        result = await self.collection.update_many(
+            {"status": "running", "heartbeat_at": {"$lt": cutoff}},
+            {"$set": {"status": "failed", "error": "Worker stopped responding", "finished_at": datetime.utcnow()}},
+        )
+        if result.modified_count:
+            logger.warning("Marked %d stale jobs as failed", result.modified_count)
+
+    async def _worker(self):
+        while True:
+            try:
+                self._wakeup.clear()
+                await self._reap()
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job queue poll failed")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+            # Finishing a job may unblock queued jobs in its group
+            self._wakeup.set()
+
+    async def _heartbeat(self, context: JobContext, group: str):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = datetime.utcnow()
+            job = await self.collection.find_one_and_update(
+                {"id": context.job_id}, {"$set": {"heartbeat_at": now}},
+                projection={"cancel_requested": 1},
+            )
+            await self.locks.update_one(
+                {"_id": group, "job_id": context.job_id},
+                {"$set": {"expires_at": now + timedelta(seconds=self.stale_after)}},
+            )
+            if job and job.get("cancel_requested"):
+                context.cancel_requested = True
+
+    async def _finish(self, job_id: str, status: str, **fields):
+        fields.update(status=status, finished_at=datetime.utcnow())
+        await self.collection.update_one({"id": job_id}, {"$set": fields})
+
+    async def _run(self, job: dict):
+        context = JobContext(self, job["id"])
+        context.cancel_requested = job.get("cancel_requested", False)
+        self._running[job["id"]] = context
+        heartbeat = asyncio.get_running_loop().create_task(self._heartbeat(context, job["group"]))
+        started = time.perf_counter()
+        try:
+            result = await self._kinds[job["kind"]].handler(context, **job["params"])
+        except JobCancelled:
+            await self._finish(job["id"], "cancelled")
+        except asyncio.CancelledError:
+            await asyncio.shield(self._finish(job["id"], "failed", error="Interrupted by shutdown"))
+            raise
+        except Exception as exc:
+            logger.exception("Job %s (%s) failed", job["id"], job["kind"])
+            await self._finish(job["id"], "failed", error=str(exc) or type(exc).__name__)
+        else:
+            await self._finish(job["id"], "succeeded", result=result)
+            logger.info("Job %s (%s) finished in %.2fs", job["id"], job["kind"], time.perf_counter() - started)
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job["id"], None)
+            await asyncio.shield(self._unlock(job["group"], job["id"]))
@@ -0,0 +1,385 @@
+"""Minimal Prometheus-style metrics with text exposition"""
+import abc
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from tracing import span
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values: str):
+        """Child series for one combination of label values"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """A fresh series for one combination of label values"""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self, name, labelnames, values) -> List[str]:
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self, name, labelnames, values) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + [float("inf")], self.counts):
+            cumulative += count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry: Optional["Registry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    @contextmanager
+    def time(self, *labelvalues: str):
+        """Observe the duration of the with-block"""
+        child = self.labels(*labelvalues)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            child.observe(time.perf_counter() - start)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served")
+HTTP_RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "HTTP response body size by route", ("method", "route"), buckets=SIZE_BUCKETS)
+MONGO_LATENCY = Histogram(
+    "mongo_operation_duration_seconds", "MongoDB operation latency", ("collection", "operation"))
+MONGO_ERRORS = Counter(
+    "mongo_operation_errors_total", "MongoDB operations that raised", ("collection", "operation"))
+BREED_VALIDATIONS = Counter(
+    "breed_validations_total", "DogBreed models validated from documents")
+BREED_VALIDATIONS_PER_REQUEST = Histogram(
+    "breed_validations_per_request", "DogBreed models validated per HTTP request", ("route",), buckets=COUNT_BUCKETS)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "In-process cache lookups by result", ("cache", "result"))
+REBUILD_DURATION = Histogram(
+    "catalog_rebuild_duration_seconds", "Derived structure rebuild time by stage and where it ran", ("stage", "mode"))
+CATALOG_OVERLAY_BREEDS = Gauge(
+    "catalog_overlay_breeds", "Breeds written since the search structures were last rebuilt")
+RATE_LIMITED = Counter(
+    "rate_limited_requests_total", "Requests rejected with 429 by route class and reason", ("route_class", "reason"))
+CHANGE_EVENTS = Counter(
+    "catalog_change_events_total", "Catalog changes fanned out to subscribers, by operation", ("op",))
+CHANGE_SUBSCRIBERS = Gauge(
+    "catalog_change_subscribers", "Clients streaming catalog changes from this process")
+CHANGE_SUBSCRIBERS_DROPPED = Counter(
+    "catalog_change_subscribers_dropped_total", "Change streams closed because the client fell too far behind")
+ROUTE_CACHE_ENTRIES = Gauge(
+    "route_cache_entries", "Cached handler results held per route", ("route",))
+ROUTE_CACHE_EVICTIONS = Counter(
+    "route_cache_evictions_total", "Cached handler results evicted to make room, per route", ("route",))
+PARTITIONS_LOADED = Gauge(
+    "catalog_partitions_loaded", "Registry and locale partitions with structures in memory")
+WARMUP_STAGE_DURATION = Gauge(
+    "warmup_stage_seconds", "Time each startup warmup stage took", ("stage",))
+TIME_TO_READY = Gauge(
+    "time_to_ready_seconds", "Time from startup until this worker reported ready")
+MONGO_CIRCUIT_OPEN = Gauge(
+    "mongo_circuit_open", "1 while the MongoDB circuit breaker is open or half-open")
+MONGO_CIRCUIT_REJECTED = Counter(
+    "mongo_circuit_rejected_total", "MongoDB operations failed fast by the open circuit breaker")
+STALE_RESPONSES = Counter(
+    "stale_responses_total", "Reads served from last-known-good data while MongoDB was unavailable", ("source",))
+
+# Per-request tally of validated breeds; a list so awaited helpers can add to it
+_validations: ContextVar[Optional[List[int]]] = ContextVar("breed_validations", default=None)
+
+
+@contextmanager
+def mongo_timer(collection: str, operation: str):
+    """Time one MongoDB operation, as a metric and as a db-stage span"""
+    start = time.perf_counter()
+    try:
+        with span(f"mongo.{operation}", stage="db", **{"db.system": "mongodb", "db.collection": collection}):
+            yield
+    except Exception:
+        MONGO_ERRORS.labels(collection, operation).inc()
+        raise
+    finally:
+        MONGO_LATENCY.labels(collection, operation).observe(time.perf_counter() - start)
+
+
+# Collection methods that return awaitables and are timed individually;
+# find() is timed when its cursor is materialized.
+TIMED_OPERATIONS = frozenset({
+    "find_one", "insert_one", "insert_many", "replace_one", "update_one",
+    "update_many", "delete_one", "delete_many", "find_one_and_delete",
+    "find_one_and_replace", "find_one_and_update", "bulk_write",
+    "count_documents", "create_index", "distinct",
+})
+
+
+async def _guarded(guard, operation: str, call):
+    if guard is None:
+        return await call()
+    return await guard.run(operation, call)
+
+
+class _TimedCursor:
+    def __init__(self, cursor, collection: str, guard=None):
+        self._cursor = cursor
+        self._collection = collection
+        self._guard = guard
+
+    async def to_list(self, length):
+        with mongo_timer(self._collection, "find"):
+            return await _guarded(self._guard, "find", lambda: self._cursor.to_list(length))
+
+    def __getattr__(self, name):
+        value = getattr(self._cursor, name)
+        if not callable(value):
+            return value
+
+        def chained(*args, **kwargs):
+            result = value(*args, **kwargs)
+            return self if result is self._cursor else result
+        return chained
+
+
+class TimedCollection:
+    """Collection proxy feeding mongo_operation_duration_seconds
+
+    With a guard, timed operations also run through guard.run, which
+    bounds them with timeouts and a circuit breaker; see resilience.py.
+    """
+
+    def __init__(self, collection, guard=None):
+        self._collection = collection
+        self._name = collection.name
+        self._guard = guard
+
+    def find(self, *args, **kwargs):
+        return _TimedCursor(self._collection.find(*args, **kwargs), self._name, self._guard)
+
+    def __getattr__(self, name):
+        value = getattr(self._collection, name)
+        if name not in TIMED_OPERATIONS:
+            return value
+
+        async def timed(*args, **kwargs):
+            with mongo_timer(self._name, name):
+                return await _guarded(self._guard, name, lambda: value(*args, **kwargs))
+        return timed
+
+
+class TimedDatabase:
+    """Database proxy whose collections are TimedCollections"""
+
+    def __init__(self, database, guard=None):
+        self._database = database
+        self._guard = guard
+        self._collections: Dict[str, TimedCollection] = {}
+
+    def __getitem__(self, name: str) -> TimedCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = TimedCollection(self._database[name], self._guard)
+        return collection
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        value = getattr(self._database, name)
+        if hasattr(value, "insert_one"):
+            return self[name]
+        return value
+
+
+def record_validations(count: int):
+    BREED_VALIDATIONS.inc(count)
+    tally = _validations.get()
+    if tally is not None:
+        tally[0] += count
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency, status and payload size"""
+
+    def __init__(self, app, skip_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        size = 0
+        tally = [0]
+        token = _validations.set(tally)
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            _validations.reset(token)
+            # Label by route template, not raw path, to keep cardinality bounded
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_REQUESTS.labels(method, template, str(status)).inc()
+            HTTP_LATENCY.labels(method, template).observe(elapsed)
+            HTTP_RESPONSE_SIZE.labels(method, template).observe(size)
+            BREED_VALIDATIONS_PER_REQUEST.labels(template).observe(tally[0])
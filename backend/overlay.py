@@ -0,0 +1,237 @@
+"""Single-breed writes layered over the search structures
+
+The search structures (suggest trie, fuzzy index, condition index,
+catalog store) are immutable flat columns so that snapshots can share
+them between processes, and rebuilding one reads the whole catalog. A
+single breed write goes into an overlay instead: the breeds written
+since the structures were built, and structures built from just those.
+Thin wrappers read like the base structures, hiding the base entries
+of written breeds and merging in the overlay's, so a write costs work
+in proportion to the overlay rather than the catalog.
+
+Suggestion counts for temperaments, origins and groups are the base
+ones until the next full rebuild, which folds the overlay in. The
+server runs that rebuild delay seconds after a write, or straight away
+once limit breeds have been written.
+"""
+import heapq
+import itertools
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from catalog_store import CatalogStore
+from conditions import Condition, ConditionIndex, condition_ids
+from metrics import CATALOG_OVERLAY_BREEDS
+from search_index import FuzzyIndex, FuzzyMatch, SuggestIndex, Suggestion
+
+
+class OverlayCatalog:
+    """A catalog store with written breeds replaced
+
+    Rows below len(base) are the base store's, hidden for written
+    breeds; the patch store's rows follow them.
+    """
+
+    def __init__(self, base: CatalogStore, written: Set[str], patch: CatalogStore):
+        self.base = base
+        self.patch = patch
+        self._written = written
+        self._hidden = sorted(row for row in map(base.index, written) if row is not None)
+        self._hidden_rows = set(self._hidden)
+        self._offset = len(base)
+
+    def __len__(self) -> int:
+        return self._offset - len(self._hidden) + len(self.patch)
+
+    def __contains__(self, breed_id: str) -> bool:
+        return self.index(breed_id) is not None
+
+    def rows(self) -> Iterable[int]:
+        starts = [0] + [row + 1 for row in self._hidden]
+        stops = self._hidden + [self._offset]
+        spans = [range(start, stop) for start, stop in zip(starts, stops)]
+        spans.append(range(self._offset, self._offset + len(self.patch)))
+        return itertools.chain.from_iterable(spans)
+
+    def index(self, breed_id: str) -> Optional[int]:
+        if breed_id not in self._written:
+            return self.base.index(breed_id)
+        row = self.patch.index(breed_id)
+        return None if row is None else self._offset + row
+
+    def value(self, row: int, field: str) -> Any:
+        if row < self._offset:
+            return self.base.value(row, field)
+        return self.patch.value(row - self._offset, field)
+
+    def tags(self, row: int, field: str) -> List[Any]:
+        if row < self._offset:
+            return self.base.tags(row, field)
+        return self.patch.tags(row - self._offset, field)
+
+    def record(self, row: int) -> dict:
+        if row < self._offset:
+            return self.base.record(row)
+        return self.patch.record(row - self._offset)
+
+    def records(self, rows: Iterable[int]) -> List[dict]:
+        return [self.record(row) for row in rows]
+
+    def get(self, breed_id: str) -> Optional[dict]:
+        row = self.index(breed_id)
+        return None if row is None else self.record(row)
+
+    def rows_where(self, field: str, value: Any) -> List[int]:
+        rows = [row for row in self.base.rows_where(field, value) if row not in self._hidden_rows]
+        rows.extend(self._offset + row for row in self.patch.rows_where(field, value))
+        return rows
+
+    def facet_counts(self, field: str) -> Dict[Any, int]:
+        counts = self.base.facet_counts(field)
+        for row in self._hidden:
+            for value in set(self.base.tags(row, field)):
+                counts[value] -= 1
+        for value, count in self.patch.facet_counts(field).items():
+            counts[value] = counts.get(value, 0) + count
+        return {value: count for value, count in counts.items() if count > 0}
+
+    @property
+    def nbytes(self) -> int:
+        return self.base.nbytes + self.patch.nbytes
+
+
+class OverlayFuzzy:
+    """A fuzzy index with written breeds' terms replaced"""
+
+    def __init__(self, base: FuzzyIndex, written: Set[str], patch: FuzzyIndex):
+        self.base = base
+        self.patch = patch
+        self._written = written
+
+    def search(self, query: str, max_distance: int = 2, limit: int = 50) -> List[FuzzyMatch]:
+        # Asks the base for enough to make up for the matches it hides
+        matches = [
+            match for match in self.base.search(query, max_distance, limit + len(self._written))
+            if match.breed_id not in self._written
+        ]
+        matches.extend(self.patch.search(query, max_distance, limit))
+        return sorted(matches, key=lambda m: (-m.score, m.term))[:limit]
+
+
+class OverlaySuggest:
+    """A suggest index with written breeds' names replaced"""
+
+    def __init__(self, base: SuggestIndex, written: Set[str], patch: SuggestIndex):
+        self.base = base
+        self.patch = patch
+        self._written = written
+
+    def suggest(self, query: str, limit: int = 10, max_distance: int = 2) -> List[Tuple[Suggestion, int]]:
+        base = [
+            (suggestion, distance)
+            for suggestion, distance in self.base.suggest(query, limit + len(self._written), max_distance)
+            if suggestion.breed_id not in self._written
+        ]
+        # The patch's other suggestions would count only the written breeds
+        patch = [
+            (suggestion, distance)
+            for suggestion, distance in self.patch.suggest(query, limit, max_distance)
+            if suggestion.kind == "breed"
+        ]
+        # Keeps each side's ranking, closest and best scored first between them
+        merged = heapq.merge(base, patch, key=lambda item: (item[1], -item[0].score))
+        return list(itertools.islice(merged, limit))
+
+
+class OverlayConditions:
+    """A condition index with written breeds' conditions recounted"""
+
+    def __init__(self, base: ConditionIndex, written: Set[str], touched: Set[str], patch: ConditionIndex):
+        conditions = {condition.id: condition for condition in base.ranked()}
+        for cid in touched:
+            before, after = base.get(cid), patch.get(cid)
+            breed_ids = [breed_id for breed_id in (before.breed_ids if before else ()) if breed_id not in written]
+            breed_ids.extend(after.breed_ids if after else ())
+            if not breed_ids:
+                conditions.pop(cid, None)
+                continue
+            entity = before or after
+            variants = list(entity.variants)
+            variants.extend(v for v in (after.variants if after else ()) if v not in variants)
+            conditions[cid] = Condition(cid, entity.name, variants, breed_ids)
+        self._ranked = sorted(conditions.values(), key=lambda c: (-len(c.breed_ids), c.name))
+        self._conditions = {condition.id: condition for condition in self._ranked}
+
+    def __len__(self) -> int:
+        return len(self._conditions)
+
+    def get(self, cid: str) -> Optional[Condition]:
+        return self._conditions.get(cid)
+
+    def ranked(self) -> List[Condition]:
+        return self._ranked
+
+
+class CatalogOverlay:
+    """Breeds written since the base search structures were built"""
+
+    def __init__(self, aliases: Optional[Dict[str, List[str]]] = None, limit: int = 256, delay: float = 5.0):
+        self.aliases = aliases or {}
+        self.limit = limit
+        self.delay = delay
+        # ID -> (position, the breed as written or None once deleted)
+        self._breeds: Dict[str, Tuple[int, Optional[dict]]] = {}
+        self.position = 0  # writes so far
+
+    def __len__(self) -> int:
+        return len(self._breeds)
+
+    @property
+    def full(self) -> bool:
+        return len(self._breeds) >= self.limit
+
+    def write(self, breed_id: str, breed: Optional[dict]):
+        """Layer a breed as stored in MongoDB (None once deleted) over the base"""
+        self.position += 1
+        self._breeds[breed_id] = (self.position, breed)
+        CATALOG_OVERLAY_BREEDS.set(len(self._breeds))
+
+    def fold(self, position: int):
+        """Forget writes up to position; a rebuild that read the catalog after them has them
+
+        Later ones stay even if the rebuild happened to read them too:
+        layering a breed over itself changes nothing.
+        """
+        for breed_id in [breed_id for breed_id, (written, _) in self._breeds.items() if written <= position]:
+            del self._breeds[breed_id]
+        CATALOG_OVERLAY_BREEDS.set(len(self._breeds))
+
+    def layer(self, base: Dict[str, Any]) -> Dict[str, Any]:
+        """Structures that read as base with the overlay's writes applied"""
+        if not self._breeds:
+            return dict(base)
+        written = set(self._breeds)
+        breeds = [breed for _, breed in self._breeds.values() if breed is not None]
+        conditions = ConditionIndex.build(breeds)
+        touched = {condition.id for condition in conditions.ranked()}
+        for breed_id in written:
+            before = base["catalog"].get(breed_id)
+            if before is not None:
+                touched.update(condition_ids(before.get("health_issues") or ()))
+        return {
+            "suggest": OverlaySuggest(base["suggest"], written, SuggestIndex.build(breeds)),
+            "fuzzy": OverlayFuzzy(base["fuzzy"], written, FuzzyIndex.build(breeds, self.aliases)),
+            "conditions": OverlayConditions(base["conditions"], written, touched, conditions),
+            "catalog": OverlayCatalog(base["catalog"], written, CatalogStore.build(breeds)),
+        }
+
+
+def overlay_from_env(aliases: Optional[Dict[str, List[str]]] = None) -> CatalogOverlay:
+    """CATALOG_OVERLAY_LIMIT (breeds written before the search structures
+    are rebuilt), CATALOG_OVERLAY_DELAY (seconds after a write before
+    they are rebuilt anyway)"""
+    return CatalogOverlay(
+        aliases,
+        limit=int(os.environ.get("CATALOG_OVERLAY_LIMIT", "256")),
+        delay=float(os.environ.get("CATALOG_OVERLAY_DELAY", "5")),
+    )
@@ -0,0 +1,234 @@
+"""Catalog partitions by breed registry and locale
+
+The default partition (registry "default", locale "en") is the main
+catalog in dog_breeds, with its change feed, revisions and snapshots.
+Every other partition is a collection of its own,
+dog_breeds.<registry>.<locale>, with its own indexes: a registry's breed
+list (its groups and standards differ from another's), or a translation
+of one with localized names, temperaments and descriptions. Translated
+breeds keep the IDs they have in the registry's default-locale
+partition, so a client can switch language without losing its place.
+
+Partitions are listed in the catalog_partitions collection, with a
+version bumped on every write. Their in-memory structures (catalog
+store, search and condition indexes, rollups) are built on first use and
+the least recently used are dropped beyond max_loaded, so twenty locales
+cost memory only while someone is reading them.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from metrics import PARTITIONS_LOADED, record_cache
+from resilience import MongoUnavailable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGISTRY = "default"
+DEFAULT_LOCALE = "en"
+
+_REGISTRY = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+_LOCALE = re.compile(r"^[a-z]{2,3}(-[a-z0-9]{2,8})*$")
+
+
+class PartitionKey(NamedTuple):
+    registry: str
+    locale: str
+
+    @property
+    def id(self) -> str:
+        return f"{self.registry}/{self.locale}"
+
+    @property
+    def is_default(self) -> bool:
+        return self == DEFAULT_PARTITION
+
+    @property
+    def collection_name(self) -> str:
+        return "dog_breeds" if self.is_default else f"dog_breeds.{self.registry}.{self.locale}"
+
+
+DEFAULT_PARTITION = PartitionKey(DEFAULT_REGISTRY, DEFAULT_LOCALE)
+
+
+def normalize_locale(locale: str) -> str:
+    return locale.strip().lower().replace("_", "-")
+
+
+def partition_key(registry: str, locale: str) -> PartitionKey:
+    """Validated key for a registry and locale ("pt_BR" becomes "pt-br")"""
+    registry, locale = registry.strip().lower(), normalize_locale(locale)
+    if not _REGISTRY.match(registry):
+        raise ValueError(f"invalid registry {registry!r}")
+    if not _LOCALE.match(locale):
+        raise ValueError(f"invalid locale {locale!r}, expected e.g. 'fr' or 'pt-br'")
+    return PartitionKey(registry, locale)
+
+
+def accepted_locales(header: Optional[str]) -> List[str]:
+    """Locales from an Accept-Language header, most preferred first
+
+    Each region-specific tag is followed by its language ("fr-ch" by
+    "fr"); wildcards and malformed tags are skipped.
+    """
+    weighted = []
+    for position, part in enumerate((header or "").split(",")):
+        tag, _, params = part.partition(";")
+        tag = normalize_locale(tag)
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        if quality > 0 and _LOCALE.match(tag):
+            weighted.append((-quality, position, tag))
+    locales = []
+    for _, _, tag in sorted(weighted):
+        for locale in (tag, tag.split("-")[0]):
+            if locale not in locales:
+                locales.append(locale)
+    return locales
+
+
+class _Loaded(NamedTuple):
+    version: int
+    structures: dict
+
+
+class PartitionCache:
+    """Partitions known to the catalog and the structures of recently used ones
+
+    build(collection) reads a partition's breeds and returns its derived
+    structures. Other processes' writes are noticed when the list of
+    partitions is next refreshed, at most refresh_interval seconds later.
+    """
+
+    def __init__(self, build: Callable[..., Awaitable[dict]], max_loaded: int = 4, refresh_interval: float = 30.0):
+        self.build = build
+        self.max_loaded = max_loaded
+        self.refresh_interval = refresh_interval
+        self.database = None
+        self._known: Dict[PartitionKey, dict] = {}
+        self._refreshed_at: Optional[float] = None
+        self._loaded: "OrderedDict[PartitionKey, _Loaded]" = OrderedDict()
+        self._building: Dict[Tuple[PartitionKey, int], asyncio.Future] = {}
+
+    def attach(self, database):
+        """Read partitions from database"""
+        self.database = database
+        self._refreshed_at = None
+
+    def collection(self, key: PartitionKey):
+        return self.database[key.collection_name]
+
+    async def ensure_indexes(self, key: PartitionKey):
+        collection = self.collection(key)
+        await collection.create_index("id", unique=True)
+        await collection.create_index("name")
+        await collection.create_index("health_conditions")
+
+    async def known(self) -> Dict[PartitionKey, dict]:
+        """Every partition but the default one, with its version and breed count"""
+        now = time.monotonic()
+        if self._refreshed_at is None or now - self._refreshed_at >= self.refresh_interval:
+            try:
+                documents = await self.database.catalog_partitions.find().to_list(None)
+            except MongoUnavailable:
+                # Keep routing by the last list read; the default partition needs none
+                return self._known
+            self._known = {PartitionKey(doc["registry"], doc["locale"]): doc for doc in documents}
+            self._refreshed_at = now
+        return self._known
+
+    async def resolve(self, registry: str, locales: List[str]) -> Optional[PartitionKey]:
+        """The partition of registry best matching locales, in order of preference
+
+        Falls back to the registry's default locale, then to any locale it
+        has; None if the registry has no partitions at all.
+        """
+        known = await self.known()
+        available = {key.locale for key in known if key.registry == registry}
+        if registry == DEFAULT_REGISTRY:
+            available.add(DEFAULT_LOCALE)
+        for locale in list(locales) + [DEFAULT_LOCALE] + sorted(available):
+            if locale in available:
+                return PartitionKey(registry, locale)
+        return None
+
+    async def structures(self, key: PartitionKey) -> dict:
+        """The partition's derived structures, built now if they aren't loaded"""
+        info = (await self.known()).get(key)
+        version = info["version"] if info else 0
+        loaded = self._loaded.get(key)
+        record_cache("partition", loaded is not None and loaded.version == version)
+        if loaded is not None and loaded.version == version:
+            self._loaded.move_to_end(key)
+            return loaded.structures
+        # Concurrent requests for a cold partition share one build
+        building = self._building.get((key, version))
+        if building is None:
+            building = self._building[(key, version)] = asyncio.ensure_future(self._load(key, version))
+            building.add_done_callback(lambda _: self._building.pop((key, version), None))
+        return await asyncio.shield(building)
+
+    async def _load(self, key: PartitionKey, version: int) -> dict:
+        started = time.perf_counter()
+        structures = await self.build(self.collection(key))
+        current = self._loaded.get(key)
+        # A build that raced a newer one doesn't replace it
+        if current is None or current.version <= version:
+            self._loaded[key] = _Loaded(version, structures)
+            self._loaded.move_to_end(key)
+            while len(self._loaded) > self.max_loaded:
+                evicted, _ = self._loaded.popitem(last=False)
+                logger.info("Unloaded catalog partition %s", evicted.id)
+            PARTITIONS_LOADED.set(len(self._loaded))
+        logger.info("Loaded catalog partition %s in %.2fs", key.id, time.perf_counter() - started)
+        return structures
+
+    def version(self, key: PartitionKey) -> int:
+        """The partition's version as of the last refresh; 0 if it has none"""
+        info = self._known.get(key)
+        return info["version"] if info else 0
+
+    def is_loaded(self, key: PartitionKey) -> bool:
+        return key in self._loaded
+
+    async def register(self, key: PartitionKey, count: int) -> dict:
+        """Record a write to a partition; every process rebuilds it on next use"""
+        document = await self.database.catalog_partitions.find_one_and_update(
+            {"_id": key.id},
+            {"$set": {"registry": key.registry, "locale": key.locale, "count": count, "updated_at": datetime.utcnow()},
+             "$inc": {"version": 1}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        self._known[key] = document
+        return document
+
+    async def drop(self, key: PartitionKey) -> bool:
+        """Delete a partition and its collection; False if there was none"""
+        result = await self.database.catalog_partitions.delete_one({"_id": key.id})
+        await self.collection(key).drop()
+        self._known.pop(key, None)
+        if self._loaded.pop(key, None) is not None:
+            PARTITIONS_LOADED.set(len(self._loaded))
+        return result.deleted_count > 0
+
+
+def partitions_from_env(build: Callable[..., Awaitable[dict]]) -> PartitionCache:
+    """CATALOG_PARTITIONS_LOADED (partitions kept in memory at once) and
+    CATALOG_PARTITIONS_REFRESH (seconds between checks for other processes'
+    partition writes)"""
+    return PartitionCache(
+        build,
+        max_loaded=int(os.environ.get("CATALOG_PARTITIONS_LOADED", "4")),
+        refresh_interval=float(os.environ.get("CATALOG_PARTITIONS_REFRESH", "30")),
+    )
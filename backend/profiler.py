@@ -0,0 +1,185 @@
+"""Statistical sampling profiler producing collapsed (flamegraph) stacks
+
+A background thread periodically captures the event loop thread's
+Python stack. In "wall" mode it also walks the await chain of every
+pending asyncio task, so time spent suspended (waiting on Mongo, say)
+shows up too. Output is the collapsed-stack format read by
+flamegraph.pl, speedscope and inferno.
+"""
+import asyncio
+import hmac
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import List, Optional
+
+MAX_DEPTH = 128
+
+
+def _label(code) -> str:
+    filename = os.path.basename(code.co_filename)
+    # ';' separates frames in the collapsed format
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+def frame_stack(frame) -> List[str]:
+    """Root-first labels for a thread's frame chain"""
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        stack.append(_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def coroutine_stack(coro) -> List[str]:
+    """Outermost-first labels for a suspended coroutine's await chain"""
+    stack = []
+    while coro is not None and len(stack) < MAX_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        stack.append(_label(frame.f_code))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return stack
+
+
+def _running_task(loop):
+    # asyncio keeps the task currently stepping on each loop here; it is
+    # the only way to see it from another thread.
+    current_tasks = getattr(asyncio.tasks, "_current_tasks", None)
+    return current_tasks.get(loop) if current_tasks is not None else None
+
+
+class SamplingProfiler:
+    """Samples one thread (and optionally its loop's tasks) until stopped"""
+
+    def __init__(self, interval: float = 0.005, mode: str = "cpu",
+                 loop: Optional[asyncio.AbstractEventLoop] = None, task: Optional[asyncio.Task] = None):
+        if mode not in ("cpu", "wall"):
+            raise ValueError("mode must be 'cpu' or 'wall'")
+        self.interval = interval
+        self.mode = mode
+        self.loop = loop
+        self.task = task
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at = 0.0
+        self.duration = 0.0
+
+    def start(self) -> "SamplingProfiler":
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        self.sample_count += 1
+        frame = sys._current_frames().get(self._thread_id)
+        on_cpu = frame is not None and (
+            self.task is None or _running_task(self.loop) is self.task
+        )
+        if on_cpu:
+            self.samples[";".join(frame_stack(frame))] += 1
+        if self.mode != "wall" or self.loop is None:
+            return
+        tasks = [self.task] if self.task is not None else list(asyncio.all_tasks(self.loop))
+        running = _running_task(self.loop)
+        for task in tasks:
+            if task is running or task.done():
+                continue
+            stack = coroutine_stack(task.get_coro())
+            if stack:
+                self.samples[";".join([f"[task {task.get_name()}]"] + stack + ["[suspended]"])] += 1
+
+    def collapsed(self) -> str:
+        """One "frame;frame;frame count" line per distinct stack"""
+        lines = [f"{stack} {count}" for stack, count in self.samples.most_common()]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+
+class ProfileStore:
+    """Most recent per-request profiles, retrievable by ID"""
+
+    def __init__(self, capacity: int = 50):
+        self.capacity = capacity
+        self._profiles: "OrderedDict[str, str]" = OrderedDict()
+        self._ids = itertools.count(1)
+
+    def add(self, collapsed: str) -> str:
+        profile_id = f"{os.getpid()}-{next(self._ids)}"
+        self._profiles[profile_id] = collapsed
+        while len(self._profiles) > self.capacity:
+            self._profiles.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id: str) -> Optional[str]:
+        return self._profiles.get(profile_id)
+
+
+class RequestProfilerMiddleware:
+    """Profiles a single request when it carries X-Profile and a valid admin token
+
+    The response gets an X-Profile-Id header; the collapsed stacks are kept
+    in the store for retrieval through the admin API.
+    """
+
+    def __init__(self, app, admin_token: Optional[str], store: ProfileStore,
+                 interval: float = 0.001, mode: str = "wall"):
+        self.app = app
+        self.admin_token = admin_token
+        self.store = store
+        self.interval = interval
+        self.mode = mode
+
+    def _requested(self, scope) -> bool:
+        if not self.admin_token:
+            return False
+        headers = dict(scope.get("headers", ()))
+        token = headers.get(b"x-admin-token", b"").decode("latin-1")
+        return headers.get(b"x-profile") in (b"1", b"true") and hmac.compare_digest(token, self.admin_token)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = SamplingProfiler(
+            self.interval, self.mode, asyncio.get_running_loop(), asyncio.current_task()
+        ).start()
+        stopped = False
+
+        async def send_wrapper(message):
+            nonlocal stopped
+            if message["type"] == "http.response.start" and not stopped:
+                stopped = True
+                profiler.stop()
+                profile_id = self.store.add(profiler.collapsed())
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile_id.encode()))
+                headers.append((b"x-profile-samples", str(profiler.sample_count).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not stopped:
+                profiler.stop()
@@ -0,0 +1,373 @@
+"""Selective queries: one request for a breed and everything shown with it
+
+A query is a JSON list of selections. A selection is a field name, or an
+object mapping one field name to its arguments plus the "fields" to
+select from what it returns:
+
+    [{"breed": {"id": "...", "fields": [
+        "name", "size",
+        {"similar": {"limit": 5, "fields": ["id", "name", "image_url"]}},
+        {"conditions": {"fields": ["id", "name", "breed_count"]}},
+        {"group_stats": {"fields": ["count", "lifespan_years"]}}
+    ]}}]
+
+A field may be given as "alias:field" to select it twice with different
+arguments. Only selected fields are resolved and returned.
+
+Breeds are fetched through a per-request BreedLoader: lookups queued in
+the same pass of the event loop share one fetch, served from the catalog
+store with one MongoDB $in query for the rest. The number of fetches
+grows with the depth of the query, not with the breeds in it.
+Conditions and group stats come from the shared condition index and
+rollups.
+
+Before anything runs, the query's cost is computed: each object resolved
+counts 1, multiplied by the most a list field can return (its limit).
+Queries over the cost or depth limits are rejected without being run.
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from catalog_store import FIELDS, TAG_FIELDS, CatalogStore
+from conditions import ConditionIndex, condition_ids
+from stats import DIMENSIONS, BreedRollups
+
+
+class QueryError(ValueError):
+    """The query is malformed or over its limits; nothing was resolved"""
+
+
+class Selection(NamedTuple):
+    alias: str
+    field: "Field"
+    args: Dict[str, Any]
+    fields: List["Selection"]
+
+
+class Arg(NamedTuple):
+    kind: type
+    default: Any = None
+    maximum: Optional[int] = None  # ints, and the length of lists
+    choices: Optional[Sequence[str]] = None
+
+
+class Field(NamedTuple):
+    name: str
+    resolve: Optional[Callable[..., Awaitable[Any]]] = None  # None: read parent[name]
+    type: Optional[str] = None  # object type name; None for scalars
+    many: bool = False
+    args: Dict[str, Arg] = {}
+
+
+class QueryContext:
+    """What resolvers read, shared across one request"""
+
+    def __init__(self, store: CatalogStore, conditions: ConditionIndex, rollups: BreedRollups,
+                 fetch_breeds: Callable[[List[str]], Awaitable[List[dict]]]):
+        self.store = store
+        self.conditions = conditions
+        self.rollups = rollups
+        self.breeds = BreedLoader(fetch_breeds)
+
+
+class BreedLoader:
+    """Breed documents by ID, batched and cached for one request
+
+    load() only queues the ID; the batch is fetched once the resolvers
+    already scheduled have run and queued theirs.
+    """
+
+    def __init__(self, fetch: Callable[[List[str]], Awaitable[List[dict]]]):
+        self._fetch = fetch
+        self._cache: Dict[str, asyncio.Future] = {}
+        self._pending: List[str] = []
+        self.batches = 0
+
+    def load(self, breed_id: str) -> asyncio.Future:
+        future = self._cache.get(breed_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._cache[breed_id] = loop.create_future()
+            if not self._pending:
+                loop.call_soon(lambda: asyncio.ensure_future(self._dispatch()))
+            self._pending.append(breed_id)
+        return future
+
+    async def load_many(self, breed_ids: Iterable[str]) -> List[dict]:
+        """Found breeds, in the order asked for; unknown IDs are left out"""
+        breeds = await asyncio.gather(*(self.load(breed_id) for breed_id in breed_ids))
+        return [breed for breed in breeds if breed is not None]
+
+    async def _dispatch(self):
+        breed_ids, self._pending = self._pending, []
+        self.batches += 1
+        try:
+            found = {breed["id"]: breed for breed in await self._fetch(breed_ids)}
+        except Exception as exc:
+            for breed_id in breed_ids:
+                self._cache.pop(breed_id).set_exception(exc)
+            return
+        for breed_id in breed_ids:
+            self._cache[breed_id].set_result(found.get(breed_id))
+
+
+def similar_rows(store: CatalogStore, breed: dict, limit: int) -> List[int]:
+    """Rows of the breeds most like breed: same group, same size, shared temperament"""
+    scores: Dict[int, int] = {}
+    for field, weight in (("breed_group", 3), ("size", 2)):
+        for row in store.rows_where(field, breed.get(field)):
+            scores[row] = scores.get(row, 0) + weight
+    own = store.index(breed["id"])
+    if own is not None:
+        tags = store.tags(own, "temperament")
+    else:
+        tags = (breed.get("temperament") or "").split(TAG_FIELDS["temperament"])
+    for tag in tags:
+        for row in store.rows_where("temperament", tag):
+            scores[row] = scores.get(row, 0) + 1
+    scores.pop(own, None)
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], store.value(item[0], "name")))
+    return [row for row, _ in ranked[:limit]]
+
+
+def group_stats(rollups: BreedRollups, dimension: str, key: str) -> Optional[dict]:
+    for group in rollups.summary(dimension)["groups"]:
+        if group["key"] == key:
+            return group
+    return None
+
+
+def condition_entity(condition) -> dict:
+    return {
+        "id": condition.id,
+        "name": condition.name,
+        "variants": condition.variants,
+        "breed_count": len(condition.breed_ids),
+    }
+
+
+async def resolve_breed(parent, args, context: QueryContext):
+    return (await context.breeds.load_many([args["id"]]) or [None])[0]
+
+
+async def resolve_breeds(parent, args, context: QueryContext):
+    if args["ids"] is not None:
+        return await context.breeds.load_many(args["ids"][args["offset"]:args["offset"] + args["limit"]])
+    store = context.store
+    rows: Optional[set] = None
+    for field in ("size", "breed_group", "origin"):
+        if args[field] is not None:
+            matching = set(store.rows_where(field, args[field]))
+            rows = matching if rows is None else rows & matching
+    rows = sorted(store.rows() if rows is None else rows, key=lambda row: store.value(row, "name"))
+    page = rows[args["offset"]:args["offset"] + args["limit"]]
+    return await context.breeds.load_many(store.value(row, "id") for row in page)
+
+
+async def resolve_similar(breed, args, context: QueryContext):
+    store = context.store
+    rows = similar_rows(store, breed, args["limit"])
+    return await context.breeds.load_many(store.value(row, "id") for row in rows)
+
+
+async def resolve_breed_conditions(breed, args, context: QueryContext):
+    found = (context.conditions.get(cid) for cid in condition_ids(breed.get("health_issues")))
+    return [condition_entity(condition) for condition in found if condition is not None][:args["limit"]]
+
+
+async def resolve_group_stats(breed, args, context: QueryContext):
+    return group_stats(context.rollups, "breed_group", breed.get("breed_group"))
+
+
+async def resolve_condition(parent, args, context: QueryContext):
+    condition = context.conditions.get(args["id"])
+    return None if condition is None else condition_entity(condition)
+
+
+async def resolve_conditions(parent, args, context: QueryContext):
+    return [condition_entity(condition) for condition in context.conditions.ranked()[:args["limit"]]]
+
+
+async def resolve_condition_breeds(condition, args, context: QueryContext):
+    breed_ids = context.conditions.get(condition["id"]).breed_ids
+    return await context.breeds.load_many(breed_ids[:args["limit"]])
+
+
+async def resolve_groups(parent, args, context: QueryContext):
+    return context.rollups.summary(args["by"])["groups"][:args["limit"]]
+
+
+def _fields(*fields: Field) -> Dict[str, Field]:
+    return {field.name: field for field in fields}
+
+
+def _limit(default: int, maximum: int) -> Arg:
+    return Arg(int, default, maximum)
+
+
+GROUP_FIELDS = ("key", "count", "lifespan_years", "weight_lbs", "top_health_issues")
+
+SCHEMA: Dict[str, Dict[str, Field]] = {
+    "Query": _fields(
+        Field("breed", resolve_breed, "Breed", args={"id": Arg(str)}),
+        Field("breeds", resolve_breeds, "Breed", many=True, args={
+            "ids": Arg(list, maximum=100), "size": Arg(str), "breed_group": Arg(str), "origin": Arg(str),
+            "limit": _limit(20, 100), "offset": Arg(int, 0),
+        }),
+        Field("condition", resolve_condition, "Condition", args={"id": Arg(str)}),
+        Field("conditions", resolve_conditions, "Condition", many=True, args={"limit": _limit(20, 100)}),
+        Field("groups", resolve_groups, "GroupStats", many=True, args={
+            "by": Arg(str, "breed_group", choices=DIMENSIONS), "limit": _limit(20, 100),
+        }),
+    ),
+    "Breed": _fields(
+        *(Field(name) for name in FIELDS),
+        Field("similar", resolve_similar, "Breed", many=True, args={"limit": _limit(5, 20)}),
+        Field("conditions", resolve_breed_conditions, "Condition", many=True, args={"limit": _limit(10, 50)}),
+        Field("group_stats", resolve_group_stats, "GroupStats"),
+    ),
+    "Condition": _fields(
+        Field("id"), Field("name"), Field("variants"), Field("breed_count"),
+        Field("breeds", resolve_condition_breeds, "Breed", many=True, args={"limit": _limit(10, 100)}),
+    ),
+    "GroupStats": _fields(*(Field(name) for name in GROUP_FIELDS)),
+}
+# Arguments that must be given
+REQUIRED_ARGS = {("Query", "breed", "id"), ("Query", "condition", "id")}
+
+
+_KIND_NAMES = {int: "an integer", str: "a string", list: "a list of strings"}
+
+
+def _arguments(type_name: str, field: Field, given: Dict[str, Any], path: str) -> Dict[str, Any]:
+    unknown = set(given) - set(field.args)
+    if unknown:
+        raise QueryError(f"{path}: unknown argument {sorted(unknown)[0]!r}")
+    args = {}
+    for name, spec in field.args.items():
+        value = given.get(name, spec.default)
+        if value is None:
+            if (type_name, field.name, name) in REQUIRED_ARGS:
+                raise QueryError(f"{path}: argument {name!r} is required")
+            args[name] = None
+            continue
+        # bool is an int subclass, but never a valid limit
+        if not isinstance(value, spec.kind) or isinstance(value, bool):
+            raise QueryError(f"{path}: argument {name!r} must be {_KIND_NAMES[spec.kind]}")
+        if spec.kind is list and not all(isinstance(item, str) for item in value):
+            raise QueryError(f"{path}: argument {name!r} must be a list of strings")
+        if spec.kind is int and (value < 0 or (spec.maximum is not None and value > spec.maximum)):
+            raise QueryError(f"{path}: argument {name!r} must be between 0 and {spec.maximum}")
+        if spec.choices is not None and value not in spec.choices:
+            raise QueryError(f"{path}: argument {name!r} must be one of: {', '.join(spec.choices)}")
+        if spec.kind is list and spec.maximum is not None and len(value) > spec.maximum:
+            raise QueryError(f"{path}: argument {name!r} takes at most {spec.maximum} items")
+        args[name] = value
+    return args
+
+
+def parse(selections: Any, type_name: str = "Query", path: str = "") -> List[Selection]:
+    """Check a selection list against the schema; raises QueryError"""
+    if not isinstance(selections, list) or not selections:
+        raise QueryError(f"{path or 'query'}: expected a non-empty list of fields")
+    parsed = []
+    aliases = set()
+    for item in selections:
+        if isinstance(item, str):
+            key, spec = item, {}
+        elif isinstance(item, dict) and len(item) == 1:
+            ((key, spec),) = item.items()
+            if not isinstance(spec, dict):
+                raise QueryError(f"{path}{key}: expected an object of arguments and fields")
+        else:
+            raise QueryError(f"{path or 'query'}: each field is a name or a single-key object")
+        alias, _, name = key.rpartition(":")
+        alias, name = alias.strip() or name.strip(), name.strip()
+        field = SCHEMA[type_name].get(name)
+        here = f"{path}{alias}"
+        if field is None:
+            raise QueryError(f"{here}: {type_name} has no field {name!r}")
+        if alias in aliases:
+            raise QueryError(f"{here}: selected twice; give one an alias")
+        aliases.add(alias)
+        spec = dict(spec)
+        children = spec.pop("fields", None)
+        args = _arguments(type_name, field, spec, here)
+        if field.type is None:
+            if children is not None:
+                raise QueryError(f"{here}: {name!r} has no fields to select")
+            fields = []
+        else:
+            if children is None:
+                raise QueryError(f"{here}: select the fields of {name!r}")
+            fields = parse(children, field.type, f"{here}.")
+        parsed.append(Selection(alias, field, args, fields))
+    return parsed
+
+
+def _multiplier(selection: Selection) -> int:
+    if not selection.field.many:
+        return 1
+    if selection.args.get("ids") is not None:
+        return len(selection.args["ids"])
+    return selection.args["limit"]
+
+
+def cost(selections: Sequence[Selection]) -> int:
+    """Objects the query can resolve at most"""
+    return sum(
+        _multiplier(selection) * (1 + cost(selection.fields))
+        for selection in selections if selection.field.type is not None
+    )
+
+
+def depth(selections: Sequence[Selection]) -> int:
+    return max((1 + depth(selection.fields) for selection in selections if selection.fields), default=0)
+
+
+async def _resolve_object(value: Any, selections: Sequence[Selection], context: QueryContext) -> Optional[dict]:
+    if value is None:
+        return None
+    results = await asyncio.gather(*(_resolve_field(value, selection, context) for selection in selections))
+    return {selection.alias: result for selection, result in zip(selections, results)}
+
+
+async def _resolve_field(parent: Any, selection: Selection, context: QueryContext) -> Any:
+    field = selection.field
+    if field.resolve is None:
+        return parent.get(field.name)
+    value = await field.resolve(parent, selection.args, context)
+    if field.type is None:
+        return value
+    if field.many:
+        return list(await asyncio.gather(*(_resolve_object(item, selection.fields, context) for item in value)))
+    return await _resolve_object(value, selection.fields, context)
+
+
+class QueryLimits(NamedTuple):
+    max_cost: int = 1000
+    max_depth: int = 5
+
+
+def check_limits(selections: Sequence[Selection], limits: QueryLimits) -> int:
+    """The query's cost, if it is within limits; raises QueryError otherwise"""
+    if depth(selections) > limits.max_depth:
+        raise QueryError(f"query nests deeper than {limits.max_depth} levels")
+    total = cost(selections)
+    if total > limits.max_cost:
+        raise QueryError(f"query cost {total} is over the limit of {limits.max_cost}; lower some limits")
+    return total
+
+
+async def execute(selections: Sequence[Selection], context: QueryContext) -> dict:
+    """Resolve parsed selections from the root"""
+    return await _resolve_object({}, selections, context)
+
+
+def query_limits_from_env() -> QueryLimits:
+    """QUERY_MAX_COST (objects one query may resolve) and QUERY_MAX_DEPTH"""
+    return QueryLimits(
+        max_cost=int(os.environ.get("QUERY_MAX_COST", "1000")),
+        max_depth=int(os.environ.get("QUERY_MAX_DEPTH", "5")),
+    )
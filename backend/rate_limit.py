@@ -0,0 +1,343 @@
+"""Token-bucket rate limiting per client and route class
+
+Each request draws a token from the bucket for its (route class, client)
+pair. Buckets refill continuously at the class's rate up to its burst
+size, and an empty bucket answers 429 with Retry-After. Buckets live in
+process memory, or in a MongoDB collection when several workers must
+share them. A per-client cap on in-flight requests keeps one client
+from tying up the server with slow requests.
+"""
+import hmac
+import logging
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, NamedTuple, Optional
+
+from pymongo import ReturnDocument
+from starlette.responses import JSONResponse
+from starlette.websockets import WebSocketClose
+
+from metrics import RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+ROUTE_CLASSES = ("read", "search", "write", "populate")
+# Populate wipes the collection, so it gets the tightest budget
+DEFAULT_LIMITS = {
+    "read": "300/minute;burst=100",
+    "search": "120/minute;burst=40",
+    "write": "30/minute;burst=10",
+    "populate": "6/hour;burst=2",
+}
+
+# Long-lived streams draw a token to connect but don't hold a concurrency
+# slot; websockets are always treated so
+STREAM_PATHS = ("/api/breeds/stream",)
+# Close code refusing a websocket over its rate limit: try again later
+WEBSOCKET_RATE_LIMITED = 1013
+# Answered 403 without a valid admin token, before any bucket is drawn from
+ADMIN_PREFIX = "/api/admin"
+
+_LIMIT = re.compile(r"^\s*(\d+)\s*/\s*(second|minute|hour|day)\s*(?:;\s*burst\s*=\s*(\d+)\s*)?$")
+
+
+class Limit(NamedTuple):
+    burst: int
+    rate: float  # tokens per second
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: float
+
+
+def parse_limit(text: str) -> Limit:
+    """Parse "30/minute" or "30/minute;burst=10" (burst defaults to the count)"""
+    match = _LIMIT.match(text)
+    if not match:
+        raise ValueError(f"invalid rate limit {text!r}, expected e.g. '30/minute;burst=10'")
+    count, unit, burst = int(match.group(1)), match.group(2), match.group(3)
+    if count <= 0:
+        raise ValueError(f"invalid rate limit {text!r}, count must be positive")
+    return Limit(int(burst) if burst else count, count / UNITS[unit])
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """Which bucket a request draws from; None for unlimited paths"""
+    if not path.startswith("/api/"):
+        return None
+    # Load balancer probes must never be throttled into looking unhealthy
+    if path.startswith("/api/health/"):
+        return None
+    if path.rstrip("/") == "/api/breeds/populate":
+        return "populate"
+    # A query only reads, but one request can stand in for many lookups
+    if path.rstrip("/") == "/api/query":
+        return "search"
+    if method not in ("GET", "HEAD", "OPTIONS"):
+        return "write"
+    if path.startswith("/api/breeds/search/") or path.rstrip("/") == "/api/breeds/suggest":
+        return "search"
+    return "read"
+
+
+def _decision(allowed: bool, tokens: float, cost: float, limit: Limit) -> Decision:
+    retry_after = 0.0 if allowed else (cost - tokens) / limit.rate
+    return Decision(allowed, max(0, int(tokens)), retry_after)
+
+
+class MemoryBackend:
+    """Buckets in a dict; per process, so each worker enforces its own limits
+
+    Buckets are kept per limit in least recently used order. Every limit
+    refills in the same time, so the buckets that have been idle long
+    enough to be full again are always at the front, and pruning pops
+    them off without scanning the rest. If there are still more than
+    max_buckets, the least recently used go first.
+    """
+
+    def __init__(self, max_buckets: int = 100000, prune_interval: float = 10.0):
+        self.max_buckets = max_buckets
+        self.prune_interval = prune_interval
+        self._buckets: Dict[Limit, "OrderedDict[str, tuple]"] = {}
+        self._size = 0
+        self._next_prune = 0.0
+
+    def attach(self, collection):
+        pass
+
+    async def ensure_indexes(self):
+        pass
+
+    async def take(self, key: str, limit: Limit, cost: float = 1.0) -> Decision:
+        # No awaits in here, so the read-modify-write is atomic on the loop
+        now = time.monotonic()
+        buckets = self._buckets.setdefault(limit, OrderedDict())
+        state = buckets.pop(key, None)
+        if state is None:
+            state = (limit.burst, now)
+            self._size += 1
+        tokens, updated = state
+        tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        buckets[key] = (tokens, now)
+        if now >= self._next_prune or self._size > self.max_buckets:
+            self._prune(now)
+        return _decision(allowed, tokens, cost, limit)
+
+    def _prune(self, now: float):
+        self._next_prune = now + self.prune_interval
+        for limit, buckets in self._buckets.items():
+            # A bucket that has refilled completely is the same as no bucket
+            idle_since = now - limit.burst / limit.rate
+            while buckets and next(iter(buckets.values()))[1] <= idle_since:
+                buckets.popitem(last=False)
+                self._size -= 1
+        while self._size > self.max_buckets:
+            oldest = min(
+                (buckets for buckets in self._buckets.values() if buckets),
+                key=lambda buckets: next(iter(buckets.values()))[1],
+            )
+            oldest.popitem(last=False)
+            self._size -= 1
+
+
+class MongoBackend:
+    """Buckets as documents, refilled and drawn in one atomic update
+
+    Every worker sees the same buckets. Documents expire once their bucket
+    would be full again, so idle clients cost no storage.
+    """
+
+    def __init__(self):
+        self.collection = None
+
+    def attach(self, collection):
+        """Keep buckets in collection"""
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, limit: Limit, cost: float = 1.0) -> Decision:
+        now = time.time()
+        # Clamp elapsed at zero in case worker clocks disagree
+        elapsed = {"$max": [0, {"$subtract": [now, {"$ifNull": ["$updated", now]}]}]}
+        refilled = {"$min": [limit.burst, {"$add": [
+            {"$ifNull": ["$tokens", limit.burst]}, {"$multiply": [elapsed, limit.rate]},
+        ]}]}
+        pipeline = [
+            {"$set": {"tokens": refilled, "updated": now}},
+            {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+            {"$set": {
+                "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                "expires_at": datetime.utcnow() + timedelta(seconds=limit.burst / limit.rate),
+            }},
+        ]
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key}, pipeline, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return _decision(bucket["allowed"], bucket["tokens"], cost, limit)
+
+
+def limits_from_env() -> Dict[str, Limit]:
+    """RATE_LIMIT_READ/SEARCH/WRITE/POPULATE, each a limit string or "off" """
+    limits = {}
+    for name in ROUTE_CLASSES:
+        text = os.environ.get(f"RATE_LIMIT_{name.upper()}", DEFAULT_LIMITS[name])
+        if text.strip().lower() != "off":
+            limits[name] = parse_limit(text)
+    return limits
+
+
+def backend_from_env():
+    """RATE_LIMIT_BACKEND=memory (default), mongo (shared through the collection
+    attached at startup) or off"""
+    kind = os.environ.get("RATE_LIMIT_BACKEND", "memory").lower()
+    if kind == "off":
+        return None
+    if kind == "mongo":
+        return MongoBackend()
+    if kind == "memory":
+        return MemoryBackend()
+    raise ValueError(f"unknown RATE_LIMIT_BACKEND {kind!r}")
+
+
+def client_id(scope, proxy_hops: int = 0) -> str:
+    """Client address, taken from X-Forwarded-For behind proxy_hops trusted proxies"""
+    if proxy_hops:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-forwarded-for":
+                hops = [hop.strip() for hop in value.decode("latin-1").split(",") if hop.strip()]
+                # Entries left of the trusted proxies' own are client-supplied
+                if len(hops) >= proxy_hops:
+                    return hops[-proxy_hops]
+                break
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class RateLimitMiddleware:
+    """Applies per-class token buckets and a per-client in-flight cap
+
+    Websockets draw a token when they connect, and are closed with 1013
+    before they are accepted if their bucket is empty. Requests carrying
+    a valid admin token are exempt. Admin routes refuse every other
+    request anyway, so those are turned away with 403 before they can
+    drain a public bucket. If the backend fails (MongoDB down, say)
+    requests are let through rather than rejected.
+    """
+
+    def __init__(self, app, backend, limits: Dict[str, Limit], concurrency: int = 0,
+                 proxy_hops: int = 0, admin_token: Optional[str] = None):
+        self.app = app
+        self.backend = backend
+        self.limits = limits
+        self.concurrency = concurrency
+        self.proxy_hops = proxy_hops
+        self.admin_token = admin_token
+        self._in_flight: Dict[str, int] = {}
+        self._backend_failing = False
+
+    def _is_admin(self, scope) -> bool:
+        if not self.admin_token:
+            return False
+        for name, value in scope.get("headers", ()):
+            if name == b"x-admin-token":
+                return hmac.compare_digest(value.decode("latin-1"), self.admin_token)
+        return False
+
+    async def _take(self, key: str, limit: Limit) -> Decision:
+        try:
+            decision = await self.backend.take(key, limit)
+        except Exception as exc:
+            if not self._backend_failing:
+                logger.warning("Rate limit backend failed, allowing requests: %r", exc)
+                self._backend_failing = True
+            return Decision(True, limit.burst, 0.0)
+        if self._backend_failing:
+            logger.info("Rate limit backend recovered")
+            self._backend_failing = False
+        return decision
+
+    async def _reject(self, scope, receive, send, detail: str, retry_after: float, headers: Dict[str, str]):
+        response = JSONResponse(
+            {"detail": detail},
+            status_code=429,
+            headers={**headers, "Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+        await response(scope, receive, send)
+
+    async def _connect(self, scope, receive, send):
+        # A websocket draws one token from its class's bucket to connect
+        name = route_class("GET", scope["path"])
+        limit = self.limits.get(name)
+        if limit is not None and not self._is_admin(scope):
+            decision = await self._take(f"{name}:{client_id(scope, self.proxy_hops)}", limit)
+            if not decision.allowed:
+                RATE_LIMITED.labels(name, "rate").inc()
+                await WebSocketClose(WEBSOCKET_RATE_LIMITED, "Rate limit exceeded")(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            await self._connect(scope, receive, send)
+            return
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        is_admin = self._is_admin(scope)
+        path = scope["path"]
+        if not is_admin and (path == ADMIN_PREFIX or path.startswith(ADMIN_PREFIX + "/")):
+            await JSONResponse({"detail": "Admin token required"}, status_code=403)(scope, receive, send)
+            return
+        name = route_class(scope["method"], path)
+        limit = self.limits.get(name)
+        if limit is None or is_admin:
+            await self.app(scope, receive, send)
+            return
+
+        client = client_id(scope, self.proxy_hops)
+        streaming = scope["path"].rstrip("/") in STREAM_PATHS
+        # Checked first so a request turned away here keeps its token
+        if self.concurrency and not streaming and self._in_flight.get(client, 0) >= self.concurrency:
+            RATE_LIMITED.labels(name, "concurrency").inc()
+            await self._reject(scope, receive, send, "Too many concurrent requests", 1, {})
+            return
+
+        decision = await self._take(f"{name}:{client}", limit)
+        headers = {"X-RateLimit-Limit": str(limit.burst), "X-RateLimit-Remaining": str(decision.remaining)}
+        if not decision.allowed:
+            RATE_LIMITED.labels(name, "rate").inc()
+            await self._reject(scope, receive, send, "Rate limit exceeded", decision.retry_after, headers)
+            return
+
+        encoded = [(key.lower().encode(), value.encode()) for key, value in headers.items()]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + encoded}
+            await send(message)
+
+        if streaming:
+            await self.app(scope, receive, send_wrapper)
+            return
+        # The backend await above may have let other requests in
+        self._in_flight[client] = self._in_flight.get(client, 0) + 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            remaining = self._in_flight[client] - 1
+            if remaining:
+                self._in_flight[client] = remaining
+            else:
+                del self._in_flight[client]
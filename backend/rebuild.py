@@ -0,0 +1,174 @@
+"""Rebuilds of derived catalog structures, offloaded to worker processes
+
+Each stage (suggest trie, fuzzy trigram index, condition index, stats
+rollups, columnar catalog store) is CPU-bound. For large catalogs the
+stages run in parallel in a process pool, so the event loop keeps
+serving requests and each core takes a stage. Breeds are sent as one pickled column store holding only
+the fields the stage reads. Small catalogs are built inline, where
+process overhead would cost more than it saves.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from catalog_store import FIELDS, CatalogStore
+from conditions import ConditionIndex
+from metrics import REBUILD_DURATION
+from search_index import FuzzyIndex, SuggestIndex
+from stats import DIMENSIONS, BreedRollups
+
+logger = logging.getLogger(__name__)
+
+
+def build_suggest(breeds: List[dict], aliases: Dict[str, List[str]]) -> SuggestIndex:
+    return SuggestIndex.build(breeds)
+
+
+def build_fuzzy(breeds: List[dict], aliases: Dict[str, List[str]]) -> FuzzyIndex:
+    return FuzzyIndex.build(breeds, aliases)
+
+
+def build_conditions(breeds: List[dict], aliases: Dict[str, List[str]]) -> ConditionIndex:
+    return ConditionIndex.build(breeds)
+
+
+def build_rollups(breeds: List[dict], aliases: Dict[str, List[str]]) -> BreedRollups:
+    return BreedRollups.build(breeds)
+
+
+def build_catalog(breeds: List[dict], aliases: Dict[str, List[str]]) -> CatalogStore:
+    return CatalogStore.build(breeds)
+
+
+class Stage(NamedTuple):
+    fields: Sequence[str]  # what the builder reads from each breed
+    build: Callable[[List[dict], Dict[str, List[str]]], Any]
+    # Combines results built from disjoint slices of the catalog; stages
+    # that have one are split across every worker process
+    merge: Optional[Callable[[Any, Any], Any]] = None
+
+
+STAGES: Dict[str, Stage] = {
+    "suggest": Stage(("id", "name", "temperament", "origin", "breed_group"), build_suggest),
+    "fuzzy": Stage(("id", "name"), build_fuzzy),
+    "conditions": Stage(("id", "health_issues"), build_conditions),
+    "rollups": Stage(
+        tuple(d for d in DIMENSIONS if d != "all") + ("lifespan", "weight"),
+        build_rollups,
+        BreedRollups.merge,
+    ),
+    "catalog": Stage(FIELDS, build_catalog),
+}
+# Search results are read from the catalog store, so it is rebuilt with
+# the indexes that point into it
+SEARCH_STAGES = ("suggest", "fuzzy", "conditions", "catalog")
+
+
+def projection(stages: Iterable[str]) -> Dict[str, int]:
+    """MongoDB projection of just the fields the stages read"""
+    fields = {"_id": 0}
+    for name in stages:
+        fields.update((field, 1) for field in STAGES[name].fields)
+    return fields
+
+
+def pack(breeds: Sequence[dict], fields: Iterable[str]) -> bytes:
+    """Column-oriented pickle of the given fields; keys are not repeated per breed"""
+    columns = {field: [breed.get(field) for breed in breeds] for field in fields}
+    return pickle.dumps(columns, pickle.HIGHEST_PROTOCOL)
+
+
+def unpack(payload: bytes) -> List[dict]:
+    columns = pickle.loads(payload)
+    fields = list(columns)
+    return [dict(zip(fields, row)) for row in zip(*columns.values())]
+
+
+def _run_stage(name: str, payload: bytes, aliases: Dict[str, List[str]]):
+    # Runs in a worker process
+    return STAGES[name].build(unpack(payload), aliases)
+
+
+class RebuildPipeline:
+    """Builds derived structures, in a process pool once the catalog is large enough"""
+
+    def __init__(self, workers: int = 0, min_breeds: int = 2000,
+                 aliases: Optional[Dict[str, List[str]]] = None):
+        self.workers = workers
+        self.min_breeds = min_breeds
+        self.aliases = aliases or {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn, not fork: the server process has motor and exporter threads
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, breeds: Sequence[dict], stages: Iterable[str] = tuple(STAGES)) -> Dict[str, Any]:
+        """Stage name -> built structure; nothing is installed here"""
+        stages = list(stages)
+        if self.workers and len(breeds) >= self.min_breeds:
+            try:
+                return await self._run_pool(breeds, stages)
+            except BrokenProcessPool:
+                logger.exception("Rebuild process pool died, building inline")
+                self._executor = None
+        return self._run_inline(breeds, stages)
+
+    def _run_inline(self, breeds: Sequence[dict], stages: List[str]) -> Dict[str, Any]:
+        built = {}
+        for name in stages:
+            with REBUILD_DURATION.time(name, "inline"):
+                built[name] = STAGES[name].build(breeds, self.aliases)
+        return built
+
+    async def _run_pool(self, breeds: Sequence[dict], stages: List[str]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        pool = self._pool()
+
+        async def build(name: str, part: Sequence[dict]):
+            # Packed on a thread so the loop keeps getting the GIL meanwhile
+            payload = await loop.run_in_executor(None, pack, part, STAGES[name].fields)
+            return await loop.run_in_executor(pool, _run_stage, name, payload, self.aliases)
+
+        async def stage(name: str):
+            started = time.perf_counter()
+            merge = STAGES[name].merge
+            if merge is None:
+                result = await build(name, breeds)
+            else:
+                size = -(-len(breeds) // self.workers)
+                parts = await asyncio.gather(*(
+                    build(name, breeds[start:start + size]) for start in range(0, len(breeds), size)
+                ))
+                result = parts[0]
+                for part in parts[1:]:
+                    result = merge(result, part)
+            REBUILD_DURATION.labels(name, "process").observe(time.perf_counter() - started)
+            return result
+
+        results = await asyncio.gather(*(stage(name) for name in stages))
+        return dict(zip(stages, results))
+
+
+def pipeline_from_env(aliases: Optional[Dict[str, List[str]]] = None) -> RebuildPipeline:
+    """REBUILD_WORKERS (default: one per stage, up to the CPU count; 0 = inline)
+    and REBUILD_MIN_BREEDS (catalog size at which the pool is used)"""
+    default_workers = min(len(STAGES), os.cpu_count() or 1)
+    return RebuildPipeline(
+        workers=int(os.environ.get("REBUILD_WORKERS", default_workers)),
+        min_breeds=int(os.environ.get("REBUILD_MIN_BREEDS", "2000")),
+        aliases=aliases,
+    )
@@ -0,0 +1,206 @@
+"""Bounded MongoDB calls and stale responses while it is unavailable
+
+Every timed collection operation goes through a MongoGuard: it gets a
+timeout for its kind (reads, single writes, bulk writes) and passes a
+circuit breaker. After failure_threshold consecutive timeouts or
+connection errors the breaker opens, and calls fail with MongoUnavailable
+at once instead of piling up behind a database that isn't answering.
+After reset_timeout seconds one trial call goes through; its success
+closes the breaker again.
+
+Read routes answer MongoUnavailable with last-known-good data (a cached
+response, or the in-memory catalog store, which a snapshot persists on
+disk) and call mark_stale, which makes StalenessMiddleware add an
+X-Catalog-Stale header giving the data's age in seconds.
+"""
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+from pymongo.errors import ConnectionFailure, ExecutionTimeout
+
+from metrics import MONGO_CIRCUIT_OPEN, MONGO_CIRCUIT_REJECTED, STALE_RESPONSES
+
+T = TypeVar("T")
+
+STALE_HEADER = "X-Catalog-Stale"
+
+# Operations that read, and ones that may write a whole catalog at once
+READ_OPERATIONS = frozenset({"find", "find_one", "count_documents", "distinct"})
+BULK_OPERATIONS = frozenset({"insert_many", "update_many", "delete_many", "bulk_write", "create_index"})
+
+# Errors that say MongoDB is unreachable or overloaded, rather than that
+# the operation itself was wrong (a duplicate key, say)
+UNAVAILABLE_ERRORS = (asyncio.TimeoutError, ConnectionFailure, ExecutionTimeout)
+
+
+class MongoUnavailable(Exception):
+    """MongoDB timed out, failed to connect, or the circuit breaker is open"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed, open after repeated failures, half-open to try again
+
+    While half-open a single trial call is let through; if it never
+    reports back (it was cancelled), another is allowed after
+    reset_timeout.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open":
+            return False
+        now = time.monotonic()
+        if self._trial_at is not None and now - self._trial_at < self.reset_timeout:
+            return False
+        self._trial_at = now
+        return True
+
+    def succeeded(self):
+        self.failures = 0
+        if self.opened_at is not None:
+            self.opened_at = self._trial_at = None
+            MONGO_CIRCUIT_OPEN.set(0)
+
+    def failed(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._trial_at = None
+            MONGO_CIRCUIT_OPEN.set(1)
+
+
+class MongoGuard:
+    """Timeouts per kind of operation, in front of one circuit breaker
+
+    A timeout of 0 waits as long as the operation takes.
+    """
+
+    def __init__(self, breaker: CircuitBreaker, read_timeout: float = 5.0,
+                 write_timeout: float = 10.0, bulk_timeout: float = 0.0):
+        self.breaker = breaker
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.bulk_timeout = bulk_timeout
+
+    def timeout(self, operation: str) -> Optional[float]:
+        if operation in READ_OPERATIONS:
+            timeout = self.read_timeout
+        elif operation in BULK_OPERATIONS:
+            timeout = self.bulk_timeout
+        else:
+            timeout = self.write_timeout
+        return timeout or None
+
+    async def run(self, operation: str, call: Callable[[], Awaitable[T]]) -> T:
+        if not self.breaker.allow():
+            MONGO_CIRCUIT_REJECTED.inc()
+            retry_after = self.breaker.retry_after()
+            raise MongoUnavailable(f"MongoDB circuit open, retrying in {retry_after:.0f}s", retry_after)
+        try:
+            result = await asyncio.wait_for(call(), self.timeout(operation))
+        except UNAVAILABLE_ERRORS as exc:
+            self.breaker.failed()
+            raise MongoUnavailable(f"MongoDB {operation} failed: {exc!r}", self.breaker.retry_after()) from exc
+        except Exception:
+            # MongoDB answered; the error is the caller's
+            self.breaker.succeeded()
+            raise
+        self.breaker.succeeded()
+        return result
+
+    def status(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "retry_after": round(self.breaker.retry_after(), 1),
+        }
+
+
+def guard_from_env() -> MongoGuard:
+    """MONGO_READ_TIMEOUT, MONGO_WRITE_TIMEOUT and MONGO_BULK_TIMEOUT
+    (seconds; 0 for none), MONGO_BREAKER_FAILURES (consecutive failures
+    that open the breaker) and MONGO_BREAKER_RESET (seconds before a trial
+    call)"""
+    return MongoGuard(
+        CircuitBreaker(
+            failure_threshold=int(os.environ.get("MONGO_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.environ.get("MONGO_BREAKER_RESET", "10")),
+        ),
+        read_timeout=float(os.environ.get("MONGO_READ_TIMEOUT", "5")),
+        write_timeout=float(os.environ.get("MONGO_WRITE_TIMEOUT", "10")),
+        bulk_timeout=float(os.environ.get("MONGO_BULK_TIMEOUT", "0")),
+    )
+
+
+# Age of the oldest stale data the current response was built from; a
+# list so awaited helpers can set it
+_stale: ContextVar[Optional[List[float]]] = ContextVar("stale_age", default=None)
+
+
+def mark_stale(age: float, source: str):
+    """Note that the current response is served from data age seconds old"""
+    STALE_RESPONSES.labels(source).inc()
+    holder = _stale.get()
+    if holder is not None:
+        holder.append(age)
+
+
+class StalenessMiddleware:
+    """ASGI middleware adding X-Catalog-Stale to responses built from stale data
+
+    Such responses are also marked no-store, so no cache keeps them past
+    MongoDB's recovery.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        holder: List[float] = []
+        token = _stale.set(holder)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and holder:
+                headers = [(name, value) for name, value in message.get("headers", [])
+                           if name.lower() != b"cache-control"]
+                headers.append((STALE_HEADER.lower().encode("latin-1"), str(int(max(holder))).encode("latin-1")))
+                headers.append((b"cache-control", b"no-store"))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _stale.reset(token)
@@ -0,0 +1,351 @@
+"""Read-through caching of route handler results
+
+    @route_cache.cached("breed", ttl=300, max_entries=5000, negative_ttl=30)
+    async def get_breed_by_id(breed_id: str, ...):
+
+The decorated handler's result is cached under its normalized
+parameters, as FastAPI passed them. Every entry is tagged with the
+catalog generation current when the handler started; once a write moves
+the generation on, older entries are misses, so one write invalidates
+every cached response without touching them. Each route has its own
+size-bounded store, evicting the least recently (LRU) or least
+frequently (LFU) used entry. With negative_ttl, HTTPExceptions with
+status 404 are cached too, so repeated lookups of unknown IDs don't
+reach MongoDB.
+
+Concurrent misses for one key share a single handler call.
+
+When a handler fails with one of the RouteCache's stale_on exceptions
+(MongoDB being unavailable), the last result cached for the key is
+served however old it is, and marked stale; without one, the route's
+fallback(**params) answers, if it has one.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple, Type
+
+from fastapi import HTTPException
+
+from metrics import ROUTE_CACHE_ENTRIES, ROUTE_CACHE_EVICTIONS, record_cache
+from resilience import mark_stale
+from tracing import record_span
+
+EVICTION_POLICIES = ("lru", "lfu")
+
+
+class LRUCache:
+    """At most max_entries items; adding one more drops the least recently used"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable) -> Any:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def peek(self, key: Hashable) -> Any:
+        """The item without counting it as used"""
+        return self._items.get(key)
+
+    def set(self, key: Hashable, value: Any) -> int:
+        """Store value; returns how many items were evicted"""
+        self._items[key] = value
+        self._items.move_to_end(key)
+        evicted = 0
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def pop(self, key: Hashable):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+
+class LFUCache:
+    """At most max_entries items; adding one more drops the least frequently used
+
+    Items are bucketed by use count, so get and set are O(1). Ties go to
+    the least recently used item of the lowest count.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items: Dict[Hashable, List[Any]] = {}  # key -> [value, count]
+        self._buckets: Dict[int, "OrderedDict[Hashable, None]"] = {}
+        self._lowest = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _touch(self, key: Hashable, item: List[Any]):
+        count = item[1]
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if self._lowest == count:
+                self._lowest = count + 1
+        item[1] = count + 1
+        self._buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+    def get(self, key: Hashable) -> Any:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        self._touch(key, item)
+        return item[0]
+
+    def peek(self, key: Hashable) -> Any:
+        """The item without counting it as used"""
+        item = self._items.get(key)
+        return item[0] if item else None
+
+    def count(self, key: Hashable) -> int:
+        item = self._items.get(key)
+        return item[1] if item else 0
+
+    def set(self, key: Hashable, value: Any) -> int:
+        """Store value; returns how many items were evicted"""
+        item = self._items.get(key)
+        if item is not None:
+            # Replacing a value isn't a use; get() already counted the lookup
+            item[0] = value
+            return 0
+        evicted = 0
+        if self._items and len(self._items) >= self.max_entries:
+            victim, _ = self._buckets[self._lowest].popitem(last=False)
+            if not self._buckets[self._lowest]:
+                del self._buckets[self._lowest]
+            del self._items[victim]
+            evicted = 1
+        self._items[key] = [value, 1]
+        self._buckets.setdefault(1, OrderedDict())[key] = None
+        self._lowest = 1
+        return evicted
+
+    def pop(self, key: Hashable):
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        bucket = self._buckets[item[1]]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[item[1]]
+            self._lowest = min(self._buckets, default=0)
+
+    def clear(self):
+        self._items.clear()
+        self._buckets.clear()
+        self._lowest = 0
+
+
+def make_store(eviction: str, max_entries: int):
+    if eviction == "lru":
+        return LRUCache(max_entries)
+    if eviction == "lfu":
+        return LFUCache(max_entries)
+    raise ValueError(f"unknown eviction policy {eviction!r}, expected one of {EVICTION_POLICIES}")
+
+
+class _Entry(NamedTuple):
+    value: Any  # the handler's result, or (status, detail) of the 404 it raised
+    failed: bool
+    generation: Hashable
+    expires_at: float
+    stored_at: float
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+class _Route:
+    """One decorated handler's store and counters"""
+
+    def __init__(self, name: str, ttl: float, negative_ttl: float, store, make_key: Callable[[dict], Hashable],
+                 fallback: Optional[Callable[..., Awaitable[Any]]] = None):
+        self.name = name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.store = store
+        self.make_key = make_key
+        self.fallback = fallback
+        self.handler = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+        self.in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.store),
+            "max_entries": self.store.max_entries,
+            "eviction": "lfu" if isinstance(self.store, LFUCache) else "lru",
+            "ttl": self.ttl,
+            "negative_ttl": self.negative_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale": self.stale,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class RouteCache:
+    """Registry of cached routes sharing one catalog generation
+
+    generation(params) returns a hashable tag for the data the handler
+    would read given its parameters; entries made under another tag are
+    stale.
+    """
+
+    def __init__(self, generation: Callable[[dict], Hashable], enabled: bool = True,
+                 stale_on: Tuple[Type[Exception], ...] = ()):
+        self.generation = generation
+        self.enabled = enabled
+        self.stale_on = stale_on
+        self.routes: Dict[str, _Route] = {}
+
+    def cached(self, name: str, ttl: float = 60.0, max_entries: int = 1000, eviction: str = "lru",
+               negative_ttl: float = 0.0, key: Optional[Callable[[dict], Hashable]] = None,
+               fallback: Optional[Callable[..., Awaitable[Any]]] = None):
+        """Decorate an async handler; name labels its metrics
+
+        key(params) normalizes the parameters into a cache key, so requests
+        that must get the same response share an entry; by default every
+        parameter counts as given. fallback(**params) answers when the
+        handler fails with a stale_on exception and nothing is cached; it
+        may raise that exception itself.
+        """
+        route = self.routes[name] = _Route(
+            name, ttl, negative_ttl, make_store(eviction, max_entries), key or _freeze, fallback,
+        )
+
+        def decorator(handler):
+            route.handler = handler
+            if not self.enabled:
+                if fallback is None:
+                    return handler
+
+                @wraps(handler)
+                async def guarded_handler(**params):
+                    try:
+                        return await handler(**params)
+                    except self.stale_on:
+                        return await fallback(**params)
+                return guarded_handler
+
+            @wraps(handler)
+            async def cached_handler(**params):
+                cache_key = route.make_key(params)
+                started_ns = time.time_ns()
+                entry = route.store.get(cache_key)
+                hit = self._current(entry, params)
+                record_cache(f"route:{name}", hit)
+                if hit:
+                    route.hits += 1
+                    record_span(f"cache.{name}", "cache", started_ns, time.time_ns())
+                    if entry.failed:
+                        raise HTTPException(*entry.value)
+                    return entry.value
+                route.misses += 1
+                try:
+                    return await self._load(route, cache_key, params)
+                except self.stale_on:
+                    # Keep answering from what was last known good
+                    if entry is not None and not entry.failed:
+                        route.stale += 1
+                        mark_stale(time.monotonic() - entry.stored_at, "route_cache")
+                        return entry.value
+                    if route.fallback is None:
+                        raise
+                    route.stale += 1
+                    return await route.fallback(**params)
+            return cached_handler
+        return decorator
+
+    def _current(self, entry: Optional[_Entry], params: dict) -> bool:
+        return entry is not None and entry.expires_at > time.monotonic() and entry.generation == self.generation(params)
+
+    def is_cached(self, name: str, params: dict) -> bool:
+        """Whether a request with params would be served from the cache"""
+        route = self.routes[name]
+        return self._current(route.store.peek(route.make_key(params)), params)
+
+    async def prefill(self, name: str, params: dict) -> bool:
+        """Cache the handler's result for params unless a current one is cached
+
+        Returns whether the handler ran. Unlike a request, this doesn't
+        count as a use of the entry.
+        """
+        route = self.routes[name]
+        if not self.enabled or self.is_cached(name, params):
+            return False
+        try:
+            await self._load(route, route.make_key(params), params)
+        except (HTTPException,) + self.stale_on:
+            pass
+        return True
+
+    async def _load(self, route: _Route, cache_key: Hashable, params: dict):
+        # Concurrent misses for this key wait on the first one's call
+        pending = route.in_flight.get(cache_key)
+        if pending is None:
+            pending = route.in_flight[cache_key] = asyncio.ensure_future(self._fill(route, cache_key, params))
+            pending.add_done_callback(lambda _: route.in_flight.pop(cache_key, None))
+        return await asyncio.shield(pending)
+
+    async def _fill(self, route: _Route, cache_key: Hashable, params: dict):
+        # Tagged before the handler reads, so a write landing meanwhile
+        # leaves this entry stale rather than cached as current
+        generation = self.generation(params)
+        try:
+            value = await route.handler(**params)
+        except HTTPException as exc:
+            if route.negative_ttl > 0 and exc.status_code == 404:
+                failure = (exc.status_code, exc.detail)
+                now = time.monotonic()
+                self._store(route, cache_key, _Entry(failure, True, generation, now + route.negative_ttl, now))
+            raise
+        now = time.monotonic()
+        self._store(route, cache_key, _Entry(value, False, generation, now + route.ttl, now))
+        return value
+
+    def _store(self, route: _Route, cache_key: Hashable, entry: _Entry):
+        evicted = route.store.set(cache_key, entry)
+        if evicted:
+            route.evictions += evicted
+            ROUTE_CACHE_EVICTIONS.labels(route.name).inc(evicted)
+        ROUTE_CACHE_ENTRIES.labels(route.name).set(len(route.store))
+
+    def clear(self):
+        for route in self.routes.values():
+            route.store.clear()
+            ROUTE_CACHE_ENTRIES.labels(route.name).set(0)
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: route.stats() for name, route in self.routes.items()}
+
+
+def route_cache_from_env(generation: Callable[[dict], Hashable],
+                         stale_on: Tuple[Type[Exception], ...] = ()) -> RouteCache:
+    """ROUTE_CACHE=off serves every request from its handler"""
+    return RouteCache(generation, enabled=os.environ.get("ROUTE_CACHE", "on").lower() != "off", stale_on=stale_on)
@@ -0,0 +1,521 @@
+"""In-memory search structures built from the breed catalog"""
+import bisect
+import heapq
+import itertools
+import re
+from array import array
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from catalog_store import TextColumn, nested_buffers, sub_buffers
+
+# How many ranked completions each trie node keeps for its subtree
+TOP_K = 25
+
+KIND_WEIGHTS = {
+    "breed": 3.0,
+    "breed_group": 2.0,
+    "origin": 1.5,
+    "temperament": 1.0,
+}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """Case-fold and collapse whitespace"""
+    return _WHITESPACE.sub(" ", text.strip().lower())
+
+
+def bounded_edit_distance(a: str, b: str, max_distance: int) -> Optional[int]:
+    """Damerau (OSA) edit distance, or None once it must exceed max_distance"""
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    before: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb),
+            )
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > max_distance:
+            return None
+        before, previous = previous, current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+
+def trigrams(text: str) -> List[str]:
+    """Padded character trigrams"""
+    padded = f"##{text}#"
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class Suggestion(NamedTuple):
+    text: str
+    kind: str
+    breed_id: Optional[str]
+    count: int
+    score: float
+
+
+class _Node:
+    __slots__ = ("edges", "entries", "top_ranks", "top_ids")
+
+    def __init__(self):
+        # first character of the edge label -> (label, child)
+        self.edges: Dict[str, Tuple[str, "_Node"]] = {}
+        # (rank, suggestion index) for keys terminating here
+        self.entries: List[Tuple[float, int]] = []
+        # best ranks and suggestion indexes anywhere in this subtree
+        self.top_ranks = array("d")
+        self.top_ids = array("I")
+
+
+def _common_prefix_len(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _offsets_array(lengths: Iterable[int]) -> array:
+    return array("I", itertools.accumulate(lengths, initial=0))
+
+
+class _TrieBuilder:
+    """Linked radix trie, only used while building a SuggestIndex"""
+
+    def __init__(self):
+        self.root = _Node()
+        self.suggestions: List[Suggestion] = []
+
+    def add(self, text: str, kind: str, breed_id: Optional[str], count: int):
+        score = KIND_WEIGHTS[kind] + min(count, 50) / 50
+        sid = len(self.suggestions)
+        self.suggestions.append(Suggestion(text, kind, breed_id, count, score))
+        key = normalize(text)
+        # Every word start is a key so "retr" completes "Golden Retriever";
+        # matches inside the term rank slightly below leading matches.
+        starts = [0] + [m.end() for m in re.finditer(r"[ \-]", key)]
+        for start in starts:
+            if start < len(key):
+                self._insert(key[start:], (score - (0.5 if start else 0.0), sid))
+
+    def _insert(self, key: str, entry: Tuple[float, int]):
+        node = self.root
+        while True:
+            if not key:
+                node.entries.append(entry)
+                return
+            edge = node.edges.get(key[0])
+            if edge is None:
+                child = _Node()
+                child.entries.append(entry)
+                node.edges[key[0]] = (key, child)
+                return
+            label, child = edge
+            common = _common_prefix_len(label, key)
+            if common == len(label):
+                node, key = child, key[common:]
+                continue
+            middle = _Node()
+            middle.edges[label[common]] = (label[common:], child)
+            node.edges[key[0]] = (label[:common], middle)
+            node, key = middle, key[common:]
+
+    def finalize(self, node: _Node):
+        candidates = list(node.entries)
+        for _, child in node.edges.values():
+            self.finalize(child)
+            candidates.extend(zip(child.top_ranks, child.top_ids))
+        best: Dict[int, float] = {}
+        for rank, sid in candidates:
+            if rank > best.get(sid, float("-inf")):
+                best[sid] = rank
+        top = heapq.nlargest(TOP_K, ((r, s) for s, r in best.items()))
+        node.top_ranks = array("d", (rank for rank, _ in top))
+        node.top_ids = array("I", (sid for _, sid in top))
+        node.entries = []
+
+
+KINDS = tuple(KIND_WEIGHTS)
+
+
+class SuggestIndex:
+    """Compressed (radix) trie of completions with per-node top-k caches
+
+    The trie is built from linked nodes and then flattened breadth-first
+    into columns, so each node's children are contiguous and sorted by
+    first character. The flat form is cheap to ship between processes and
+    can be mapped from a snapshot; see snapshot.py.
+    """
+
+    BUFFERS = ("firsts", "children", "top_offsets", "top_ranks", "top_ids", "kinds", "counts", "scores")
+    TEXTS = ("labels", "texts", "breed_ids")
+
+    def __init__(self, **columns):
+        # Nodes: edge label into each node ("" for the root), the label's
+        # first code point, and node i's children at children[i]:children[i + 1]
+        self._labels: TextColumn = columns["labels"]
+        self._firsts: Sequence[int] = columns["firsts"]
+        self._children: Sequence[int] = columns["children"]
+        # Best (rank, suggestion) pairs per subtree, top_offsets[i]:top_offsets[i + 1]
+        self._top_offsets: Sequence[int] = columns["top_offsets"]
+        self._top_ranks: Sequence[float] = columns["top_ranks"]
+        self._top_ids: Sequence[int] = columns["top_ids"]
+        # Suggestions; an empty breed ID stands for None
+        self._texts: TextColumn = columns["texts"]
+        self._kinds: Sequence[int] = columns["kinds"]
+        self._breed_ids: TextColumn = columns["breed_ids"]
+        self._counts: Sequence[int] = columns["counts"]
+        self._scores: Sequence[float] = columns["scores"]
+
+    @classmethod
+    def build(cls, breeds: Iterable[dict]) -> "SuggestIndex":
+        """Index breed names, temperament words, origins and breed groups"""
+        builder = _TrieBuilder()
+        counts: Dict[Tuple[str, str], int] = {}
+        labels: Dict[Tuple[str, str], str] = {}
+
+        def count(kind: str, text: str):
+            text = text.strip()
+            if not text:
+                return
+            key = (kind, normalize(text))
+            counts[key] = counts.get(key, 0) + 1
+            labels.setdefault(key, text)
+
+        for breed in breeds:
+            builder.add(breed["name"], "breed", breed.get("id"), 1)
+            for word in breed.get("temperament", "").split(","):
+                count("temperament", word)
+            for part in re.split(r"[/,]", breed.get("origin", "")):
+                count("origin", part)
+            count("breed_group", breed.get("breed_group", ""))
+
+        for key, n in counts.items():
+            builder.add(labels[key], key[0], None, n)
+
+        builder.finalize(builder.root)
+        return cls._flatten(builder)
+
+    @classmethod
+    def _flatten(cls, builder: _TrieBuilder) -> "SuggestIndex":
+        nodes = [builder.root]
+        labels = [""]
+        children = array("I")
+        position = 0
+        while position < len(nodes):
+            edges = nodes[position].edges
+            children.append(len(nodes))
+            for first in sorted(edges):
+                label, child = edges[first]
+                labels.append(label)
+                nodes.append(child)
+            position += 1
+        children.append(len(nodes))
+        suggestions = builder.suggestions
+        return cls(
+            labels=TextColumn.build(labels),
+            firsts=array("I", (ord(label[0]) if label else 0 for label in labels)),
+            children=children,
+            top_offsets=_offsets_array(len(node.top_ids) for node in nodes),
+            top_ranks=array("d", itertools.chain.from_iterable(node.top_ranks for node in nodes)),
+            top_ids=array("I", itertools.chain.from_iterable(node.top_ids for node in nodes)),
+            texts=TextColumn.build(s.text for s in suggestions),
+            kinds=array("B", (KINDS.index(s.kind) for s in suggestions)),
+            breed_ids=TextColumn.build(s.breed_id or "" for s in suggestions),
+            counts=array("I", (s.count for s in suggestions)),
+            scores=array("d", (s.score for s in suggestions)),
+        )
+
+    @classmethod
+    def from_buffers(cls, meta: dict, buffers: Dict[str, Any]) -> "SuggestIndex":
+        columns = {name: buffers[name] for name in cls.BUFFERS}
+        columns.update((name, TextColumn.from_buffers({}, sub_buffers(buffers, name))) for name in cls.TEXTS)
+        return cls(**columns)
+
+    def meta(self) -> dict:
+        return {}
+
+    def buffers(self) -> Dict[str, Any]:
+        buffers = {name: getattr(self, f"_{name}") for name in self.BUFFERS}
+        for name in self.TEXTS:
+            buffers.update(nested_buffers(name, getattr(self, f"_{name}")))
+        return buffers
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def _suggestion(self, sid: int) -> Suggestion:
+        return Suggestion(
+            self._texts[sid], KINDS[self._kinds[sid]], self._breed_ids[sid] or None,
+            self._counts[sid], self._scores[sid],
+        )
+
+    def _tops(self, node: int) -> Sequence[int]:
+        return self._top_ids[self._top_offsets[node]:self._top_offsets[node + 1]]
+
+    def _child(self, node: int, char: str) -> Optional[int]:
+        low, high = self._children[node], self._children[node + 1]
+        code = ord(char)
+        position = bisect.bisect_left(self._firsts, code, low, high)
+        if position < high and self._firsts[position] == code:
+            return position
+        return None
+
+    def _locate(self, key: str) -> Optional[int]:
+        node = 0
+        while key:
+            child = self._child(node, key[0])
+            if child is None:
+                return None
+            label = self._labels[child]
+            if key.startswith(label):
+                node, key = child, key[len(label):]
+            elif label.startswith(key):
+                return child
+            else:
+                return None
+        return node
+
+    def _fuzzy(self, query: str, max_distance: int) -> Dict[int, Tuple[int, float]]:
+        """Subtrees whose path is within max_distance edits of the query"""
+        found: Dict[int, Tuple[int, float]] = {}
+        top_offsets, top_ranks, top_ids = self._top_offsets, self._top_ranks, self._top_ids
+
+        def collect(node: int, distance: int):
+            start, stop = top_offsets[node], top_offsets[node + 1]
+            for rank, sid in zip(top_ranks[start:stop], top_ids[start:stop]):
+                seen = found.get(sid)
+                if seen is None or (distance, -rank) < (seen[0], -seen[1]):
+                    found[sid] = (distance, rank)
+
+        # Typos in the first letter are rare, so only its subtree is searched.
+        first = self._child(0, query[0])
+        if first is None:
+            return found
+        stack = [(0, list(range(len(query) + 1)), None, "")]
+        while stack:
+            node, row, before, last = stack.pop()
+            if node == 0:
+                nodes = range(first, first + 1)
+            else:
+                nodes = range(self._children[node], self._children[node + 1])
+            for child in nodes:
+                label = self._labels[child]
+                current, previous, prev_ch = row, before, last
+                pruned = False
+                for ch in label:
+                    nxt = [current[0] + 1]
+                    for j, qc in enumerate(query, 1):
+                        cost = min(
+                            current[j] + 1,
+                            nxt[j - 1] + 1,
+                            current[j - 1] + (qc != ch),
+                        )
+                        # Adjacent transpositions count as a single edit
+                        if j > 1 and qc == prev_ch and query[j - 2] == ch:
+                            cost = min(cost, previous[j - 2] + 1)
+                        nxt.append(cost)
+                    previous, current, prev_ch = current, nxt, ch
+                    if current[-1] <= max_distance:
+                        # The path so far is a typo-tolerant prefix match:
+                        # everything below it completes the query.
+                        collect(child, current[-1])
+                    if min(current) > max_distance:
+                        pruned = True
+                        break
+                if not pruned:
+                    stack.append((child, current, previous, prev_ch))
+        return found
+
+    def suggest(self, query: str, limit: int = 10, max_distance: int = 2) -> List[Tuple[Suggestion, int]]:
+        """Ranked completions for query as (suggestion, edit distance) pairs"""
+        key = normalize(query)
+        if not key:
+            return []
+        limit = min(limit, TOP_K)
+        results: List[Tuple[Suggestion, int]] = []
+        seen = set()
+
+        node = self._locate(key)
+        if node is not None:
+            for sid in self._tops(node)[:limit]:
+                seen.add(sid)
+                results.append((self._suggestion(sid), 0))
+
+        budget = typo_budget(key, max_distance)
+        if len(results) < limit and budget:
+            fuzzy = self._fuzzy(key, budget)
+            ranked = sorted(
+                (item for item in fuzzy.items() if item[0] not in seen),
+                # Ties go to the suggestion indexed first, whatever the trie layout
+                key=lambda item: (item[1][0], -item[1][1], item[0]),
+            )
+            for sid, (distance, _) in ranked[: limit - len(results)]:
+                results.append((self._suggestion(sid), distance))
+        return results
+
+
+def typo_budget(query: str, max_distance: int) -> int:
+    """Allowed edits for a query: none for very short input, more for long"""
+    if len(query) < 3:
+        return 0
+    if len(query) < 6:
+        return min(max_distance, 1)
+    return max_distance
+
+
+class FuzzyMatch(NamedTuple):
+    breed_id: str
+    term: str
+    distance: int
+    score: float
+
+
+class FuzzyIndex:
+    """Positional trigram postings over breed names, name words and aliases
+
+    Terms, grams and postings are flat columns, so the index can be
+    mapped from a snapshot; see snapshot.py.
+    """
+
+    def __init__(self, terms: TextColumn, term_offsets: Sequence[int], term_breeds: TextColumn,
+                 length_offsets: Sequence[int], grams: TextColumn, gram_offsets: Sequence[int],
+                 gram_terms: Sequence[int], gram_positions: Sequence[int]):
+        self._terms = terms
+        # term_breeds[term_offsets[t]:term_offsets[t + 1]] are term t's breed IDs
+        self._term_offsets = term_offsets
+        self._term_breeds = term_breeds
+        # Terms are ordered by length; length_offsets[n] is the first one
+        # at least n characters long
+        self._length_offsets = length_offsets
+        # grams are sorted; gram_terms[gram_offsets[g]:gram_offsets[g + 1]]
+        # hold them, in term order, at gram_positions in those terms
+        self._grams = grams
+        self._gram_offsets = gram_offsets
+        self._gram_terms = gram_terms
+        self._gram_positions = gram_positions
+
+    @classmethod
+    def build(cls, breeds: Iterable[dict], aliases: Optional[Dict[str, List[str]]] = None) -> "FuzzyIndex":
+        """Index every breed under its full name, its words and its aliases"""
+        aliases = aliases or {}
+        term_breeds: Dict[str, List[str]] = {}
+        for breed in breeds:
+            name = breed["name"]
+            names = {normalize(name)}
+            names.update(w for w in re.split(r"[\s\-()]+", normalize(name)) if len(w) >= 3)
+            names.update(normalize(alias) for alias in aliases.get(name, []))
+            for term in names:
+                term_breeds.setdefault(term, []).append(breed["id"])
+        # Ordered by length, so every gram's postings are too and a length
+        # window is one slice of them
+        terms = sorted(term_breeds, key=len)
+        lengths = [0] * (len(terms[-1]) + 1 if terms else 1)
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for tid, term in enumerate(terms):
+            lengths[len(term)] += 1
+            for position, gram in enumerate(trigrams(term)):
+                postings.setdefault(gram, []).append((tid, position))
+        grams = sorted(postings)
+        return cls(
+            TextColumn.build(terms),
+            _offsets_array(len(term_breeds[term]) for term in terms),
+            TextColumn.build(itertools.chain.from_iterable(term_breeds[term] for term in terms)),
+            _offsets_array(lengths),
+            TextColumn.build(grams),
+            _offsets_array(len(postings[gram]) for gram in grams),
+            array("I", (tid for gram in grams for tid, _ in postings[gram])),
+            array("H", (position for gram in grams for _, position in postings[gram])),
+        )
+
+    @classmethod
+    def from_buffers(cls, meta: dict, buffers: Dict[str, Any]) -> "FuzzyIndex":
+        def text(name):
+            return TextColumn.from_buffers({}, sub_buffers(buffers, name))
+        return cls(text("terms"), buffers["term_offsets"], text("term_breeds"), buffers["length_offsets"],
+                   text("grams"), buffers["gram_offsets"], buffers["gram_terms"], buffers["gram_positions"])
+
+    def meta(self) -> dict:
+        return {}
+
+    def buffers(self) -> Dict[str, Any]:
+        return {
+            **nested_buffers("terms", self._terms),
+            "term_offsets": self._term_offsets,
+            **nested_buffers("term_breeds", self._term_breeds),
+            "length_offsets": self._length_offsets,
+            **nested_buffers("grams", self._grams),
+            "gram_offsets": self._gram_offsets,
+            "gram_terms": self._gram_terms,
+            "gram_positions": self._gram_positions,
+        }
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def _postings(self, gram: str, low: int, high: int) -> range:
+        """Where gram's postings for terms low to high - 1 are in gram_terms"""
+        grams = self._grams
+        position = bisect.bisect_left(range(len(grams)), gram, key=grams.__getitem__)
+        if position == len(grams) or grams[position] != gram:
+            return range(0)
+        start, stop = self._gram_offsets[position], self._gram_offsets[position + 1]
+        return range(
+            bisect.bisect_left(self._gram_terms, low, start, stop),
+            bisect.bisect_left(self._gram_terms, high, start, stop),
+        )
+
+    def candidates(self, key: str, budget: int) -> List[int]:
+        """Terms that may be within budget edits of a normalized key
+
+        A term within k edits is within k characters of the key's length.
+        Each edit (a transposition included) breaks at most four of the
+        key's trigrams and moves the rest by at most one position, so at
+        least len(trigrams(key)) - 4k of them are in the term within k
+        positions of where they are in the key. Both sides count gram
+        occurrences, so a repeated gram counts as often as it repeats.
+        """
+        lengths = self._length_offsets
+        longest = len(lengths) - 1
+        low = lengths[min(max(len(key) - budget, 0), longest)]
+        high = lengths[min(len(key) + budget + 1, longest)]
+        grams = trigrams(key)
+        required = max(1, len(grams) - 4 * budget)
+        gram_terms, gram_positions = self._gram_terms, self._gram_positions
+        shared: Dict[int, int] = {}
+        for offset, gram in enumerate(grams):
+            counted = -1
+            for posting in self._postings(gram, low, high):
+                tid = gram_terms[posting]
+                # Each of the key's occurrences counts once per term
+                if tid != counted and abs(gram_positions[posting] - offset) <= budget:
+                    shared[tid] = shared.get(tid, 0) + 1
+                    counted = tid
+        return [tid for tid, count in shared.items() if count >= required]
+
+    def search(self, query: str, max_distance: int = 2, limit: int = 50) -> List[FuzzyMatch]:
+        """Breeds whose name, name word or alias is within max_distance edits"""
+        key = normalize(query)
+        budget = typo_budget(key, max_distance)
+        best: Dict[str, FuzzyMatch] = {}
+        for tid in self.candidates(key, budget):
+            term = self._terms[tid]
+            distance = bounded_edit_distance(key, term, budget)
+            if distance is None:
+                continue
+            score = round(1 - distance / max(len(key), len(term)), 3)
+            for position in range(self._term_offsets[tid], self._term_offsets[tid + 1]):
+                breed_id = self._term_breeds[position]
+                current = best.get(breed_id)
+                if current is None or score > current.score:
+                    best[breed_id] = FuzzyMatch(breed_id, term, distance, score)
+        return sorted(best.values(), key=lambda m: (-m.score, m.term))[:limit]
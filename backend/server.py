@@ -1,28 +1,80 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Query, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
 import os
+import asyncio
+import hmac
+import itertools
 import logging
+import math
+import re
+import time
+import httpx
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Hashable, Iterable, List, Optional
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
+from bootstrap import Bundle, build_bundle
+from catalog_store import CatalogStore
+from changes import breed_delta, broadcaster_from_env
+from conditions import ConditionIndex, condition_ids
+from metrics import CONTENT_TYPE, REGISTRY, MetricsMiddleware, TimedDatabase, record_cache, record_validations
+from tracing import TracedRoute, TracingMiddleware, exporter_from_env, span
+from rate_limit import RateLimitMiddleware, backend_from_env, limits_from_env
+from profiler import ProfileStore, RequestProfilerMiddleware, SamplingProfiler
+from slow_queries import SlowQueryLog
+from search_index import FuzzyIndex, SuggestIndex, normalize
+from hot_queries import hot_queries_from_env
+from stats import DIMENSIONS, BreedRollups, cell_id
+from jobs import JobContext, JobError, JobQueue
+from partitions import DEFAULT_LOCALE, DEFAULT_REGISTRY, PartitionKey, accepted_locales, partition_key, partitions_from_env
+from resilience import MongoUnavailable, StalenessMiddleware, guard_from_env, mark_stale
+from query import QueryContext, QueryError, check_limits, execute, parse, query_limits_from_env
+from route_cache import route_cache_from_env
+from rebuild import SEARCH_STAGES, STAGES, pipeline_from_env, projection
+from overlay import overlay_from_env
+from snapshot import Snapshot, published_at, snapshots_from_env
+from warmup import warmup_from_env
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Startup stages this worker finishes before it reports ready; time to
+# ready is measured from here
+warmup = warmup_from_env()
+
+# Operations slower than SLOW_QUERY_MS are kept for /api/admin/slow-queries
+slow_query_log = SlowQueryLog(
+    threshold_ms=float(os.environ.get('SLOW_QUERY_MS', '100')),
+    explain=os.environ.get('SLOW_QUERY_EXPLAIN', '0') == '1',
+)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client = AsyncIOMotorClient(mongo_url, event_listeners=[slow_query_log])
+# Timeouts and a circuit breaker on every operation; see resilience.py
+mongo_guard = guard_from_env()
+db = TimedDatabase(client[os.environ['DB_NAME']], mongo_guard)
 
 # Create the main app without a prefix
 app = FastAPI()
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=TracedRoute)
+
+# Admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Reject requests without the configured X-Admin-Token"""
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+admin_router = APIRouter(prefix="/api/admin", route_class=TracedRoute, dependencies=[Depends(require_admin)])
 
 # Define Models
 class DogBreed(BaseModel):
@@ -63,6 +115,67 @@ class DogBreedCreate(BaseModel):
     health_issues: List[str]
     breed_group: str
 
+class PartitionBreed(DogBreedCreate):
+    # A translation's breeds reuse the IDs of the registry's default locale
+    id: Optional[str] = None
+
+class CatalogPartition(BaseModel):
+    registry: str
+    locale: str
+    count: int
+    loaded: bool
+    updated_at: Optional[datetime] = None
+
+class ScoredDogBreed(DogBreed):
+    score: float
+    matched: Optional[str] = None
+
+class HealthCondition(BaseModel):
+    id: str
+    name: str
+    variants: List[str]
+    breed_count: int
+
+class ConditionBreeds(BaseModel):
+    condition: HealthCondition
+    count: int
+    breeds: List[DogBreed]
+
+class BreedSuggestion(BaseModel):
+    text: str
+    kind: str
+    breed_id: Optional[str] = None
+    count: int
+    distance: int
+
+class BreedChanges(BaseModel):
+    since: int
+    version: int  # pass as since for the next page or sync
+    has_more: bool
+    reset: bool = False  # since is too old; discard local data and sync from 0
+    breeds: List[DogBreed]  # created or updated, oldest change first
+    deleted: List[str]
+
+class QueryRequest(BaseModel):
+    query: list
+
+class JobProgress(BaseModel):
+    done: int = 0
+    total: Optional[int] = None
+
+class JobStatus(BaseModel):
+    id: str
+    kind: str
+    status: str
+    progress: JobProgress
+    message: Optional[str] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 # Dog breeds data with ACCURATE information
 DOG_BREEDS_DATA = [
     {
@@ -923,59 +1036,1208 @@ FINAL_ADDITIONAL_BREEDS = [
 
 ALL_BREEDS = DOG_BREEDS_DATA + ADDITIONAL_BREEDS + FINAL_ADDITIONAL_BREEDS
 
+# Common nicknames, indexed alongside breed names for fuzzy search
+BREED_ALIASES = {
+    "Labrador Retriever": ["Lab", "Labrador"],
+    "Golden Retriever": ["Golden", "Goldie"],
+    "German Shepherd": ["GSD", "Alsatian"],
+    "French Bulldog": ["Frenchie"],
+    "Poodle (Standard)": ["Standard Poodle"],
+    "Yorkshire Terrier": ["Yorkie"],
+    "Bulldog": ["English Bulldog", "British Bulldog"],
+    "Dachshund": ["Wiener Dog", "Sausage Dog", "Doxie"],
+    "Siberian Husky": ["Husky"],
+    "Rottweiler": ["Rottie"],
+    "Doberman Pinscher": ["Doberman", "Dobie"],
+    "Saint Bernard": ["St. Bernard"],
+    "Cavalier King Charles Spaniel": ["Cavalier", "Cav"],
+    "English Springer Spaniel": ["Springer"],
+    "Shetland Sheepdog": ["Sheltie"],
+    "Bernese Mountain Dog": ["Berner"],
+    "Australian Cattle Dog": ["Blue Heeler", "Red Heeler", "Heeler"],
+    "Pomeranian": ["Pom"],
+    "Alaskan Malamute": ["Malamute"],
+    "Rhodesian Ridgeback": ["Ridgeback"],
+    "Portuguese Water Dog": ["Portie", "PWD"],
+}
+
+def validate_breeds(documents: List[dict]) -> List[DogBreed]:
+    """DogBreed models for Mongo documents, counted for /metrics"""
+    with span("validate", stage="validate", count=len(documents)):
+        breeds = [DogBreed(**document) for document in documents]
+    record_validations(len(breeds))
+    return breeds
+
+def breed_document(breed: DogBreed) -> dict:
+    """Mongo document for a breed, including derived query fields"""
+    document = breed.dict()
+    document["health_conditions"] = condition_ids(breed.health_issues)
+    return document
+
+# In-memory search structures, rebuilt whenever the catalog changes
+suggest_index: Optional[SuggestIndex] = None
+fuzzy_index: Optional[FuzzyIndex] = None
+condition_index: Optional[ConditionIndex] = None
+# Columnar copy of the catalog that search results are read from
+catalog_store: Optional[CatalogStore] = None
+catalog_loaded_at = 0.0  # when catalog_store was read from MongoDB
+# Large catalogs are rebuilt in worker processes; see rebuild.py
+rebuild_pipeline = pipeline_from_env(BREED_ALIASES)
+rebuild_generations = itertools.count(1)
+search_generation = 0
+# Memory-mapped copies shared by the workers on this host; see snapshot.py
+catalog_snapshots = snapshots_from_env()
+catalog_snapshot: Optional[Snapshot] = None
+snapshot_version: Optional[str] = None  # newest version published or loaded here
+# Single-breed writes since the installed structures were built, served
+# over them until the next rebuild; see overlay.py
+catalog_overlay = overlay_from_env(BREED_ALIASES)
+search_base: dict = {}  # the installed structures, without the overlay
+
+def layer_search_indexes():
+    """Serve the installed search structures with the overlay's writes applied"""
+    global suggest_index, fuzzy_index, condition_index, catalog_store
+    # No await in here, so requests see either all old or all new structures
+    layered = catalog_overlay.layer(search_base)
+    suggest_index, fuzzy_index, condition_index = layered["suggest"], layered["fuzzy"], layered["conditions"]
+    catalog_store = layered["catalog"]
+
+def install_search_indexes(built: dict, generation: int, folded: Optional[int] = None) -> bool:
+    """Swap in freshly built search structures unless newer ones are installed
+
+    folded is the overlay position the catalog was read at, for a rebuild
+    read from MongoDB; the writes up to it are in the new structures.
+    """
+    global search_base, catalog_loaded_at, search_generation
+    if generation < search_generation:
+        return False
+    if folded is not None:
+        catalog_overlay.fold(folded)
+    search_base = {name: built[name] for name in SEARCH_STAGES}
+    layer_search_indexes()
+    catalog_loaded_at = time.time()
+    search_generation = generation
+    return True
+
+def install_snapshot(snapshot: Snapshot, generation: int):
+    """Serve search structures from a mapped snapshot"""
+    global catalog_snapshot, catalog_loaded_at, snapshot_version
+    snapshot_version = max(snapshot_version or "", snapshot.version)
+    if install_search_indexes(snapshot.structures, generation):
+        catalog_snapshot = snapshot
+        catalog_loaded_at = published_at(snapshot.version)
+
+async def publish_snapshot(built: dict, generation: int, revision: int):
+    """Write freshly built search structures as a new snapshot version
+
+    revision is the change-log revision read before the catalog was. This
+    worker switches to the mapped copy as well, so its heap copy can
+    be freed; the other workers pick the version up when they next poll.
+    """
+    if catalog_snapshots is None:
+        return
+    structures = {name: built[name] for name in SEARCH_STAGES}
+    loop = asyncio.get_running_loop()
+    try:
+        version = await loop.run_in_executor(None, catalog_snapshots.publish, structures, revision)
+        snapshot = await loop.run_in_executor(None, catalog_snapshots.load, version)
+    except Exception:
+        logger.exception("Could not publish a catalog snapshot")
+        return
+    install_snapshot(snapshot, generation)
+
+async def load_published_snapshot():
+    """Install the current snapshot if it is newer than what this worker has"""
+    global snapshot_version
+    version = catalog_snapshots.current_version()
+    if version is None or version <= (snapshot_version or ""):
+        return
+    generation = next(rebuild_generations)
+    # Versions published while this worker runs are current; one found at
+    # startup may be from before the catalog last changed
+    revision = None
+    if snapshot_version is None:
+        try:
+            revision = await change_broadcaster.log.latest()
+        except MongoUnavailable:
+            # The last known good catalog, to serve until MongoDB is back
+            logger.warning("MongoDB unavailable, serving catalog snapshot %s unchecked", version)
+    try:
+        snapshot = await asyncio.get_running_loop().run_in_executor(
+            None, catalog_snapshots.load_checked, version, revision)
+    except Exception:
+        logger.exception("Could not load catalog snapshot %s", version)
+        return
+    if snapshot is None:
+        # The next rebuild replaces it
+        logger.info("Ignoring stale catalog snapshot %s", version)
+        snapshot_version = version
+        return
+    install_snapshot(snapshot, generation)
+
+async def watch_snapshots():
+    while True:
+        await asyncio.sleep(catalog_snapshots.poll_interval)
+        try:
+            await load_published_snapshot()
+        except Exception:
+            logger.exception("Catalog snapshot check failed")
+
+async def rebuild_search_indexes():
+    """Rebuild in-memory search structures from the current catalog"""
+    generation = next(rebuild_generations)
+    # Writes layered so far are already in MongoDB, so in what is read next
+    folded = catalog_overlay.position
+    revision = await change_broadcaster.log.latest()
+    breeds = await db.dog_breeds.find({}, projection(SEARCH_STAGES)).to_list(None)
+    built = await rebuild_pipeline.run(breeds, SEARCH_STAGES)
+    if install_search_indexes(built, generation, folded):
+        await publish_snapshot(built, generation, revision)
+
+# Materialized rollups, mirrored in the breed_stats side collection
+breed_rollups: Optional[BreedRollups] = None
+breed_rollups_version = 0  # change feed version when they were read
+
+async def store_breed_stats(rollups: BreedRollups):
+    """Replace the side collection and the in-memory rollups"""
+    global breed_rollups, breed_rollups_version
+    version = change_broadcaster.version
+    await db.breed_stats.delete_many({})
+    documents = rollups.to_documents()
+    if documents:
+        await db.breed_stats.insert_many(documents)
+    breed_rollups, breed_rollups_version = rollups, version
+
+async def rebuild_breed_stats():
+    """Recompute every rollup from the catalog and replace the side collection"""
+    breeds = await db.dog_breeds.find({}, projection(["rollups"])).to_list(None)
+    built = await rebuild_pipeline.run(breeds, ["rollups"])
+    await store_breed_stats(built["rollups"])
+
+async def rebuild_derived():
+    """Rebuild search structures and rollups from one read of the catalog"""
+    generation = next(rebuild_generations)
+    folded = catalog_overlay.position
+    revision = await change_broadcaster.log.latest()
+    breeds = await db.dog_breeds.find({}, projection(STAGES)).to_list(None)
+    built = await rebuild_pipeline.run(breeds, STAGES)
+    if install_search_indexes(built, generation, folded):
+        await publish_snapshot(built, generation, revision)
+    await store_breed_stats(built["rollups"])
+
+async def stored_breeds(breed_ids: List[str]) -> List[dict]:
+    """Breed documents by ID, from the catalog store where it has them"""
+    found = {}
+    if catalog_store is not None:
+        for breed_id in breed_ids:
+            row = catalog_store.index(breed_id)
+            if row is not None:
+                found[breed_id] = catalog_store.record(row)
+    record_cache("catalog_store", len(found) == len(breed_ids))
+    missing = [breed_id for breed_id in breed_ids if breed_id not in found]
+    if missing:
+        for breed in await db.dog_breeds.find({"id": {"$in": missing}}).to_list(len(missing)):
+            found[breed["id"]] = breed
+    return [found[breed_id] for breed_id in breed_ids if breed_id in found]
+
+async def load_breed_stats() -> BreedRollups:
+    """Rollups from the side collection, computing them once if it is empty
+
+    Other workers' writes reach the side collection but not this worker's
+    copy, so it is read again once the change feed has moved past it.
+    """
+    global breed_rollups, breed_rollups_version
+    current = breed_rollups is not None and breed_rollups_version >= change_broadcaster.version
+    record_cache("breed_rollups", current)
+    if not current:
+        version = change_broadcaster.version
+        documents = await db.breed_stats.find().to_list(None)
+        if documents:
+            breed_rollups, breed_rollups_version = BreedRollups.from_documents(documents), version
+        else:
+            await rebuild_breed_stats()
+    return breed_rollups
+
+async def update_breed_stats(before: Optional[dict], after: Optional[dict]):
+    """Apply a single breed write to the rollups and $inc only the touched cells"""
+    rollups = await load_breed_stats()
+    rollups.apply(before, after)
+    operations = []
+    for (dimension, key), increments in rollups.increments(before, after).items():
+        _id = cell_id(dimension, key)
+        operations.append(UpdateOne(
+            {"_id": _id}, {"$inc": increments, "$setOnInsert": {"dimension": dimension, "key": key}}, upsert=True,
+        ))
+        if increments.get("count", 0) < 0:
+            # An emptied cell goes; a write that re-creates it starts it from zero
+            operations.append(DeleteOne({"_id": _id, "count": {"$lte": 0}}))
+    if operations:
+        # Ordered, so a cell's delete sees its own decrement
+        await db.breed_stats.bulk_write(operations)
+
+# Registry and locale partitions beside the main catalog; see partitions.py
+async def build_partition(collection) -> dict:
+    """Derived structures for one partition, from one read of its collection"""
+    breeds = await collection.find({}, projection(STAGES)).to_list(None)
+    return await rebuild_pipeline.run(breeds, STAGES)
+
+catalog_partitions = partitions_from_env(build_partition)
+
+async def catalog_partition(
+    response: Response,
+    registry: str = Query(DEFAULT_REGISTRY, max_length=32),
+    locale: Optional[str] = Query(None, max_length=35),
+    accept_language: Optional[str] = Header(None),
+) -> Optional[PartitionKey]:
+    """The partition a read is served from; None for the main catalog
+
+    locale takes precedence over Accept-Language. A registry without the
+    requested locale serves its default one; Content-Language says which.
+    """
+    try:
+        registry = partition_key(registry, DEFAULT_LOCALE).registry
+        locales = [partition_key(registry, locale).locale] if locale else accepted_locales(accept_language)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    key = await catalog_partitions.resolve(registry, locales)
+    if key is None:
+        raise HTTPException(status_code=404, detail=f"Unknown registry {registry!r}")
+    response.headers["Content-Language"] = key.locale
+    response.headers["Vary"] = "Accept-Language"
+    return None if key.is_default else key
+
+async def partition_breeds(partition: PartitionKey, breed_ids: List[str]) -> List[dict]:
+    """Breed documents by ID from a partition's catalog store"""
+    store = (await catalog_partitions.structures(partition))["catalog"]
+    return [breed for breed in map(store.get, breed_ids) if breed is not None]
+
+# Catalog deltas pushed to streaming clients; see changes.py
+change_broadcaster = broadcaster_from_env()
+
+# Bumped by this process's catalog writes, which reach its change feed a
+# moment later; other processes' writes arrive only through the feed
+catalog_writes = 0
+
+def catalog_generation(params: dict) -> Hashable:
+    """Tag for cached responses, moved on by every write to the catalog they read"""
+    partition = params.get("partition")
+    if partition is not None:
+        return catalog_partitions.version(partition)
+    return (change_broadcaster.version, catalog_writes)
+
+def note_catalog_write():
+    global catalog_writes
+    catalog_writes += 1
+
+async def catalog_changed(before: Optional[dict], after: Optional[dict], revision: int):
+    """Keep derived structures in step with a single breed write"""
+    note_catalog_write()
+    await update_breed_stats(before, after)
+    catalog_overlay.write((after or before)["id"], after)
+    if search_base:
+        layer_search_indexes()
+        schedule_overlay_fold()
+    await change_broadcaster.record([{"_id": revision, **breed_delta(before, after)}])
+
+# Rebuild that folds the overlay into the search structures
+overlay_fold: Optional[asyncio.Task] = None
+overlay_full = asyncio.Event()
+
+def schedule_overlay_fold():
+    """Rebuild the search structures after the overlay's delay, or now if it is full"""
+    global overlay_fold
+    if catalog_overlay.full:
+        overlay_full.set()
+    if overlay_fold is None:
+        overlay_fold = asyncio.get_running_loop().create_task(fold_overlay())
+
+async def fold_overlay():
+    global overlay_fold
+    try:
+        await asyncio.wait_for(overlay_full.wait(), catalog_overlay.delay)
+    except asyncio.TimeoutError:
+        pass
+    overlay_full.clear()
+    try:
+        await rebuild_search_indexes()
+    except Exception:
+        logger.exception("Rebuilding the search structures failed")
+    overlay_fold = None
+    # Writes made during the rebuild
+    if len(catalog_overlay):
+        schedule_overlay_fold()
+
+async def catalog_replaced(first: int, last: int):
+    """Log one reset for a bulk write that used versions first to last"""
+    note_catalog_write()
+    count = await db.dog_breeds.count_documents({})
+    await change_broadcaster.record([{"_id": last, "op": "reset", "first": first, "count": count}])
+
+async def add_tombstones(breed_ids: List[str]) -> int:
+    """Record deleted breeds for delta sync; returns the first of their revisions"""
+    first = await change_broadcaster.log.allocate(len(breed_ids))
+    deleted_at = datetime.utcnow()
+    await db.breed_tombstones.bulk_write([
+        ReplaceOne({"_id": breed_id}, {"revision": revision, "deleted_at": deleted_at}, upsert=True)
+        for revision, breed_id in enumerate(breed_ids, first)
+    ], ordered=False)
+    return first
+
+# Handler results cached per route; see route_cache.py. While MongoDB is
+# unavailable, cached results are served past their expiry
+route_cache = route_cache_from_env(catalog_generation, stale_on=(MongoUnavailable,))
+
+def last_known_catalog(partition: Optional[PartitionKey]) -> CatalogStore:
+    """The catalog store as last read from MongoDB, for reads while it is unavailable
+
+    Marks the response stale. Partitions have no fallback: theirs are only
+    missing when they couldn't be built.
+    """
+    if partition is not None or catalog_store is None:
+        raise MongoUnavailable("MongoDB is unavailable and no catalog is loaded", mongo_guard.breaker.retry_after())
+    mark_stale(time.time() - catalog_loaded_at, "catalog_store")
+    return catalog_store
+
+async def all_breeds_fallback(partition: Optional[PartitionKey]) -> List[DogBreed]:
+    store = last_known_catalog(partition)
+    return validate_breeds(store.records(store.rows()))
+
+async def breed_fallback(breed_id: str, partition: Optional[PartitionKey]) -> DogBreed:
+    breed = last_known_catalog(partition).get(breed_id)
+    if breed is None:
+        raise HTTPException(status_code=404, detail="Breed not found")
+    return validate_breeds([breed])[0]
+
+async def search_fallback(query: str, fuzzy: bool, max_distance: int, partition: Optional[PartitionKey]):
+    """search_breeds over the catalog store, matching as MongoDB's $regex would"""
+    store = last_known_catalog(partition)
+    pattern = re.compile(re.escape(query), re.IGNORECASE)
+    breeds = [
+        breed for breed in store.records(store.rows())
+        if any(pattern.search(breed.get(field) or "") for field in SEARCH_FIELDS)
+    ][:1000]
+    return await search_results(query, fuzzy, max_distance, partition, breeds)
+
+def search_key(params: dict) -> Hashable:
+    # The query arrives normalized; max_distance only applies to fuzzy searches
+    return (
+        params["query"], params["fuzzy"],
+        params["max_distance"] if params["fuzzy"] else None, params["partition"],
+    )
+
+# Main-catalog searches counted by normalized query; see hot_queries.py
+hot_queries = hot_queries_from_env()
+
+async def refresh_hot_searches(keys: List[Hashable]):
+    """Recompute and cache results for the most frequent searches"""
+    for query, fuzzy, max_distance in keys:
+        await route_cache.prefill("search", {
+            "query": query, "fuzzy": fuzzy, "max_distance": max_distance or 0, "partition": None,
+        })
+
 # Add your routes to the router instead of directly to app
 @api_router.get("/")
 async def root():
     return {"message": "Welcome to the Dog Breeds API"}
 
+@api_router.get("/health/live")
+async def liveness():
+    """The process is up and answering requests"""
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def readiness(response: Response):
+    """Warmup progress; 503 until it has finished, so no traffic is routed here"""
+    if not warmup.ready:
+        response.status_code = 503
+    return {**warmup.status(), "database": mongo_guard.status()}
+
+async def queue_initial_populate():
+    """Populate an empty catalog in the background and ask the client to retry
+
+    Clients used to populate an empty catalog themselves; the job runs in
+    the catalog group like every other catalog write.
+    """
+    try:
+        await job_queue.submit_once("populate")
+    except JobError as exc:
+        raise HTTPException(status_code=503, detail=str(exc))
+    raise HTTPException(
+        status_code=503,
+        detail="The catalog is being populated",
+        headers={"Retry-After": str(INITIAL_POPULATE_RETRY_AFTER)},
+    )
+
 @api_router.get("/breeds", response_model=List[DogBreed])
-async def get_all_breeds():
+@route_cache.cached("breeds", ttl=60, max_entries=64, fallback=all_breeds_fallback)
+async def get_all_breeds(partition: Optional[PartitionKey] = Depends(catalog_partition)):
     """Get all dog breeds"""
+    if partition is not None:
+        store = (await catalog_partitions.structures(partition))["catalog"]
+        return validate_breeds(store.records(store.rows()))
     breeds = await db.dog_breeds.find().to_list(1000)
     if not breeds:
-        # If no breeds in database, populate with initial data
-        await populate_breeds()
-        breeds = await db.dog_breeds.find().to_list(1000)
-    return [DogBreed(**breed) for breed in breeds]
+        await queue_initial_populate()
+    return validate_breeds(breeds)
+
+@route_cache.cached("bootstrap", ttl=3600, max_entries=16)
+async def bootstrap_bundle(partition: Optional[PartitionKey]) -> Bundle:
+    """The encoded bundle for the partition's current version; see bootstrap.py"""
+    if partition is not None:
+        structures = await catalog_partitions.structures(partition)
+        return build_bundle(structures["catalog"], structures["conditions"])
+    if catalog_store is None:
+        await rebuild_search_indexes()
+    if not len(catalog_store) and not await db.dog_breeds.count_documents({}, limit=1):
+        await queue_initial_populate()
+    return build_bundle(catalog_store, condition_index)
+
+@api_router.get("/bootstrap", response_class=Response, responses={200: {"content": {"application/json": {}}}})
+async def get_bootstrap(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    partition: Optional[PartitionKey] = Depends(catalog_partition),
+):
+    """Everything the first page renders, in one cacheable response
+
+    Summary rows for every breed, facet counts and image variants with
+    their dimensions; see bootstrap.py. An empty catalog is populated
+    by a job, and answered with 503 until it is. Revalidate with
+    If-None-Match.
+    """
+    bundle = await bootstrap_bundle(partition=partition)
+    # Headers catalog_partition set on the default response don't carry over
+    headers = {name: value for name, value in response.headers.items() if name in ("content-language", "vary")}
+    headers.update({"ETag": bundle.etag, "Cache-Control": "public, max-age=60"})
+    if if_none_match and bundle.etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    if bundle.link:
+        headers["Link"] = bundle.link
+    return Response(bundle.body, media_type="application/json", headers=headers)
+
+@api_router.get("/breeds/suggest", response_model=List[BreedSuggestion])
+@route_cache.cached("suggest", ttl=60, max_entries=2000, eviction="lfu")
+async def suggest_breeds(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=25),
+    max_distance: int = Query(2, ge=0, le=2),
+    partition: Optional[PartitionKey] = Depends(catalog_partition),
+):
+    """Typeahead completions over breed names, temperaments, origins and groups"""
+    if partition is not None:
+        index = (await catalog_partitions.structures(partition))["suggest"]
+    else:
+        record_cache("suggest_index", suggest_index is not None)
+        if suggest_index is None:
+            await rebuild_search_indexes()
+        index = suggest_index
+    return [
+        BreedSuggestion(
+            text=suggestion.text,
+            kind=suggestion.kind,
+            breed_id=suggestion.breed_id,
+            count=suggestion.count,
+            distance=distance,
+        )
+        for suggestion, distance in index.suggest(q, limit, max_distance)
+    ]
+
+@api_router.get("/breeds/stats")
+@route_cache.cached("stats", ttl=300, max_entries=64)
+async def get_breed_stats(group_by: str = "all", partition: Optional[PartitionKey] = Depends(catalog_partition)):
+    """Breed counts, lifespan/weight distributions and top health issues per group"""
+    if group_by not in DIMENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"group_by must be one of: {', '.join(DIMENSIONS)}",
+        )
+    if partition is not None:
+        rollups = (await catalog_partitions.structures(partition))["rollups"]
+    else:
+        rollups = await load_breed_stats()
+    return rollups.summary(group_by)
+
+STREAM_HEARTBEAT = float(os.environ.get('CHANGE_HEARTBEAT', '15'))
+
+@api_router.get("/breeds/stream")
+async def stream_breed_changes(
+    since: Optional[int] = Query(None, ge=0),
+    last_event_id: Optional[int] = Header(None, ge=0),
+):
+    """Server-sent events for every catalog change after version since
+
+    EventSource reconnects with Last-Event-ID, which takes precedence, so
+    a dropped client resumes where it left off. A "reset" event means
+    the catalog must be re-fetched.
+    """
+    resume = last_event_id if last_event_id is not None else since
+    if resume is None:
+        # Pinned now, so nothing is missed before the stream starts
+        resume = change_broadcaster.version
+
+    async def events():
+        # Reconnect quickly after the stream is closed for falling behind
+        yield b"retry: 1000\n\n"
+        async for change in change_broadcaster.stream(resume, STREAM_HEARTBEAT):
+            yield b": keep-alive\n\n" if change is None else change.frame
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        "X-Catalog-Version": str(resume),
+    })
+
+@api_router.websocket("/breeds/stream/ws")
+async def stream_breed_changes_ws(websocket: WebSocket, since: Optional[int] = Query(None, ge=0)):
+    """The change stream as JSON text messages, one per change"""
+    if since is None:
+        since = change_broadcaster.version
+    await websocket.accept()
+    try:
+        async for change in change_broadcaster.stream(since, STREAM_HEARTBEAT):
+            if change is None:
+                await websocket.send_json({"op": "ping", "version": change_broadcaster.version})
+            else:
+                await websocket.send_text(change.payload)
+        # Fell too far behind; the client reconnects with its last version
+        await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+
+MAX_CHANGES_PAGE = 1000
+
+@api_router.get("/breeds/changes", response_model=BreedChanges)
+async def get_breed_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=MAX_CHANGES_PAGE),
+):
+    """Breeds created, updated or deleted after version since, a page at a time
+
+    since=0 is a full sync. Pages stop at the last version whose writes
+    are all complete, so a client never skips a write still in flight.
+    """
+    horizon = await change_broadcaster.log.horizon()
+    if 0 < since < horizon:
+        # Tombstones this client needs were pruned
+        return BreedChanges(since=since, version=0, has_more=True, reset=True, breeds=[], deleted=[])
+    until = change_broadcaster.version
+    window = {"revision": {"$gt": since, "$lte": until}}
+    breeds = await db.dog_breeds.find(window, {"_id": 0}).sort("revision", 1).to_list(limit + 1)
+    # A client starting from nothing has nothing to delete
+    tombstones = await db.breed_tombstones.find(window).sort("revision", 1).to_list(limit + 1) if since else []
+    # (revision, breed document or None, deleted ID or None), merged by revision
+    changes = sorted(
+        [(breed["revision"], breed, None) for breed in breeds]
+        + [(tombstone["revision"], None, tombstone["_id"]) for tombstone in tombstones],
+        key=lambda change: change[0],
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    return BreedChanges(
+        since=since,
+        version=changes[-1][0] if has_more else max(since, until),
+        has_more=has_more,
+        breeds=validate_breeds([breed for _, breed, _ in changes if breed is not None]),
+        deleted=[breed_id for _, _, breed_id in changes if breed_id is not None],
+    )
+
+@api_router.post("/breeds", response_model=DogBreed, dependencies=[Depends(require_admin)])
+async def create_breed(breed: DogBreedCreate):
+    """Add a breed to the catalog"""
+    breed_obj = DogBreed(**breed.dict())
+    document = breed_document(breed_obj)
+    document["revision"] = await change_broadcaster.log.allocate()
+    await db.dog_breeds.insert_one(dict(document))
+    await catalog_changed(None, document, document["revision"])
+    return breed_obj
+
+@api_router.put("/breeds/{breed_id}", response_model=DogBreed, dependencies=[Depends(require_admin)])
+async def update_breed(breed_id: str, breed: DogBreedCreate):
+    """Replace a breed's details, keeping its ID"""
+    before = await db.dog_breeds.find_one({"id": breed_id}, {"_id": 0})
+    if not before:
+        raise HTTPException(status_code=404, detail="Breed not found")
+    breed_obj = DogBreed(**breed.dict(), id=breed_id, created_at=before["created_at"])
+    document = breed_document(breed_obj)
+    if breed_delta(before, document) is None:
+        # Nothing a client can see changed; keep the revision
+        return breed_obj
+    document["revision"] = await change_broadcaster.log.allocate()
+    await db.dog_breeds.replace_one({"id": breed_id}, dict(document))
+    await catalog_changed(before, document, document["revision"])
+    return breed_obj
+
+@api_router.delete("/breeds/{breed_id}", dependencies=[Depends(require_admin)])
+async def delete_breed(breed_id: str):
+    """Remove a breed from the catalog"""
+    before = await db.dog_breeds.find_one_and_delete({"id": breed_id}, {"_id": 0})
+    if not before:
+        raise HTTPException(status_code=404, detail="Breed not found")
+    revision = await add_tombstones([breed_id])
+    await catalog_changed(before, None, revision)
+    return {"message": f"Deleted breed {breed_id}"}
 
 @api_router.get("/breeds/{breed_id}", response_model=DogBreed)
-async def get_breed_by_id(breed_id: str):
+@route_cache.cached("breed", ttl=300, max_entries=5000, negative_ttl=30, fallback=breed_fallback)
+async def get_breed_by_id(breed_id: str, partition: Optional[PartitionKey] = Depends(catalog_partition)):
     """Get a specific breed by ID"""
-    breed = await db.dog_breeds.find_one({"id": breed_id})
+    if partition is not None:
+        breed = (await catalog_partitions.structures(partition))["catalog"].get(breed_id)
+    else:
+        breed = await db.dog_breeds.find_one({"id": breed_id})
     if not breed:
         raise HTTPException(status_code=404, detail="Breed not found")
-    return DogBreed(**breed)
+    return validate_breeds([breed])[0]
 
 @api_router.get("/breeds/search/{query}")
-async def search_breeds(query: str):
-    """Search breeds by name, temperament, or breed group"""
-    breeds = await db.dog_breeds.find({
-        "$or": [
-            {"name": {"$regex": query, "$options": "i"}},
-            {"temperament": {"$regex": query, "$options": "i"}},
-            {"breed_group": {"$regex": query, "$options": "i"}},
-            {"size": {"$regex": query, "$options": "i"}}
-        ]
+async def search_breeds(
+    query: str,
+    fuzzy: bool = False,
+    max_distance: int = Query(2, ge=0, le=3),
+    partition: Optional[PartitionKey] = Depends(catalog_partition),
+):
+    """Search breeds by name, temperament, or breed group
+
+    With fuzzy=true, breeds whose name or alias is within max_distance
+    edits of the query are included too, and every result carries a score.
+    """
+    # The query is matched as text, case-insensitively: case and spacing
+    # don't change what matches, so such queries share results
+    query = normalize(query)
+    if partition is None:
+        hot_queries.observe((query, fuzzy, max_distance if fuzzy else None))
+    return await find_breeds(query=query, fuzzy=fuzzy, max_distance=max_distance, partition=partition)
+
+# Fields a search query is matched against, case-insensitively
+SEARCH_FIELDS = ("name", "temperament", "breed_group", "size")
+
+@route_cache.cached("search", ttl=300, max_entries=2000, eviction="lfu", key=search_key, fallback=search_fallback)
+async def find_breeds(query: str, fuzzy: bool, max_distance: int, partition: Optional[PartitionKey]):
+    """Results for a normalized search query; see search_breeds"""
+    collection = db.dog_breeds if partition is None else catalog_partitions.collection(partition)
+    # Escaped, as lowercasing would change what a pattern like \D matches
+    pattern = re.escape(query)
+    breeds = await collection.find({
+        "$or": [{field: {"$regex": pattern, "$options": "i"}} for field in SEARCH_FIELDS]
     }).to_list(1000)
-    return [DogBreed(**breed) for breed in breeds]
-
-@api_router.post("/breeds/populate")
-async def populate_breeds():
-    """Populate the database with initial breed data"""
-    # Clear existing data
-    await db.dog_breeds.delete_many({})
-    
-    # Insert all breeds
-    breed_objects = []
-    for breed_data in ALL_BREEDS:
-        breed_obj = DogBreed(**breed_data)
-        breed_objects.append(breed_obj.dict())
-    
-    await db.dog_breeds.insert_many(breed_objects)
-    return {"message": f"Successfully populated {len(breed_objects)} dog breeds"}
+    return await search_results(query, fuzzy, max_distance, partition, breeds)
+
+async def search_results(query: str, fuzzy: bool, max_distance: int, partition: Optional[PartitionKey],
+                         breeds: List[dict]):
+    """Breeds matching query exactly, plus fuzzy matches ranked by score if asked for"""
+    if not fuzzy:
+        return validate_breeds(breeds)
+
+    if partition is not None:
+        index = (await catalog_partitions.structures(partition))["fuzzy"]
+    else:
+        record_cache("fuzzy_index", fuzzy_index is not None)
+        if fuzzy_index is None:
+            await rebuild_search_indexes()
+        index = fuzzy_index
+    matches = {match.breed_id: match for match in index.search(query, max_distance)}
+    with span("validate", stage="validate", count=len(breeds)):
+        results = [ScoredDogBreed(**breed, score=1.0) for breed in breeds]
+    record_validations(len(results))
+    exact_ids = {breed.id for breed in results}
+    missing = [breed_id for breed_id in matches if breed_id not in exact_ids]
+    if missing:
+        found = await stored_breeds(missing) if partition is None else await partition_breeds(partition, missing)
+        for breed in found:
+            match = matches[breed["id"]]
+            results.append(ScoredDogBreed(**breed, score=match.score, matched=match.term))
+            record_validations(1)
+    for result in results:
+        if result.id in matches and result.matched is None:
+            result.matched = matches[result.id].term
+    results.sort(key=lambda breed: -breed.score)
+    return results
+
+def health_condition(condition) -> HealthCondition:
+    return HealthCondition(
+        id=condition.id,
+        name=condition.name,
+        variants=condition.variants,
+        breed_count=len(condition.breed_ids),
+    )
+
+async def partition_conditions(partition: Optional[PartitionKey]) -> ConditionIndex:
+    if partition is not None:
+        return (await catalog_partitions.structures(partition))["conditions"]
+    record_cache("condition_index", condition_index is not None)
+    if condition_index is None:
+        await rebuild_search_indexes()
+    return condition_index
+
+@api_router.get("/conditions", response_model=List[HealthCondition])
+@route_cache.cached("conditions", ttl=300, max_entries=64)
+async def get_conditions(partition: Optional[PartitionKey] = Depends(catalog_partition)):
+    """All canonical health conditions, most common first"""
+    conditions = await partition_conditions(partition)
+    return [health_condition(condition) for condition in conditions.ranked()]
+
+@api_router.get("/conditions/{condition_id}/breeds", response_model=ConditionBreeds)
+@route_cache.cached("condition_breeds", ttl=300, max_entries=1000, negative_ttl=30)
+async def get_condition_breeds(condition_id: str, partition: Optional[PartitionKey] = Depends(catalog_partition)):
+    """Breeds prone to a health condition"""
+    condition = (await partition_conditions(partition)).get(condition_id)
+    if condition is None:
+        raise HTTPException(status_code=404, detail="Condition not found")
+    if partition is not None:
+        breeds = await partition_breeds(partition, condition.breed_ids)
+    else:
+        breeds = await stored_breeds(condition.breed_ids)
+    return ConditionBreeds(
+        condition=health_condition(condition),
+        count=len(condition.breed_ids),
+        breeds=validate_breeds(breeds),
+    )
+
+QUERY_LIMITS = query_limits_from_env()
+
+@api_router.post("/query")
+async def run_query(request: QueryRequest):
+    """Resolve exactly the fields and related resources a client selects; see query.py"""
+    try:
+        selections = parse(request.query)
+        cost = check_limits(selections, QUERY_LIMITS)
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if catalog_store is None:
+        await rebuild_search_indexes()
+    context = QueryContext(catalog_store, condition_index, await load_breed_stats(), stored_breeds)
+    data = await execute(selections, context)
+    return {"data": data, "extensions": {"cost": cost, "breed_batches": context.breeds.batches}}
+
+# Background jobs; catalog writers share a group so they never overlap
+job_queue = JobQueue(workers=int(os.environ.get('JOB_WORKERS', '2')))
+CATALOG_BATCH_SIZE = 1000
+MAX_IMPORT_BREEDS = 10000
+# Seconds a client asking for an empty catalog is told to wait
+INITIAL_POPULATE_RETRY_AFTER = 2
+
+async def sync_catalog(job: JobContext, records: Iterable[dict], total: int, replace: bool, message: str) -> dict:
+    """Write breed records matched by name, keeping the IDs of existing breeds
+
+    Only breeds that actually change get a new revision, so clients
+    syncing deltas download what changed rather than the whole catalog.
+    With replace, breeds missing from records are deleted (and tombstoned).
+    """
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+    kept = set()
+    first_revision = last_revision = None
+    records = iter(records)
+    done = 0
+    try:
+        while True:
+            # The last record wins when a name repeats
+            batch = list({record["name"]: record for record in itertools.islice(records, CATALOG_BATCH_SIZE)}.values())
+            if not batch:
+                break
+            existing = {
+                breed["name"]: breed
+                for breed in await db.dog_breeds.find({"name": {"$in": [record["name"] for record in batch]}}, {"_id": 0}).to_list(None)
+            }
+            writes = []
+            for record in batch:
+                before = existing.get(record["name"])
+                identity = {} if before is None else {
+                    key: before[key] for key in ("id", "created_at") if before.get(key) is not None
+                }
+                document = breed_document(DogBreed(**{**record, **identity}))
+                kept.add(document["id"])
+                if before is None:
+                    counts["inserted"] += 1
+                elif breed_delta(before, document) is None:
+                    counts["unchanged"] += 1
+                    continue
+                else:
+                    counts["updated"] += 1
+                writes.append(document)
+            if writes:
+                first = await change_broadcaster.log.allocate(len(writes))
+                for revision, document in enumerate(writes, first):
+                    document["revision"] = revision
+                await db.dog_breeds.bulk_write(
+                    [ReplaceOne({"id": document["id"]}, document, upsert=True) for document in writes], ordered=False
+                )
+                first_revision = first_revision or first
+                last_revision = first + len(writes) - 1
+            done += len(batch)
+            await job.progress(min(done, total), total, message)
+        if replace:
+            stale = [
+                breed["id"] for breed in await db.dog_breeds.find({}, {"_id": 0, "id": 1}).to_list(None)
+                if breed["id"] not in kept
+            ]
+            for start in range(0, len(stale), CATALOG_BATCH_SIZE):
+                chunk = stale[start:start + CATALOG_BATCH_SIZE]
+                await db.dog_breeds.delete_many({"id": {"$in": chunk}})
+                first = await add_tombstones(chunk)
+                first_revision = first_revision or first
+                last_revision = first + len(chunk) - 1
+                counts["deleted"] += len(chunk)
+    finally:
+        # Even a cancelled job leaves derived data matching what was written
+        await rebuild_derived()
+        if first_revision is not None:
+            await catalog_replaced(first_revision, last_revision)
+    return counts
+
+async def populate_catalog(job: JobContext) -> dict:
+    """Reset the catalog to the seed breeds"""
+    return await sync_catalog(job, ALL_BREEDS, len(ALL_BREEDS), True, "Populating breeds")
+
+async def import_catalog(job: JobContext, payload_id: str, replace: bool = False) -> dict:
+    """Upsert staged breeds by name, optionally deleting every other breed"""
+    payload = await db.job_payloads.find_one({"_id": payload_id})
+    if payload is None:
+        raise ValueError("Import payload not found")
+    try:
+        return await sync_catalog(job, payload["breeds"], len(payload["breeds"]), replace, "Importing breeds")
+    finally:
+        await db.job_payloads.delete_one({"_id": payload_id})
+
+async def import_partition(job: JobContext, payload_id: str, registry: str, locale: str, replace: bool = False) -> dict:
+    """Upsert staged breeds into a registry or locale partition
+
+    Breeds carrying an ID replace the breed with that ID; others are
+    matched by name, as in the main catalog.
+    """
+    key = partition_key(registry, locale)
+    payload = await db.job_payloads.find_one({"_id": payload_id})
+    if payload is None:
+        raise ValueError("Import payload not found")
+    collection = catalog_partitions.collection(key)
+    await catalog_partitions.ensure_indexes(key)
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+    records = payload["breeds"]
+    kept = set()
+    try:
+        for start in range(0, len(records), CATALOG_BATCH_SIZE):
+            # The last record wins when an ID or name repeats
+            batch = list({record.get("id") or record["name"]: record for record in records[start:start + CATALOG_BATCH_SIZE]}.values())
+            existing = await collection.find({"$or": [
+                {"id": {"$in": [record["id"] for record in batch if record.get("id")]}},
+                {"name": {"$in": [record["name"] for record in batch if not record.get("id")]}},
+            ]}, {"_id": 0}).to_list(None)
+            by_id = {breed["id"]: breed for breed in existing}
+            by_name = {breed["name"]: breed for breed in existing}
+            writes = []
+            for record in batch:
+                before = by_id.get(record["id"]) if record.get("id") else by_name.get(record["name"])
+                identity = {} if before is None else {
+                    field: before[field] for field in ("id", "created_at") if before.get(field) is not None
+                }
+                fields = {field: value for field, value in record.items() if value is not None}
+                document = breed_document(DogBreed(**{**fields, **identity}))
+                kept.add(document["id"])
+                if before is None:
+                    counts["inserted"] += 1
+                elif breed_delta(before, document) is None:
+                    counts["unchanged"] += 1
+                    continue
+                else:
+                    counts["updated"] += 1
+                writes.append(ReplaceOne({"id": document["id"]}, document, upsert=True))
+            if writes:
+                await collection.bulk_write(writes, ordered=False)
+            await job.progress(min(start + CATALOG_BATCH_SIZE, len(records)), len(records), f"Importing breeds into {key.id}")
+        if replace:
+            result = await collection.delete_many({"id": {"$nin": list(kept)}})
+            counts["deleted"] = result.deleted_count
+    finally:
+        # Every process rebuilds the partition's structures on next use
+        await catalog_partitions.register(key, await collection.count_documents({}))
+        await db.job_payloads.delete_one({"_id": payload_id})
+    return counts
+
+async def reindex_catalog(job: JobContext) -> dict:
+    """Rebuild the search indexes and the breed_stats rollups"""
+    await job.progress(0, 1, "Rebuilding derived structures")
+    await rebuild_derived()
+    await job.progress(1, 1, "Done")
+    return {"breeds": await db.dog_breeds.count_documents({})}
+
+async def warm_images(job: JobContext, concurrency: int = 8, timeout: float = 10.0) -> dict:
+    """Fetch every distinct image URL once, warming CDN caches and finding broken links"""
+    breeds = await db.dog_breeds.find({}, {"_id": 0, "id": 1, "image_url": 1}).to_list(None)
+    breed_ids = {}
+    for breed in breeds:
+        breed_ids.setdefault(breed["image_url"], []).append(breed["id"])
+    total = len(breed_ids)
+    await job.progress(0, total, "Fetching images")
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = []
+
+    async def fetch(http, url):
+        async with semaphore:
+            try:
+                response = await http.get(url)
+                error = f"HTTP {response.status_code}" if response.status_code >= 400 else None
+            except httpx.HTTPError as exc:
+                error = str(exc) or type(exc).__name__
+        if error:
+            failed.append({"url": url, "error": error, "breed_ids": breed_ids[url][:20]})
+
+    async with httpx.AsyncClient(follow_redirects=True, timeout=timeout) as http:
+        tasks = [asyncio.ensure_future(fetch(http, url)) for url in breed_ids]
+        try:
+            for done, task in enumerate(asyncio.as_completed(tasks), 1):
+                await task
+                await job.progress(done, total, "Fetching images")
+        finally:
+            for task in tasks:
+                task.cancel()
+    return {"urls": total, "ok": total - len(failed), "failed": failed[:100]}
+
+job_queue.register("populate", populate_catalog, group="catalog")
+job_queue.register("import", import_catalog, group="catalog")
+job_queue.register("import-partition", import_partition, group="catalog")
+job_queue.register("reindex", reindex_catalog, group="catalog")
+job_queue.register("image-warm", warm_images)
+
+async def submit_job(kind: str, response: Response, **params) -> dict:
+    try:
+        job = await job_queue.submit(kind, params)
+    except JobError as exc:
+        raise HTTPException(status_code=503, detail=str(exc))
+    response.headers["Location"] = f"/api/jobs/{job['id']}"
+    return job
+
+# Synthetic catalogs for scale testing are loaded by synthetic.py and
+# backend_bench.py, never through the API
+@api_router.post("/breeds/populate", status_code=202, response_model=JobStatus, dependencies=[Depends(require_admin)])
+async def populate_breeds(response: Response):
+    """Queue a job resetting the catalog to the seed breeds"""
+    return await submit_job("populate", response)
+
+async def stage_import(records: List[dict]) -> str:
+    """Stage import records in Mongo, so whichever worker claims the job can read them"""
+    if len(records) > MAX_IMPORT_BREEDS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_IMPORT_BREEDS} breeds per import")
+    payload_id = str(uuid.uuid4())
+    await db.job_payloads.insert_one({"_id": payload_id, "breeds": records, "created_at": datetime.utcnow()})
+    return payload_id
+
+@api_router.post("/breeds/import", status_code=202, response_model=JobStatus, dependencies=[Depends(require_admin)])
+async def import_breeds(breeds: List[DogBreedCreate], response: Response, replace: bool = False):
+    """Queue a job upserting the given breeds by name"""
+    payload_id = await stage_import([breed.dict() for breed in breeds])
+    return await submit_job("import", response, payload_id=payload_id, replace=replace)
+
+@api_router.post("/partitions/{registry}/{locale}/import", status_code=202, response_model=JobStatus, dependencies=[Depends(require_admin)])
+async def import_partition_breeds(
+    registry: str, locale: str, breeds: List[PartitionBreed], response: Response, replace: bool = False,
+):
+    """Queue a job upserting breeds into a registry or locale partition
+
+    The default partition is the main catalog, imported as by
+    POST /api/breeds/import (which matches by name and ignores IDs).
+    """
+    try:
+        key = partition_key(registry, locale)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if key.is_default:
+        payload_id = await stage_import([breed.dict(exclude={"id"}) for breed in breeds])
+        return await submit_job("import", response, payload_id=payload_id, replace=replace)
+    payload_id = await stage_import([breed.dict() for breed in breeds])
+    return await submit_job(
+        "import-partition", response, payload_id=payload_id, registry=key.registry, locale=key.locale, replace=replace,
+    )
+
+@api_router.get("/partitions", response_model=List[CatalogPartition])
+async def get_partitions():
+    """The main catalog and every registry or locale partition"""
+    partitions = [CatalogPartition(
+        registry=DEFAULT_REGISTRY, locale=DEFAULT_LOCALE,
+        count=await db.dog_breeds.count_documents({}), loaded=catalog_store is not None,
+    )]
+    for key, info in sorted((await catalog_partitions.known()).items()):
+        partitions.append(CatalogPartition(
+            registry=key.registry, locale=key.locale, count=info["count"],
+            loaded=catalog_partitions.is_loaded(key), updated_at=info["updated_at"],
+        ))
+    return partitions
+
+@api_router.get("/jobs", response_model=List[JobStatus])
+async def get_jobs(
+    status: Optional[str] = Query(None, pattern="^(queued|running|succeeded|failed|cancelled)$"),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """Most recent jobs first"""
+    return await job_queue.recent(status, limit)
+
+@api_router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@api_router.post("/jobs/{job_id}/cancel", response_model=JobStatus, dependencies=[Depends(require_admin)])
+async def cancel_job(job_id: str):
+    """Cancel a queued job, or ask a running one to stop at its next checkpoint"""
+    job = await job_queue.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@admin_router.post("/jobs/reindex", status_code=202, response_model=JobStatus)
+async def reindex_breeds(response: Response):
+    """Queue a rebuild of the search indexes and statistics rollups"""
+    return await submit_job("reindex", response)
+
+@admin_router.post("/jobs/image-warm", status_code=202, response_model=JobStatus)
+async def warm_breed_images(response: Response, concurrency: int = Query(8, ge=1, le=32)):
+    """Queue a job fetching every breed image once"""
+    return await submit_job("image-warm", response, concurrency=concurrency)
+
+# Sampling profiler for the live worker
+profile_store = ProfileStore()
+profile_lock = asyncio.Lock()
+
+@admin_router.post("/profile", response_class=PlainTextResponse)
+async def profile_worker(
+    seconds: float = Query(5, gt=0, le=60),
+    interval_ms: float = Query(5, ge=1, le=100),
+    mode: str = Query("cpu", pattern="^(cpu|wall)$"),
+):
+    """Sample this worker for a while and return collapsed stacks for a flamegraph
+
+    mode=cpu samples the event loop thread; mode=wall also records where
+    pending asyncio tasks are suspended.
+    """
+    if profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    async with profile_lock:
+        profiler = SamplingProfiler(interval_ms / 1000, mode, asyncio.get_running_loop()).start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={"X-Profile-Samples": str(profiler.sample_count)},
+    )
+
+@admin_router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_request_profile(profile_id: str):
+    """Collapsed stacks of a request profiled with the X-Profile header"""
+    collapsed = profile_store.get(profile_id)
+    if collapsed is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(collapsed)
+
+@admin_router.get("/slow-queries")
+async def get_slow_queries(limit: int = Query(50, ge=1, le=1000)):
+    """Recent MongoDB operations over the slow-query threshold, newest first"""
+    return {
+        "threshold_ms": slow_query_log.threshold_ms,
+        "explain": slow_query_log.explain,
+        "records": slow_query_log.records(limit),
+    }
+
+@admin_router.delete("/slow-queries")
+async def clear_slow_queries():
+    """Empty the slow-query ring buffer"""
+    slow_query_log.clear()
+    return {"message": "Slow query log cleared"}
+
+@admin_router.delete("/tombstones")
+async def prune_tombstones(older_than_days: float = Query(30, ge=0)):
+    """Drop old delete records; clients last synced before them must resync from 0"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    newest = await db.breed_tombstones.find({"deleted_at": {"$lt": cutoff}}).sort("revision", -1).to_list(1)
+    if not newest:
+        return {"deleted": 0, "horizon": await change_broadcaster.log.horizon()}
+    horizon = newest[0]["revision"]
+    # Raised first, so no client is told it is in sync while tombstones go
+    await change_broadcaster.log.raise_horizon(horizon)
+    result = await db.breed_tombstones.delete_many({"revision": {"$lte": horizon}})
+    return {"deleted": result.deleted_count, "horizon": horizon}
+
+@admin_router.delete("/partitions/{registry}/{locale}")
+async def drop_partition(registry: str, locale: str):
+    """Delete a registry or locale partition and its collection"""
+    try:
+        key = partition_key(registry, locale)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if key.is_default:
+        raise HTTPException(status_code=400, detail="The main catalog can't be dropped")
+    if not await catalog_partitions.drop(key):
+        raise HTTPException(status_code=404, detail="Partition not found")
+    return {"message": f"Dropped partition {key.id}"}
+
+@admin_router.get("/route-cache")
+async def get_route_cache():
+    """Entries, hit rates and evictions of each cached route"""
+    return {"enabled": route_cache.enabled, "routes": route_cache.stats()}
+
+@admin_router.delete("/route-cache")
+async def clear_route_cache():
+    """Drop every cached handler result in this worker"""
+    route_cache.clear()
+    return {"message": "Route cache cleared"}
+
+@admin_router.get("/search-queries")
+async def get_search_queries(limit: int = Query(50, ge=1, le=1000)):
+    """The most frequent searches, with whether their results are cached"""
+    counter = hot_queries.counter
+    queries = []
+    for entry in counter.top(limit):
+        query, fuzzy, max_distance = entry.key
+        params = {"query": query, "fuzzy": fuzzy, "max_distance": max_distance or 0, "partition": None}
+        queries.append({
+            "query": query, "fuzzy": fuzzy, "max_distance": max_distance,
+            "count": entry.count, "error": entry.error, "cached": route_cache.is_cached("search", params),
+        })
+    return {
+        "total": counter.total,
+        "tracked": len(counter),
+        "capacity": counter.capacity,
+        "precomputed": hot_queries.top,
+        "refreshes": hot_queries.refreshes,
+        "queries": queries,
+    }
+
+@admin_router.get("/snapshot")
+async def get_snapshot():
+    """The catalog snapshot this worker is serving from"""
+    if catalog_snapshots is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "directory": catalog_snapshots.directory,
+        "published_version": catalog_snapshots.current_version(),
+        "version": catalog_snapshot.version if catalog_snapshot else None,
+        "breeds": catalog_snapshot.count if catalog_snapshot else None,
+        "bytes": catalog_snapshot.size if catalog_snapshot else None,
+        "in_use": catalog_snapshot is not None and search_base.get("catalog") is catalog_snapshot.structures["catalog"],
+    }
 
 # Include the router in the main app
 app.include_router(api_router)
+app.include_router(admin_router)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+# Added before CORS so 429 responses still carry CORS headers
+rate_limit_backend = backend_from_env()
+if rate_limit_backend is not None:
+    app.add_middleware(
+        RateLimitMiddleware,
+        backend=rate_limit_backend,
+        limits=limits_from_env(),
+        concurrency=int(os.environ.get('RATE_LIMIT_CONCURRENCY', '16')),
+        proxy_hops=int(os.environ.get('RATE_LIMIT_PROXY_HOPS', '0')),
+        admin_token=ADMIN_TOKEN,
+    )
 
 app.add_middleware(
     CORSMiddleware,
@@ -985,6 +2247,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(MongoUnavailable)
+async def mongo_unavailable(request, exc: MongoUnavailable):
+    """Fail fast where there's no last known good data to serve"""
+    return JSONResponse(
+        {"detail": "Database temporarily unavailable"},
+        status_code=503,
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+app.add_middleware(StalenessMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(
+    TracingMiddleware,
+    exporter=exporter_from_env(),
+    sample_rate=float(os.environ.get('TRACE_SAMPLE_RATE', '1.0')),
+    server_timing_header=os.environ.get('SERVER_TIMING', '1') != '0',
+)
+app.add_middleware(RequestProfilerMiddleware, admin_token=ADMIN_TOKEN, store=profile_store)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -992,6 +2273,115 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def ensure_indexes():
+    """Create query indexes and backfill derived fields on older documents"""
+    slow_query_log.attach(asyncio.get_running_loop(), client[os.environ['DB_NAME']])
+    await db.dog_breeds.create_index("id")
+    await db.dog_breeds.create_index("health_conditions")
+    await job_queue.ensure_indexes(db.jobs)
+    await db.job_payloads.create_index("created_at", expireAfterSeconds=86400)
+    if rate_limit_backend is not None:
+        rate_limit_backend.attach(db.rate_limits)
+        await rate_limit_backend.ensure_indexes()
+    change_broadcaster.log.attach(db.catalog_changes, db.counters)
+    catalog_partitions.attach(db)
+    for key in await catalog_partitions.known():
+        await catalog_partitions.ensure_indexes(key)
+    await change_broadcaster.log.ensure_indexes()
+    await db.dog_breeds.create_index("revision")
+    await db.breed_tombstones.create_index("revision")
+    unrevised = await db.dog_breeds.find({"revision": {"$exists": False}}, {"_id": 1}).to_list(None)
+    if unrevised:
+        first = await change_broadcaster.log.allocate(len(unrevised))
+        await db.dog_breeds.bulk_write([
+            UpdateOne({"_id": breed["_id"]}, {"$set": {"revision": revision}})
+            for revision, breed in enumerate(unrevised, first)
+        ], ordered=False)
+        await catalog_replaced(first, first + len(unrevised) - 1)
+        logger.info("Assigned revisions to %d breeds", len(unrevised))
+    stale = await db.dog_breeds.find(
+        {"health_conditions": {"$exists": False}}, {"id": 1, "health_issues": 1}
+    ).to_list(None)
+    if stale:
+        await db.dog_breeds.bulk_write([
+            UpdateOne(
+                {"_id": breed["_id"]},
+                {"$set": {"health_conditions": condition_ids(breed.get("health_issues"))}},
+            )
+            for breed in stale
+        ], ordered=False)
+        logger.info("Backfilled health_conditions on %d breeds", len(stale))
+
+@app.on_event("startup")
+async def start_job_queue():
+    job_queue.start(db.jobs, db.job_locks)
+
+@app.on_event("startup")
+async def start_change_broadcaster():
+    await change_broadcaster.start()
+
+@app.on_event("startup")
+async def start_hot_queries():
+    hot_queries.start(lambda: change_broadcaster.stream(None, STREAM_HEARTBEAT), refresh_hot_searches)
+
+snapshot_watcher: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_snapshot_watcher():
+    """Serve from the published snapshot right away, then follow new versions"""
+    global snapshot_watcher
+    if catalog_snapshots is None:
+        return
+    await load_published_snapshot()
+    snapshot_watcher = asyncio.get_running_loop().create_task(watch_snapshots())
+
+# Connections opened up front, and endpoints requested in-process so their
+# responses are cached and every layer has paid its first-call costs
+WARMUP_CONNECTIONS = int(os.environ.get('WARMUP_CONNECTIONS', '4'))
+WARMUP_PATHS = [
+    path for path in os.environ.get('WARMUP_PATHS', '/api/bootstrap,/api/breeds,/api/conditions,/api/breeds/stats').split(',')
+    if path
+]
+
+@warmup.stage("mongo")
+async def open_mongo_pool():
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(WARMUP_CONNECTIONS)))
+
+@warmup.stage("catalog")
+async def load_catalog():
+    """Search structures (unless a snapshot already provided them) and rollups"""
+    if catalog_store is None:
+        await rebuild_search_indexes()
+    await load_breed_stats()
+
+@warmup.stage("responses")
+async def warm_responses():
+    # The first real request populates an empty catalog; warmup shouldn't
+    if not await db.dog_breeds.count_documents({}, limit=1):
+        return
+    headers = {"X-Admin-Token": ADMIN_TOKEN} if ADMIN_TOKEN else {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://warmup", headers=headers) as http:
+        for path in WARMUP_PATHS:
+            response = await http.get(path)
+            if response.status_code >= 500:
+                raise RuntimeError(f"GET {path} returned {response.status_code}")
+
+@app.on_event("startup")
+async def start_warmup():
+    """Last startup step; runs in the background so liveness probes pass meanwhile"""
+    warmup.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    warmup.stop()
+    if snapshot_watcher is not None:
+        snapshot_watcher.cancel()
+    if overlay_fold is not None:
+        overlay_fold.cancel()
+    hot_queries.stop()
+    change_broadcaster.stop()
+    await job_queue.stop()
+    rebuild_pipeline.shutdown()
     client.close()
\ No newline at end of file
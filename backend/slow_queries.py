@@ -0,0 +1,184 @@
+"""Slow MongoDB operation log fed by pymongo command monitoring
+
+Commands slower than a threshold are recorded with their filter shape
+(values replaced by type placeholders) in a ring buffer. Optionally the
+command is re-run through explain so each record shows whether the
+winning plan was a COLLSCAN or an IXSCAN and how many documents and
+keys were examined.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Command name -> where its filter lives
+FILTER_FIELDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "aggregate": "pipeline",
+}
+EXPLAINABLE = {"find", "count", "distinct", "findAndModify", "aggregate", "delete", "update"}
+# Commands that are never interesting here (and explain must not recurse)
+IGNORED = {"explain", "isMaster", "hello", "ismaster", "ping", "endSessions", "saslStart", "saslContinue", "getMore", "killCursors"}
+# Session and routing metadata that explain rejects or doesn't need
+_METADATA = ("lsid", "txnNumber", "$db", "$clusterTime", "$readPreference", "readConcern", "writeConcern")
+
+
+def shape(value: Any) -> Any:
+    """A query with its literal values replaced by type placeholders"""
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(not isinstance(item, (dict, list, tuple)) for item in value):
+            return [shape(value[0])]
+        return [shape(item) for item in value]
+    return f"<{type(value).__name__}>"
+
+
+def _filter_of(name: str, command: dict) -> Any:
+    if name in FILTER_FIELDS:
+        return command.get(FILTER_FIELDS[name])
+    if name == "delete":
+        return [d.get("q") for d in command.get("deletes", [])[:1]]
+    if name == "update":
+        return [u.get("q") for u in command.get("updates", [])[:1]]
+    return None
+
+
+def _plan_stages(plan: dict) -> List[str]:
+    stages = []
+    while isinstance(plan, dict) and plan:
+        stages.append(plan.get("stage", "?"))
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return stages
+
+
+def summarize_explain(result: dict) -> dict:
+    """Winning plan stages and examination counts from an explain result"""
+    planner = result.get("queryPlanner") or {}
+    if not planner and result.get("stages"):
+        # aggregate explain wraps the find stage in a $cursor stage
+        planner = result["stages"][0].get("$cursor", {}).get("queryPlanner", {})
+    stats = result.get("executionStats") or {}
+    stages = _plan_stages(planner.get("winningPlan", {}))
+    return {
+        "winning_plan": stages,
+        "collection_scan": "COLLSCAN" in stages,
+        "index_scan": "IXSCAN" in stages,
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "returned": stats.get("nReturned"),
+        "execution_ms": stats.get("executionTimeMillis"),
+    }
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    """Command listener keeping the slowest recent operations in a ring buffer"""
+
+    def __init__(self, threshold_ms: float = 100, capacity: int = 200,
+                 explain: bool = False, explain_interval: float = 60.0, explain_shapes: int = 1000):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.explain_shapes = explain_shapes
+        self._records: deque = deque(maxlen=capacity)
+        self._pending: Dict[tuple, tuple] = {}
+        # Query shape -> when it was last explained, oldest first
+        self._explained: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._database = None
+
+    def attach(self, loop: asyncio.AbstractEventLoop, database):
+        """Enable explain capture, run on loop against database"""
+        self._loop = loop
+        self._database = database
+
+    # pymongo calls these on its own threads; keep them cheap
+    def started(self, event):
+        if event.command_name in IGNORED:
+            return
+        self._pending[(event.connection_id, event.request_id)] = (event.command, event.database_name)
+
+    def succeeded(self, event):
+        self._finish(event, None)
+
+    def failed(self, event):
+        self._finish(event, str(getattr(event, "failure", "")) or "failed")
+
+    def _finish(self, event, error: Optional[str]):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms:
+            return
+        command, database = pending
+        name = event.command_name
+        query = _filter_of(name, command)
+        record = {
+            "time": datetime.utcnow().isoformat() + "Z",
+            "operation": name,
+            "database": database,
+            "collection": command.get(name) if isinstance(command.get(name), str) else None,
+            "duration_ms": round(duration_ms, 3),
+            "filter_shape": shape(query) if query is not None else None,
+            "error": error,
+            "plan": None,
+        }
+        with self._lock:
+            self._records.append(record)
+        logger.warning("Slow MongoDB %s on %s took %.1fms: %s",
+                       name, record["collection"], duration_ms, record["filter_shape"])
+        if self.explain and error is None and name in EXPLAINABLE:
+            self._schedule_explain(record, command)
+
+    def _schedule_explain(self, record: dict, command: dict):
+        if self._loop is None or self._database is None or self._loop.is_closed():
+            return
+        key = f"{record['operation']}:{record['collection']}:{record['filter_shape']}"
+        now = time.monotonic()
+        with self._lock:
+            # One explain per query shape per interval, however often it is slow
+            if now - self._explained.get(key, float("-inf")) < self.explain_interval:
+                return
+            self._explained[key] = now
+            self._explained.move_to_end(key)
+            # Shapes explained over an interval ago would be explained again
+            # anyway; past explain_shapes the oldest are forgotten early
+            while self._explained:
+                oldest, explained_at = next(iter(self._explained.items()))
+                if now - explained_at < self.explain_interval and len(self._explained) <= self.explain_shapes:
+                    break
+                del self._explained[oldest]
+        explained = {k: v for k, v in command.items() if k not in _METADATA}
+        self._loop.call_soon_threadsafe(
+            lambda: self._loop.create_task(self._explain(record, explained))
+        )
+
+    async def _explain(self, record: dict, command: dict):
+        try:
+            result = await self._database.command({"explain": command, "verbosity": "executionStats"})
+            record["plan"] = summarize_explain(result)
+        except Exception as exc:
+            record["plan"] = {"error": str(exc)}
+
+    def records(self, limit: Optional[int] = None) -> List[dict]:
+        """Most recent slow operations first"""
+        with self._lock:
+            records = list(self._records)
+        records.reverse()
+        return records[:limit] if limit else records
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
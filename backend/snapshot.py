@@ -0,0 +1,223 @@
+"""Read-only catalog snapshots shared between worker processes
+
+A snapshot is one file per catalog version holding the columnar catalog
+store and the search and facet indexes. Every worker maps it read-only,
+so their pages sit in the OS page cache once rather than in each
+worker's heap. Each structure is a set of flat buffers plus a small JSON
+description (its meta()), and is rebuilt around views into the mapping
+without copying the buffers.
+
+File layout: an 8-byte magic, the header length as a little-endian
+uint64, a JSON header, then 8-byte aligned sections. The header lists
+every section's offset, length and array typecode, plus each
+structure's type and meta.
+
+The header also records the change-log revision (see changes.py) the
+structures were built at, so a worker starting from a snapshot can tell
+whether the catalog has changed since.
+
+Publishing writes the new file under a temporary name, renames it into
+place and then atomically replaces the CURRENT pointer file, so readers
+only ever see complete snapshots. Workers poll CURRENT and remap when it
+names a newer version.
+"""
+import json
+import mmap
+import os
+import struct
+import time
+from typing import Any, Dict, List, Optional
+
+from catalog_store import CatalogStore
+from conditions import ConditionIndex
+from search_index import FuzzyIndex, SuggestIndex
+
+MAGIC = b"DOGSNAP1"
+FORMAT = 2
+# Structures a snapshot can hold, by type name
+TYPES = {cls.__name__: cls for cls in (CatalogStore, SuggestIndex, FuzzyIndex, ConditionIndex)}
+POINTER = "CURRENT"
+_HEADER_LENGTH = struct.Struct("<Q")
+_ALIGN = 8
+
+
+def _aligned(position: int) -> int:
+    return -(-position // _ALIGN) * _ALIGN
+
+
+def new_version() -> str:
+    """Version names sort in publication order"""
+    return f"{time.time_ns():020d}-{os.getpid()}"
+
+
+def published_at(version: str) -> float:
+    """When a version was published, as a Unix time"""
+    return int(version.split("-")[0]) / 1e9
+
+
+def write_snapshot(path: str, version: str, structures: Dict[str, Any], revision: Optional[int] = None):
+    """Write a snapshot file; it appears at path only once complete"""
+    sections: Dict[str, Any] = {}
+    for name, structure in structures.items():
+        sections.update((f"{name}/{key}", buffer) for key, buffer in structure.buffers().items())
+
+    layout: Dict[str, list] = {}
+    position = 0
+    for name, buffer in sections.items():
+        view = memoryview(buffer)
+        layout[name] = [position, view.nbytes, view.format]
+        position = _aligned(position + view.nbytes)
+    header = json.dumps({
+        "format": FORMAT,
+        "version": version,
+        "revision": revision,
+        "created_at": time.time(),
+        "structures": {
+            name: {"type": type(structure).__name__, "meta": structure.meta()}
+            for name, structure in structures.items()
+        },
+        "sections": layout,
+    }).encode()
+    data_start = _aligned(len(MAGIC) + _HEADER_LENGTH.size + len(header))
+
+    temporary = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(temporary, "wb") as f:
+            f.write(MAGIC)
+            f.write(_HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            for name, buffer in sections.items():
+                f.write(b"\0" * (data_start + layout[name][0] - f.tell()))
+                f.write(buffer)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.unlink(temporary)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class Snapshot:
+    """A mapped snapshot file and the structures read from it"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        (length,) = _HEADER_LENGTH.unpack_from(view, len(MAGIC))
+        start = len(MAGIC) + _HEADER_LENGTH.size
+        header = json.loads(bytes(view[start:start + length]))
+        if header["format"] != FORMAT:
+            raise ValueError(f"{path} has unsupported snapshot format {header['format']}")
+        data_start = _aligned(start + length)
+
+        def section(name: str) -> memoryview:
+            offset, size, typecode = header["sections"][name]
+            buffer = view[data_start + offset:data_start + offset + size]
+            return buffer if typecode == "B" else buffer.cast(typecode)
+
+        self.path = path
+        self.version: str = header["version"]
+        self.revision: Optional[int] = header.get("revision")
+        self.created_at: float = header["created_at"]
+        self.size = len(self._mmap)
+        # Buffers stay views into the mapping; only the small metas are copied
+        self.structures: Dict[str, Any] = {}
+        for name, description in header["structures"].items():
+            prefix = f"{name}/"
+            buffers = {key[len(prefix):]: section(key) for key in header["sections"] if key.startswith(prefix)}
+            self.structures[name] = TYPES[description["type"]].from_buffers(description["meta"], buffers)
+
+    @property
+    def count(self) -> Optional[int]:
+        """Breeds in the snapshot's catalog store"""
+        store = self.structures.get("catalog")
+        return None if store is None else len(store)
+
+
+class SnapshotDirectory:
+    """Snapshot files in one directory and the CURRENT pointer naming the live one"""
+
+    def __init__(self, directory: str, keep: int = 2, poll_interval: float = 2.0):
+        self.directory = directory
+        self.keep = keep
+        self.poll_interval = poll_interval
+
+    def path(self, version: str) -> str:
+        return os.path.join(self.directory, f"catalog-{version}.snap")
+
+    def current_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.directory, POINTER)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def publish(self, structures: Dict[str, Any], revision: Optional[int] = None) -> str:
+        """Write a new version and point CURRENT at it (blocking; run off the loop)
+
+        revision is the change-log revision the structures were built at.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        version = new_version()
+        write_snapshot(self.path(version), version, structures, revision)
+        pointer = os.path.join(self.directory, POINTER)
+        temporary = f"{pointer}.tmp-{os.getpid()}"
+        with open(temporary, "w") as f:
+            f.write(version)
+        os.replace(temporary, pointer)
+        self.prune()
+        return version
+
+    def prune(self):
+        # Workers still mapping a removed file keep reading it; the space is
+        # freed once the last mapping goes away
+        versions = self.versions()
+        current = self.current_version()
+        for version in versions[:-self.keep]:
+            if version != current:
+                try:
+                    os.unlink(self.path(version))
+                except FileNotFoundError:
+                    pass
+
+    def versions(self) -> List[str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[len("catalog-"):-len(".snap")] for name in names
+                      if name.startswith("catalog-") and name.endswith(".snap"))
+
+    def load(self, version: str) -> Snapshot:
+        return Snapshot(self.path(version))
+
+    def load_checked(self, version: str, revision: Optional[int]) -> Optional[Snapshot]:
+        """Load version unless it was built at another change-log revision
+
+        Such a snapshot was left from before the catalog last changed (or
+        from another database). None for revision (the log couldn't be
+        read) skips the check.
+        """
+        snapshot = self.load(version)
+        if revision is not None and snapshot.revision != revision:
+            return None
+        return snapshot
+
+
+def snapshots_from_env() -> Optional[SnapshotDirectory]:
+    """CATALOG_SNAPSHOT_DIR (unset: no snapshots), CATALOG_SNAPSHOT_KEEP
+    and CATALOG_SNAPSHOT_POLL (seconds between checks for a new version)"""
+    directory = os.environ.get("CATALOG_SNAPSHOT_DIR")
+    if not directory:
+        return None
+    return SnapshotDirectory(
+        directory,
+        keep=int(os.environ.get("CATALOG_SNAPSHOT_KEEP", "2")),
+        poll_interval=float(os.environ.get("CATALOG_SNAPSHOT_POLL", "2")),
+    )
@@ -0,0 +1,197 @@
+"""Static JSON export of the catalog for CDN or GitHub Pages hosting
+
+Writes the read side of the API as plain files, serialized from the same
+DogBreed models the API returns:
+
+    manifest.json                 logical names -> current file names
+    breeds.<hash>.json            the full catalog, as GET /api/breeds
+    index.<hash>.json             compact rows for list views
+    breeds/<id>.<hash>.json       one file per breed, as GET /api/breeds/{id}
+    search/<shard>.<hash>.json    token -> breed IDs, sharded by first character
+    facets/<field>.<hash>.json    value -> breed IDs per categorical field
+
+Every file but the manifest is named after a hash of its content, so it
+can be cached forever; only manifest.json has to be revalidated. The
+manifest is replaced last, so it never names a file that isn't there yet.
+
+    python static_export.py --out ../api
+    python static_export.py --out ../api --mongo --prune
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from catalog_store import CatalogStore
+from conditions import ConditionIndex
+from facets import FACET_FIELDS, encode, ranked_facet_counts
+from search_index import normalize
+
+DEFAULT_OUT = Path(__file__).parent.parent / "api"
+# Fields of the compact index rows, in order
+INDEX_FIELDS = ("id", "name", "size", "breed_group", "origin", "image_url")
+# Seed breeds get name-derived IDs and a fixed timestamp so repeated
+# exports of unchanged data produce identical files
+SEED_NAMESPACE = uuid.UUID("6f1c1f4e-5d0a-4c55-9a36-2f0f2f7d8a10")
+SEED_CREATED_AT = datetime(2025, 1, 1)
+HASH_LENGTH = 12
+
+_TOKEN_SPLIT = re.compile(r"[\s,/()\-]+")
+
+
+def seed_id(name: str) -> str:
+    return str(uuid.uuid5(SEED_NAMESPACE, name))
+
+
+def shard_key(token: str) -> str:
+    """Search shard for a token: its first character, or "_" for anything but a-z0-9"""
+    first = token[:1]
+    return first if first.isascii() and first.isalnum() else "_"
+
+
+def search_tokens(breed: dict) -> Iterable[str]:
+    """Words a breed is found by: the fields GET /api/breeds/search matches"""
+    for field in ("name", "temperament", "breed_group", "size"):
+        for token in _TOKEN_SPLIT.split(normalize(breed[field])):
+            if token:
+                yield token
+
+
+class StaticExport:
+    """Collects content-hashed files, then writes them and the manifest"""
+
+    def __init__(self, out: Path):
+        self.out = out
+        self.files: Dict[str, bytes] = {}
+
+    def add(self, stem: str, value: Any) -> str:
+        """Stage value as stem.<hash>.json; returns its path relative to out"""
+        data = encode(value)
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        path = f"{stem}.{digest}.json"
+        self.files[path] = data
+        return path
+
+    def write(self, manifest: dict, prune: bool = False) -> int:
+        """Write new files, then the manifest; returns how many files were written"""
+        written = 0
+        for path, data in self.files.items():
+            target = self.out / path
+            # Same name means same content; unchanged files are left alone
+            if target.exists():
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            temporary = target.with_name(f".{target.name}.tmp")
+            temporary.write_bytes(data)
+            os.replace(temporary, target)
+            written += 1
+        self.out.mkdir(parents=True, exist_ok=True)
+        temporary = self.out / ".manifest.json.tmp"
+        temporary.write_text(json.dumps(manifest, indent=2, ensure_ascii=False))
+        os.replace(temporary, self.out / "manifest.json")
+        if prune:
+            self.prune()
+        return written
+
+    def prune(self):
+        """Remove hashed files the manifest no longer names"""
+        pattern = re.compile(rf"\.[0-9a-f]{{{HASH_LENGTH}}}\.json$")
+        for path in self.out.rglob("*.json"):
+            relative = path.relative_to(self.out).as_posix()
+            if pattern.search(relative) and relative not in self.files:
+                path.unlink()
+
+
+def export_catalog(breeds: List[Any], out: Path, prune: bool = False) -> dict:
+    """Write every static file for breeds (DogBreed models); returns the manifest"""
+    from fastapi.encoders import jsonable_encoder
+
+    documents = jsonable_encoder(breeds)
+    export = StaticExport(out)
+
+    details = {document["id"]: export.add(f"breeds/{document['id']}", document) for document in documents}
+    catalog = export.add("breeds", documents)
+    index = export.add("index", {
+        "fields": list(INDEX_FIELDS) + ["detail"],
+        "breeds": [[document[field] for field in INDEX_FIELDS] + [details[document["id"]]] for document in documents],
+    })
+
+    shards: Dict[str, Dict[str, List[str]]] = defaultdict(lambda: defaultdict(list))
+    for document in documents:
+        for token in dict.fromkeys(search_tokens(document)):
+            shards[shard_key(token)][token].append(document["id"])
+    search = {
+        key: export.add(f"search/{key}", {token: ids for token, ids in sorted(tokens.items())})
+        for key, tokens in sorted(shards.items())
+    }
+
+    # Facets come from the columnar store's postings, conditions from
+    # the same canonicalization the API uses
+    store = CatalogStore.build([breed.dict() for breed in breeds])
+    facets = {}
+    for field in FACET_FIELDS:
+        values = [
+            {"value": value, "count": count,
+             "breeds": [store.value(row, "id") for row in store.rows_where(field, value)]}
+            for value, count in ranked_facet_counts(store, field)
+        ]
+        facets[field] = export.add(f"facets/{field}", {"field": field, "values": values})
+    conditions = ConditionIndex.build(documents)
+    facets["health_conditions"] = export.add("facets/health_conditions", {
+        "field": "health_conditions",
+        "values": [
+            {"value": c.id, "name": c.name, "variants": c.variants,
+             "count": len(c.breed_ids), "breeds": list(c.breed_ids)}
+            for c in conditions.ranked()
+        ],
+    })
+
+    files = {"breeds": catalog, "index": index, "search": search, "facets": facets}
+    manifest = {
+        # Changes whenever any exported file does
+        "version": hashlib.sha256(encode(sorted(export.files))).hexdigest()[:HASH_LENGTH],
+        "count": len(documents),
+        "files": files,
+    }
+    written = export.write(manifest, prune)
+    print(f"Exported {len(documents)} breeds to {out} ({written} new of {len(export.files)} files)", file=sys.stderr)
+    return manifest
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", type=Path, default=DEFAULT_OUT, help=f"output directory (default {DEFAULT_OUT})")
+    parser.add_argument("--mongo", action="store_true",
+                        help="export the catalog in MONGO_URL/DB_NAME instead of the seed data")
+    parser.add_argument("--prune", action="store_true", help="delete hashed files the new manifest doesn't use")
+    args = parser.parse_args(argv)
+
+    if not args.mongo:
+        # server.py reads these at import time; a seed export never connects
+        os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+        os.environ.setdefault("DB_NAME", "dog_breeds")
+    # server.py holds the seed catalog and the response model
+    from server import ALL_BREEDS, DogBreed
+
+    if args.mongo:
+        from pymongo import MongoClient
+
+        collection = MongoClient(os.environ["MONGO_URL"])[os.environ["DB_NAME"]].dog_breeds
+        breeds = [DogBreed(**document) for document in collection.find({}, {"_id": 0})]
+    else:
+        breeds = [
+            DogBreed(**breed, id=seed_id(breed["name"]), created_at=SEED_CREATED_AT)
+            for breed in ALL_BREEDS
+        ]
+    export_catalog(breeds, args.out, args.prune)
+
+
+if __name__ == "__main__":
+    main()
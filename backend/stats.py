@@ -0,0 +1,320 @@
+"""Materialized catalog rollups, maintained incrementally on breed writes
+
+Each cell is one document in a side collection. Histogram and health
+issue counts are sub-documents keyed by value, so a breed write becomes
+$inc updates of the cells it touches, and writes from several workers
+add up instead of overwriting each other.
+"""
+import heapq
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import unquote
+
+# Dimensions a dashboard can group by; "all" is the single catalog-wide cell
+DIMENSIONS = (
+    "all",
+    "size",
+    "breed_group",
+    "origin",
+    "care_level",
+    "exercise_needs",
+    "grooming_needs",
+    "health_issues",
+)
+
+LIFESPAN_BUCKET = 1  # years
+WEIGHT_BUCKET = 10  # lbs
+TOP_HEALTH_ISSUES = 5
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def parse_range(text: str) -> Optional[Tuple[float, float]]:
+    """Lowest and highest number in strings like "Males: 45-60 lbs, Females: 35-50 lbs" """
+    numbers = [float(n) for n in _NUMBER.findall(text or "")]
+    if not numbers:
+        return None
+    return min(numbers), max(numbers)
+
+
+def _bucket(value: float, width: int) -> int:
+    return int(value // width) * width
+
+
+def field_name(value) -> str:
+    """value as a MongoDB field name: no dots and no leading $"""
+    return str(value).replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def _counts(fields: dict, parse) -> Counter:
+    # Counts that reached zero stay in the document until it is rewritten
+    return Counter({parse(unquote(field)): count for field, count in fields.items() if count > 0})
+
+
+class _Measure:
+    """Running sum, extremes and histogram of one parsed range field"""
+
+    __slots__ = ("n", "total", "lows", "highs", "histogram")
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0.0
+        self.lows: Counter = Counter()
+        self.highs: Counter = Counter()
+        self.histogram: Counter = Counter()
+
+    def apply(self, parsed: Optional[Tuple[float, float]], width: int, sign: int):
+        if parsed is None:
+            return
+        low, high = parsed
+        midpoint = (low + high) / 2
+        self.n += sign
+        self.total += sign * midpoint
+        for counter, key in (
+            (self.lows, low),
+            (self.highs, high),
+            (self.histogram, _bucket(midpoint, width)),
+        ):
+            counter[key] += sign
+            if counter[key] <= 0:
+                del counter[key]
+
+    @staticmethod
+    def increments(parsed: Optional[Tuple[float, float]], width: int, sign: int,
+                   path: str) -> Iterable[Tuple[str, float]]:
+        """What apply() changes, as $inc paths under path and amounts"""
+        if parsed is None:
+            return
+        low, high = parsed
+        midpoint = (low + high) / 2
+        yield f"{path}.n", sign
+        yield f"{path}.total", sign * midpoint
+        yield f"{path}.lows.{field_name(low)}", sign
+        yield f"{path}.highs.{field_name(high)}", sign
+        yield f"{path}.histogram.{field_name(_bucket(midpoint, width))}", sign
+
+    def merge(self, other: "_Measure"):
+        self.n += other.n
+        self.total += other.total
+        self.lows.update(other.lows)
+        self.highs.update(other.highs)
+        self.histogram.update(other.histogram)
+
+    def summary(self, width: int) -> dict:
+        if not self.n:
+            return {"count": 0, "avg": None, "min": None, "max": None, "histogram": []}
+        return {
+            "count": self.n,
+            "avg": round(self.total / self.n, 2),
+            "min": min(self.lows),
+            "max": max(self.highs),
+            "histogram": [
+                {"from": start, "to": start + width, "count": count}
+                for start, count in sorted(self.histogram.items())
+            ],
+        }
+
+    def to_document(self) -> dict:
+        return {
+            "n": self.n,
+            "total": self.total,
+            "lows": {field_name(key): count for key, count in self.lows.items()},
+            "highs": {field_name(key): count for key, count in self.highs.items()},
+            "histogram": {field_name(key): count for key, count in self.histogram.items()},
+        }
+
+    @classmethod
+    def from_document(cls, doc: dict) -> "_Measure":
+        # A cell created by $inc only has the parts its breeds had
+        measure = cls()
+        measure.n = doc.get("n", 0)
+        measure.total = doc.get("total", 0.0)
+        measure.lows = _counts(doc.get("lows", {}), float)
+        measure.highs = _counts(doc.get("highs", {}), float)
+        measure.histogram = _counts(doc.get("histogram", {}), int)
+        return measure
+
+
+class _Cell:
+    __slots__ = ("count", "lifespan", "weight", "health_issues")
+
+    def __init__(self):
+        self.count = 0
+        self.lifespan = _Measure()
+        self.weight = _Measure()
+        self.health_issues: Counter = Counter()
+
+    def apply(self, lifespan, weight, issues: Set[str], sign: int):
+        self.count += sign
+        self.lifespan.apply(lifespan, LIFESPAN_BUCKET, sign)
+        self.weight.apply(weight, WEIGHT_BUCKET, sign)
+        for issue in issues:
+            self.health_issues[issue] += sign
+            if self.health_issues[issue] <= 0:
+                del self.health_issues[issue]
+
+    @staticmethod
+    def increments(lifespan, weight, issues: Set[str], sign: int) -> Iterable[Tuple[str, float]]:
+        """What apply() changes, as $inc paths and amounts"""
+        yield "count", sign
+        yield from _Measure.increments(lifespan, LIFESPAN_BUCKET, sign, "lifespan")
+        yield from _Measure.increments(weight, WEIGHT_BUCKET, sign, "weight")
+        for issue in issues:
+            yield f"health_issues.{field_name(issue)}", sign
+
+    def merge(self, other: "_Cell"):
+        self.count += other.count
+        self.lifespan.merge(other.lifespan)
+        self.weight.merge(other.weight)
+        self.health_issues.update(other.health_issues)
+
+    def summary(self, key: str) -> dict:
+        return {
+            "key": key,
+            "count": self.count,
+            "lifespan_years": self.lifespan.summary(LIFESPAN_BUCKET),
+            "weight_lbs": self.weight.summary(WEIGHT_BUCKET),
+            "top_health_issues": [
+                {"name": name, "count": count}
+                # Ties broken by name so the order doesn't depend on build order
+                for name, count in heapq.nsmallest(
+                    TOP_HEALTH_ISSUES, self.health_issues.items(), key=lambda item: (-item[1], item[0])
+                )
+            ],
+        }
+
+
+def _cell_keys(breed: dict) -> Iterable[Tuple[str, str]]:
+    yield "all", ""
+    for dimension in DIMENSIONS[1:-1]:
+        value = breed.get(dimension)
+        if value:
+            yield dimension, value
+    for issue in set(breed.get("health_issues") or ()):
+        yield "health_issues", issue
+
+
+def cell_id(dimension: str, key: str) -> str:
+    return f"{dimension}:{key}"
+
+
+class BreedRollups:
+    """Per-dimension rollup cells with cached, ready-to-serve summaries"""
+
+    def __init__(self):
+        self._cells: Dict[Tuple[str, str], _Cell] = {}
+        self._summaries: Dict[str, dict] = {}
+
+    @classmethod
+    def build(cls, breeds: Iterable[dict]) -> "BreedRollups":
+        rollups = cls()
+        for breed in breeds:
+            rollups.apply(None, breed)
+        return rollups
+
+    def apply(self, before: Optional[dict], after: Optional[dict]) -> Set[Tuple[str, str]]:
+        """Move one breed's contribution from before to after; return touched cells"""
+        touched = set()
+        for breed, sign in ((before, -1), (after, 1)):
+            if breed is None:
+                continue
+            # Parsed once per breed rather than once per cell it falls in
+            lifespan = parse_range(breed.get("lifespan"))
+            weight = parse_range(breed.get("weight"))
+            issues = set(breed.get("health_issues") or ())
+            for key in _cell_keys(breed):
+                cell = self._cells.get(key)
+                if cell is None:
+                    cell = self._cells[key] = _Cell()
+                cell.apply(lifespan, weight, issues, sign)
+                if cell.count <= 0:
+                    del self._cells[key]
+                touched.add(key)
+        # Summaries are rendered lazily, once per dimension per change
+        for dimension, _ in touched:
+            self._summaries.pop(dimension, None)
+        return touched
+
+    def increments(self, before: Optional[dict], after: Optional[dict]) -> Dict[Tuple[str, str], Dict[str, float]]:
+        """The $inc update per cell that apply(before, after) amounts to
+
+        Cells the write leaves as they were are not included.
+        """
+        changes: Dict[Tuple[str, str], Counter] = {}
+        for breed, sign in ((before, -1), (after, 1)):
+            if breed is None:
+                continue
+            lifespan = parse_range(breed.get("lifespan"))
+            weight = parse_range(breed.get("weight"))
+            issues = set(breed.get("health_issues") or ())
+            for key in _cell_keys(breed):
+                change = changes.setdefault(key, Counter())
+                for path, amount in _Cell.increments(lifespan, weight, issues, sign):
+                    change[path] += amount
+        updates = {}
+        for key, change in changes.items():
+            update = {path: amount for path, amount in change.items() if amount}
+            if update:
+                updates[key] = update
+        return updates
+
+    def merge(self, other: "BreedRollups") -> "BreedRollups":
+        """Fold in rollups built from a disjoint set of breeds"""
+        for key, cell in other._cells.items():
+            mine = self._cells.get(key)
+            if mine is None:
+                self._cells[key] = cell
+            else:
+                mine.merge(cell)
+        self._summaries.clear()
+        return self
+
+    def summary(self, group_by: str = "all") -> dict:
+        """Dashboard payload for one dimension, largest groups first"""
+        cached = self._summaries.get(group_by)
+        if cached is None:
+            groups = [
+                cell.summary(key)
+                for (dimension, key), cell in self._cells.items()
+                if dimension == group_by
+            ]
+            groups.sort(key=lambda group: (-group["count"], group["key"]))
+            total = self._cells.get(("all", ""))
+            cached = self._summaries[group_by] = {
+                "group_by": group_by,
+                "total_breeds": total.count if total else 0,
+                "groups": groups,
+            }
+        return cached
+
+    def to_documents(self, keys: Optional[Iterable[Tuple[str, str]]] = None) -> List[dict]:
+        """Side-collection documents; a cell that no longer exists has count 0"""
+        keys = self._cells.keys() if keys is None else keys
+        documents = []
+        for dimension, key in keys:
+            cell = self._cells.get((dimension, key)) or _Cell()
+            documents.append({
+                "_id": cell_id(dimension, key),
+                "dimension": dimension,
+                "key": key,
+                "count": cell.count,
+                "lifespan": cell.lifespan.to_document(),
+                "weight": cell.weight.to_document(),
+                "health_issues": {field_name(issue): count for issue, count in cell.health_issues.items()},
+            })
+        return documents
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[dict]) -> "BreedRollups":
+        rollups = cls()
+        for doc in documents:
+            if doc["count"] <= 0:
+                continue
+            cell = _Cell()
+            cell.count = doc["count"]
+            cell.lifespan = _Measure.from_document(doc.get("lifespan", {}))
+            cell.weight = _Measure.from_document(doc.get("weight", {}))
+            cell.health_issues = _counts(doc.get("health_issues", {}), str)
+            rollups._cells[(doc["dimension"], doc["key"])] = cell
+        return rollups
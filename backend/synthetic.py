@@ -0,0 +1,262 @@
+"""Deterministic synthetic breed catalogs for scale testing
+
+Records mimic the seed catalog: categorical fields follow its
+distributions (conditioned on size), ranges keep its string formats,
+and descriptions are assembled from its sentences to similar lengths.
+
+    python synthetic.py --count 100000 --ndjson breeds.ndjson
+    python synthetic.py --count 1000000 --mongo --drop
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from stats import parse_range
+
+SYLLABLES = [
+    "ar", "bel", "cor", "dan", "el", "fen", "gar", "hal", "is", "jor",
+    "kel", "lin", "mar", "nor", "os", "pel", "quin", "ros", "sal", "tor",
+    "ul", "val", "wen", "yor", "zan", "bri", "cal", "dor", "fin", "gil",
+    "hin", "kar", "lom", "mer", "nev", "par", "rin", "sor", "tal", "ver",
+]
+
+EXTRA_ORIGINS = [
+    "Hungary", "Norway", "Finland", "Spain", "Italy", "Belgium", "Netherlands",
+    "Croatia", "Tibet", "Mexico", "Argentina", "Ireland", "Wales", "Denmark",
+]
+
+CATEGORICAL_FIELDS = (
+    "care_level", "exercise_needs", "grooming_needs", "breed_group",
+    "good_with_kids", "good_with_pets",
+)
+
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+
+def _choice_weights(counter: Counter) -> Tuple[list, list]:
+    items = sorted(counter.items(), key=lambda item: str(item[0]))
+    return [item[0] for item in items], [item[1] for item in items]
+
+
+class SeedProfile:
+    """Empirical field distributions of a seed catalog"""
+
+    def __init__(self, seed_breeds: List[dict]):
+        if not seed_breeds:
+            raise ValueError("seed catalog is empty")
+        self.sizes = _choice_weights(Counter(b["size"] for b in seed_breeds))
+        self.by_size: Dict[str, List[dict]] = defaultdict(list)
+        for breed in seed_breeds:
+            self.by_size[breed["size"]].append(breed)
+        self.origins = _choice_weights(Counter(b["origin"] for b in seed_breeds))
+        self.temperament_words = _choice_weights(Counter(
+            word.strip() for b in seed_breeds for word in b["temperament"].split(",")
+        ))
+        self.temperament_lengths = _choice_weights(Counter(
+            len(b["temperament"].split(",")) for b in seed_breeds
+        ))
+        self.health_issues = _choice_weights(Counter(
+            issue for b in seed_breeds for issue in b["health_issues"]
+        ))
+        self.health_lengths = _choice_weights(Counter(len(b["health_issues"]) for b in seed_breeds))
+        self.image_urls = sorted({b["image_url"] for b in seed_breeds})
+        self.name_suffixes = sorted({
+            b["name"].split()[-1] for b in seed_breeds
+            if " " in b["name"] and b["name"].split()[-1].isalpha()
+        })
+        self.description_lengths = [len(b["description"]) for b in seed_breeds]
+        self.sexed_weight_ratio = sum("Males:" in b["weight"] for b in seed_breeds) / len(seed_breeds)
+        self.sentences: List[str] = []
+        for breed in seed_breeds:
+            name = breed["name"]
+            for sentence in _SENTENCE.split(breed["description"]):
+                # Sentences refer to their breed by name; make that a slot
+                self.sentences.append(sentence.replace(name, "{name}"))
+
+
+def _word(index: int, length: int, order: List[List[str]]) -> str:
+    parts = []
+    for position in range(length):
+        parts.append(order[position][index % len(SYLLABLES)])
+        index //= len(SYLLABLES)
+    return "".join(parts).capitalize()
+
+
+class BreedGenerator:
+    """Streams deterministic, unique DogBreedCreate-shaped records"""
+
+    def __init__(self, seed_breeds: List[dict], seed: int = 0):
+        self.profile = SeedProfile(seed_breeds)
+        self.seed = seed
+        rng = random.Random(seed)
+        self._syllable_order = [rng.sample(SYLLABLES, len(SYLLABLES)) for _ in range(4)]
+        self._suffixes = self.profile.name_suffixes or ["Dog"]
+
+    def name(self, index: int) -> str:
+        """Unique name for the index-th record"""
+        suffix = self._suffixes[index % len(self._suffixes)]
+        rest = index // len(self._suffixes)
+        length = 2
+        capacity = len(SYLLABLES) ** length
+        while rest >= capacity:
+            rest -= capacity
+            length += 1
+            capacity = len(SYLLABLES) ** length
+        # An odd stride coprime to the capacity scatters neighbouring indexes
+        stride = 7919 if capacity % 7919 else 7927
+        return f"{_word(rest * stride % capacity, length, self._syllable_order)} {suffix}"
+
+    def generate(self, count: int, start: int = 0) -> Iterator[dict]:
+        for index in range(start, start + count):
+            yield self.record(index)
+
+    def record(self, index: int) -> dict:
+        """The index-th record; independent of which records came before"""
+        rng = random.Random(f"{self.seed}:{index}")
+        profile = self.profile
+        name = self.name(index)
+        size = rng.choices(*profile.sizes)[0]
+        peers = profile.by_size[size]
+        breed = {"name": name, "size": size}
+        for field in CATEGORICAL_FIELDS:
+            breed[field] = rng.choice(peers)[field]
+
+        if rng.random() < 0.85:
+            breed["origin"] = rng.choices(*profile.origins)[0]
+        else:
+            breed["origin"] = rng.choice(EXTRA_ORIGINS)
+
+        words = profile.temperament_words
+        wanted = rng.choices(*profile.temperament_lengths)[0]
+        temperament: List[str] = []
+        while len(temperament) < wanted:
+            word = rng.choices(*words)[0]
+            if word not in temperament:
+                temperament.append(word)
+        breed["temperament"] = ", ".join(temperament)
+
+        breed["lifespan"] = self._range(rng, rng.choice(peers)["lifespan"], "years", spread=1)
+        breed["weight"] = self._weight(rng, rng.choice(peers)["weight"])
+        breed["height"] = self._range(rng, rng.choice(peers)["height"], "inches", spread=2)
+        breed["image_url"] = rng.choice(profile.image_urls)
+        breed["description"] = self._description(rng, name)
+
+        issues: List[str] = []
+        wanted = rng.choices(*profile.health_lengths)[0]
+        while len(issues) < wanted:
+            issue = rng.choices(*profile.health_issues)[0]
+            if issue not in issues:
+                issues.append(issue)
+        breed["health_issues"] = issues
+        return breed
+
+    def _jitter(self, rng: random.Random, text: str, spread: float) -> Tuple[int, int]:
+        low, high = parse_range(text) or (10, 20)
+        low = max(1, round(low + rng.uniform(-spread, spread)))
+        high = max(low + 1, round(high + rng.uniform(-spread, spread)))
+        return low, high
+
+    def _range(self, rng: random.Random, text: str, unit: str, spread: float) -> str:
+        low, high = self._jitter(rng, text, spread)
+        return f"{low}-{high} {unit}"
+
+    def _weight(self, rng: random.Random, text: str) -> str:
+        low, high = parse_range(text) or (20, 40)
+        low, high = self._jitter(rng, f"{low}-{high}", max(1, (high - low) * 0.1))
+        if rng.random() < self.profile.sexed_weight_ratio:
+            female_low, female_high = max(1, round(low * 0.8)), max(2, round(high * 0.85))
+            return f"Males: {low}-{high} lbs, Females: {female_low}-{female_high} lbs"
+        return f"{low}-{high} lbs"
+
+    def _description(self, rng: random.Random, name: str) -> str:
+        target = rng.choice(self.profile.description_lengths)
+        pool = self.profile.sentences
+        sentences: List[str] = []
+        length = 0
+        for position in rng.sample(range(len(pool)), len(pool)):
+            if length >= target:
+                break
+            sentence = pool[position].replace("{name}", name)
+            sentences.append(sentence)
+            length += len(sentence) + 1
+        return " ".join(sentences)
+
+
+def stable_id(seed: int, index: int) -> str:
+    """Deterministic UUID4-shaped ID for a generated record"""
+    return str(uuid.UUID(int=random.Random(f"id:{seed}:{index}").getrandbits(128), version=4))
+
+
+def write_ndjson(records: Iterable[dict], stream) -> int:
+    count = 0
+    for record in records:
+        stream.write(json.dumps(record))
+        stream.write("\n")
+        count += 1
+    return count
+
+
+def _batches(records: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start", type=int, default=0, help="index of the first record")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--ndjson", help="write records to this file ('-' for stdout)")
+    output.add_argument("--mongo", action="store_true", help="bulk insert into MONGO_URL/DB_NAME")
+    parser.add_argument("--drop", action="store_true", help="clear dog_breeds before inserting")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    # server.py holds the seed catalog and the document shape
+    from server import ALL_BREEDS, DogBreed, breed_document
+
+    generator = BreedGenerator(ALL_BREEDS, args.seed)
+    records = generator.generate(args.count, args.start)
+
+    if args.ndjson:
+        if args.ndjson == "-":
+            written = write_ndjson(records, sys.stdout)
+        else:
+            with open(args.ndjson, "w") as stream:
+                written = write_ndjson(records, stream)
+        print(f"Wrote {written} breeds to {args.ndjson}", file=sys.stderr)
+        return
+
+    import os
+    from pymongo import MongoClient
+
+    collection = MongoClient(os.environ["MONGO_URL"])[os.environ["DB_NAME"]].dog_breeds
+    if args.drop:
+        collection.delete_many({})
+    created_at = datetime.utcnow()
+    documents = (
+        breed_document(DogBreed(**record, id=stable_id(args.seed, args.start + i), created_at=created_at))
+        for i, record in enumerate(records)
+    )
+    written = 0
+    for batch in _batches(documents, args.batch_size):
+        collection.insert_many(batch, ordered=False)
+        written += len(batch)
+        print(f"Inserted {written}/{args.count}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
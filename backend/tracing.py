@@ -0,0 +1,389 @@
+"""Lightweight span tracing with Server-Timing and OTLP/JSON export
+
+Spans nest through a context variable, so handlers and the Mongo layer
+open them without passing anything around. Each finished request is a
+trace: its per-stage totals go into the Server-Timing header, and the
+spans can be exported in OTLP/JSON form to a file or a collector.
+"""
+import abc
+import asyncio
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache, wraps
+from typing import Any, Dict, List, Optional
+
+from fastapi.datastructures import Default, DefaultPlaceholder
+from fastapi.responses import JSONResponse, Response
+from fastapi.routing import APIRoute
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "dog-breeds-api")
+# Stages reported in Server-Timing, in display order
+STAGES = ("cache", "db", "validate", "handler", "encode")
+
+
+class Span:
+    __slots__ = ("name", "stage", "trace", "trace_id", "span_id", "parent_id",
+                 "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace: "Trace", parent: Optional["Span"], stage: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.stage = stage
+        self.trace = trace
+        self.trace_id = trace.trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent else trace.parent_id
+        # OTLP span kinds: 2 = SERVER for the request, 1 = INTERNAL below it
+        self.kind = 1 if parent else 2
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 0},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    """All spans of one request"""
+
+    __slots__ = ("trace_id", "parent_id", "spans")
+
+    def __init__(self, trace_id: Optional[str] = None, parent_id: Optional[str] = None):
+        self.trace_id = trace_id or f"{random.getrandbits(128):032x}"
+        self.parent_id = parent_id
+        self.spans: List[Span] = []
+
+    def stage_totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            if span.stage:
+                totals[span.stage] = totals.get(span.stage, 0.0) + span.duration_ms
+        return totals
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, stage: Optional[str] = None, **attributes):
+    """Open a child of the current span; a no-op outside a traced request"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, parent.trace, parent, stage, attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except Exception as exc:
+        child.error = repr(exc)
+        raise
+    finally:
+        _current.reset(token)
+        child.end_ns = time.time_ns()
+        parent.trace.spans.append(child)
+
+
+def record_span(name: str, stage: str, start_ns: int, end_ns: int, **attributes):
+    """Add an already-measured span under the current span"""
+    parent = _current.get()
+    if parent is None:
+        return
+    child = Span(name, parent.trace, parent, stage, attributes)
+    child.start_ns, child.end_ns = start_ns, end_ns
+    parent.trace.spans.append(child)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def to_otlp(traces: List[Trace]) -> dict:
+    """An OTLP/JSON ExportTraceServiceRequest for the given traces"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{
+                "scope": {"name": "dogbreeds.tracing"},
+                "spans": [span.to_otlp() for trace in traces for span in trace.spans],
+            }],
+        }]
+    }
+
+
+class _Exporter(abc.ABC):
+    """Batches finished traces on a background thread, off the request path"""
+
+    def __init__(self, batch_size: int = 64, interval: float = 2.0, max_queue: int = 10000):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: "queue.Queue[Trace]" = queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def submit(self, trace: Trace):
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            pass  # Dropping traces beats blocking requests
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self.export(batch)
+            except Exception:
+                logger.exception("Trace export failed")
+
+    @abc.abstractmethod
+    def export(self, traces: List[Trace]):
+        """Send one batch of traces; runs on the exporter thread"""
+
+
+class FileExporter(_Exporter):
+    """Appends one OTLP/JSON document per batch, one per line"""
+
+    def __init__(self, path: str, **kwargs):
+        self.path = path
+        super().__init__(**kwargs)
+
+    def export(self, traces: List[Trace]):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(to_otlp(traces)))
+            f.write("\n")
+
+
+class OTLPHttpExporter(_Exporter):
+    """POSTs OTLP/JSON to a collector's /v1/traces endpoint"""
+
+    def __init__(self, endpoint: str, **kwargs):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        super().__init__(**kwargs)
+
+    def export(self, traces: List[Trace]):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(to_otlp(traces)).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        urllib.request.urlopen(request, timeout=5).close()
+
+
+def exporter_from_env() -> Optional[_Exporter]:
+    """TRACE_EXPORT=file (TRACE_FILE) or otlp (OTEL_EXPORTER_OTLP_ENDPOINT)"""
+    kind = os.environ.get("TRACE_EXPORT", "").lower()
+    if kind == "file":
+        return FileExporter(os.environ.get("TRACE_FILE", "traces.jsonl"))
+    if kind == "otlp":
+        return OTLPHttpExporter(os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318"))
+    return None
+
+
+def _parse_traceparent(value: str):
+    # W3C trace context: version-traceid-parentid-flags
+    parts = value.split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        return parts[1], parts[2]
+    return None, None
+
+
+def server_timing(trace: Trace, total_ms: float) -> str:
+    totals = trace.stage_totals()
+    entries = [f"{stage};dur={totals[stage]:.2f}" for stage in STAGES if stage in totals]
+    entries.append(f"total;dur={total_ms:.2f}")
+    return ", ".join(entries)
+
+
+class TracingMiddleware:
+    """Opens a root span per HTTP request and adds the Server-Timing header"""
+
+    def __init__(self, app, exporter: Optional[_Exporter] = None, sample_rate: float = 1.0,
+                 server_timing_header: bool = True, skip_paths=("/metrics",)):
+        self.app = app
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.server_timing_header = server_timing_header
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = parent_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"traceparent":
+                trace_id, parent_id = _parse_traceparent(value.decode("latin-1"))
+                break
+        trace = Trace(trace_id, parent_id)
+        root = Span(f"{scope['method']} {scope['path']}", trace, None, None, {
+            "http.method": scope["method"],
+            "http.target": scope["path"],
+        })
+        token = _current.set(root)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                headers = list(message.get("headers", []))
+                if self.server_timing_header:
+                    total_ms = (time.perf_counter() - started) * 1000
+                    headers.append((b"server-timing", server_timing(trace, total_ms).encode()))
+                headers.append((b"traceparent", f"00-{trace.trace_id}-{root.span_id}-01".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            root.error = repr(exc)
+            raise
+        finally:
+            _current.reset(token)
+            root.end_ns = time.time_ns()
+            route = scope.get("route")
+            if route is not None:
+                root.name = f"{scope['method']} {route.path}"
+                root.attributes["http.route"] = route.path
+            trace.spans.append(root)
+            if self.exporter and random.random() < self.sample_rate:
+                self.exporter.submit(trace)
+
+
+class _ResponseTiming:
+    """When a traced route's endpoint returned and its response was encoded"""
+
+    __slots__ = ("handler_end_ns", "encode_start_ns", "encode_end_ns")
+
+    def __init__(self):
+        self.handler_end_ns: Optional[int] = None
+        self.encode_start_ns: Optional[int] = None
+        self.encode_end_ns: Optional[int] = None
+
+    def record(self):
+        # Nothing to record when the endpoint returned a Response itself
+        if self.handler_end_ns is None:
+            return
+        now = time.time_ns()
+        validated = self.encode_start_ns or now
+        record_span("response.validate", "validate", self.handler_end_ns, validated)
+        if self.encode_start_ns is not None:
+            record_span("response.encode", "encode", self.encode_start_ns, self.encode_end_ns or now)
+
+
+_response_timing: ContextVar[Optional[_ResponseTiming]] = ContextVar("response_timing", default=None)
+
+
+@lru_cache(maxsize=None)
+def _timed_response_class(response_class: type) -> type:
+    if getattr(response_class, "__traced__", False):
+        return response_class
+
+    class TimedResponse(response_class):
+        __traced__ = True
+
+        def render(self, content) -> bytes:
+            timing = _response_timing.get()
+            if timing is None:
+                return super().render(content)
+            timing.encode_start_ns = time.time_ns()
+            body = super().render(content)
+            timing.encode_end_ns = time.time_ns()
+            return body
+
+    TimedResponse.__name__ = TimedResponse.__qualname__ = response_class.__name__
+    return TimedResponse
+
+
+class TracedRoute(APIRoute):
+    """APIRoute that splits request time into handler, validate and encode spans
+
+    After the endpoint returns, response_model validation is recorded as
+    the validate stage (with any validation the handler did itself) and
+    rendering the response body as the encode stage.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        # include_router() rebuilds routes from the already-wrapped endpoint
+        if asyncio.iscoroutinefunction(endpoint) and not getattr(endpoint, "__traced__", False):
+            endpoint = self._trace_endpoint(endpoint)
+        response_class = kwargs.get("response_class", Default(JSONResponse))
+        if isinstance(response_class, DefaultPlaceholder):
+            kwargs["response_class"] = Default(_timed_response_class(response_class.value))
+        else:
+            kwargs["response_class"] = _timed_response_class(response_class)
+        super().__init__(path, endpoint, **kwargs)
+
+    @staticmethod
+    def _trace_endpoint(endpoint):
+        @wraps(endpoint)
+        async def traced(*args, **kwargs):
+            with span("handler", stage="handler") as handler_span:
+                result = await endpoint(*args, **kwargs)
+            timing = _response_timing.get()
+            if timing is not None and handler_span is not None and not isinstance(result, Response):
+                timing.handler_end_ns = handler_span.end_ns
+            return result
+        traced.__traced__ = True
+        return traced
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def traced_handler(request):
+            timing = _ResponseTiming()
+            token = _response_timing.set(timing)
+            try:
+                return await handler(request)
+            finally:
+                _response_timing.reset(token)
+                timing.record()
+        return traced_handler
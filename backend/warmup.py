@@ -0,0 +1,110 @@
+"""Startup warmup and readiness
+
+A fresh worker answers its first requests slowly: MongoDB connections
+are opened on demand, the catalog and its search structures are built on
+first use, and every route pays its first-call costs. Warmup runs those
+stages in the background right after startup, and the readiness probe
+reports ready only once they are done, so a load balancer keeps traffic
+on warm workers meanwhile. A stage that fails (MongoDB not up yet, say)
+is retried with backoff; the worker stays unready until it succeeds.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import TIME_TO_READY, WARMUP_STAGE_DURATION
+
+logger = logging.getLogger(__name__)
+
+Stage = Callable[[], Awaitable[None]]
+
+
+class Warmup:
+    """Stages a worker runs before it reports ready, and how long they took
+
+    Time to ready is measured from when the Warmup was created, which is
+    while server.py is imported, so it includes the rest of startup.
+    """
+
+    def __init__(self, enabled: bool = True, max_backoff: float = 30.0):
+        self.enabled = enabled
+        self.max_backoff = max_backoff
+        self.stages: List[Tuple[str, Stage]] = []
+        self.timings: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.current: Optional[str] = None
+        self.time_to_ready: Optional[float] = None
+        self._created = time.monotonic()
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def stage(self, name: str):
+        """Decorator adding an async function as the next stage"""
+        def register(function: Stage) -> Stage:
+            self.stages.append((name, function))
+            return function
+        return register
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def start(self):
+        if not self.enabled:
+            self._mark_ready()
+            return
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def wait(self):
+        await self._ready.wait()
+
+    async def run(self):
+        for name, function in self.stages:
+            self.current = name
+            backoff = 1.0
+            while True:
+                started = time.perf_counter()
+                try:
+                    await function()
+                    break
+                except Exception as exc:
+                    self.errors[name] = repr(exc)
+                    logger.warning("Warmup stage %s failed, retrying in %.0fs: %r", name, backoff, exc)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+            self.timings[name] = time.perf_counter() - started
+            self.errors.pop(name, None)
+            WARMUP_STAGE_DURATION.labels(name).set(self.timings[name])
+        self.current = None
+        self._mark_ready()
+        logger.info("Ready in %.2fs (%s)", self.time_to_ready,
+                    ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items()))
+
+    def _mark_ready(self):
+        self.time_to_ready = time.monotonic() - self._created
+        TIME_TO_READY.set(self.time_to_ready)
+        self._ready.set()
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "stage": self.current,
+            "stages": [
+                {"name": name, "seconds": self.timings.get(name), "error": self.errors.get(name)}
+                for name, _ in self.stages
+            ],
+            "time_to_ready_seconds": self.time_to_ready,
+            "uptime_seconds": time.monotonic() - self._created,
+        }
+
+
+def warmup_from_env() -> Warmup:
+    """WARMUP=off reports ready as soon as startup finishes"""
+    return Warmup(enabled=os.environ.get("WARMUP", "on").lower() != "off")
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""Latency and throughput benchmarks for the Dog Breeds API
+
+Runs the FastAPI app in-process against a local MongoDB stand-in
+(mongomock-motor by default, or an ephemeral mongod) and drives each
+endpoint with configurable concurrency and catalog sizes.
+
+    python backend_bench.py --sizes 50,1000,10000 --concurrency 1,16
+    python backend_bench.py --output new.json --compare old.json
+    python backend_bench.py --catalog-memory --sizes 10000,100000
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import math
+import os
+import pickle
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+# server.py reads these at import time; the benchmark swaps the database
+# for a local stand-in before any request is made.
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "dog_breeds_bench")
+# Every benchmark request comes from one client; don't let it be throttled
+os.environ.setdefault("RATE_LIMIT_BACKEND", "off")
+# populate resets the catalog, so it takes the admin token
+os.environ.setdefault("ADMIN_TOKEN", "bench")
+
+import httpx  # noqa: E402
+import server  # noqa: E402
+from catalog_store import CatalogStore  # noqa: E402
+from metrics import TimedDatabase  # noqa: E402
+from snapshot import SnapshotDirectory  # noqa: E402
+from synthetic import BreedGenerator  # noqa: E402
+
+ENDPOINTS = ["list", "detail", "search", "populate", "suggest", "fuzzy", "stats", "conditions", "bootstrap"]
+DEFAULT_ENDPOINTS = ["list", "detail", "search", "populate"]
+SEARCH_QUERIES = ["lab", "golden", "small", "friendly", "terrier", "herding", "large", "retriever"]
+FUZZY_QUERIES = ["rotwieler", "huskie", "dashund", "labrador", "beagel", "poodel"]
+SUGGEST_QUERIES = ["go", "gol", "ret", "ter", "sh", "fri", "hus", "germ"]
+INSERT_CHUNK = 5000
+
+
+class EphemeralMongod:
+    """A throwaway mongod on a free port with a temporary dbpath"""
+
+    def __init__(self, binary: str = "mongod"):
+        self.binary = shutil.which(binary)
+        if not self.binary:
+            raise RuntimeError(f"{binary} not found on PATH")
+        self.dbpath = tempfile.mkdtemp(prefix="bench-mongod-")
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"mongodb://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "EphemeralMongod":
+        self.process = subprocess.Popen(
+            [self.binary, "--dbpath", self.dbpath, "--port", str(self.port),
+             "--bind_ip", "127.0.0.1", "--quiet"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.5):
+                    return self
+            except OSError:
+                time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError("mongod did not start within 30s")
+
+    def __exit__(self, *exc):
+        if self.process:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+        shutil.rmtree(self.dbpath, ignore_errors=True)
+
+
+def use_database(backend: str, mongo_url: Optional[str]):
+    """Point server.py at the requested database"""
+    if backend == "mongomock":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("mongomock-motor is required: pip install mongomock-motor")
+        server.client = AsyncMongoMockClient()
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        server.client = AsyncIOMotorClient(mongo_url)
+    server.db = TimedDatabase(server.client[os.environ["DB_NAME"]], server.mongo_guard)
+
+
+async def load_catalog(size: int, seed: int) -> List[str]:
+    """Replace the catalog with the seed breeds plus synthetic ones; return their IDs"""
+    await server.db.dog_breeds.delete_many({})
+    seed_breeds = server.ALL_BREEDS[:size]
+    generated = BreedGenerator(server.ALL_BREEDS, seed).generate(size - len(seed_breeds))
+    ids = []
+    chunk = []
+    for breed_data in itertools.chain(seed_breeds, generated):
+        document = server.breed_document(server.DogBreed(**breed_data))
+        ids.append(document["id"])
+        chunk.append(document)
+        if len(chunk) >= INSERT_CHUNK:
+            await server.db.dog_breeds.insert_many(chunk)
+            chunk = []
+    if chunk:
+        await server.db.dog_breeds.insert_many(chunk)
+    await server.rebuild_derived()
+    return ids
+
+
+async def populate_and_wait(client: httpx.AsyncClient) -> httpx.Response:
+    """Queue a populate job and poll it; the final job response is returned
+
+    A job that did not succeed is reported with a 500 so it counts as an error.
+    """
+    response = await client.post("/api/breeds/populate", headers={"X-Admin-Token": os.environ["ADMIN_TOKEN"]})
+    if response.status_code != 202:
+        return response
+    location = response.headers["location"]
+    while True:
+        response = await client.get(location)
+        status = response.json().get("status")
+        if status == "succeeded":
+            return response
+        if status in ("failed", "cancelled"):
+            return httpx.Response(500, json=response.json())
+        await asyncio.sleep(0.01)
+
+
+def request_factory(endpoint: str, ids: List[str], rng: random.Random) -> Callable[[httpx.AsyncClient], Awaitable[httpx.Response]]:
+    if endpoint == "list":
+        return lambda c: c.get("/api/breeds")
+    if endpoint == "bootstrap":
+        return lambda c: c.get("/api/bootstrap")
+    if endpoint == "detail":
+        return lambda c: c.get(f"/api/breeds/{rng.choice(ids)}")
+    if endpoint == "search":
+        return lambda c: c.get(f"/api/breeds/search/{rng.choice(SEARCH_QUERIES)}")
+    if endpoint == "fuzzy":
+        return lambda c: c.get(f"/api/breeds/search/{rng.choice(FUZZY_QUERIES)}", params={"fuzzy": "true"})
+    if endpoint == "suggest":
+        return lambda c: c.get("/api/breeds/suggest", params={"q": rng.choice(SUGGEST_QUERIES)})
+    if endpoint == "stats":
+        return lambda c: c.get("/api/breeds/stats", params={"group_by": rng.choice(["all", "size", "breed_group"])})
+    if endpoint == "conditions":
+        return lambda c: c.get("/api/conditions/hip-dysplasia/breeds")
+    if endpoint == "populate":
+        return populate_and_wait
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an unsorted list"""
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+async def drive(client: httpx.AsyncClient, make_request, total: int, concurrency: int) -> Dict[str, Any]:
+    """Issue total requests from concurrency workers and time each one"""
+    latencies: List[float] = []
+    errors = 0
+    issued = 0
+
+    async def worker():
+        nonlocal errors, issued
+        while issued < total:
+            issued += 1
+            start = time.perf_counter()
+            response = await make_request(client)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(max(latencies), 3),
+        "rps": round(len(latencies) / elapsed, 1),
+    }
+
+
+async def measure_allocations(client: httpx.AsyncClient, make_request, samples: int) -> Dict[str, Any]:
+    """Peak traced memory per request and bytes still held afterwards"""
+    tracemalloc.start()
+    try:
+        peaks = []
+        baseline, _ = tracemalloc.get_traced_memory()
+        for _ in range(samples):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await make_request(client)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "alloc_peak_kb_avg": round(sum(peaks) / len(peaks) / 1024, 1),
+        "alloc_peak_kb_max": round(max(peaks) / 1024, 1),
+        "retained_kb": round((retained - baseline) / 1024, 1),
+    }
+
+
+def retained_memory(build: Callable[[List[dict]], Any], blob: bytes) -> int:
+    """Bytes still held by what build() makes from freshly unpickled documents"""
+    tracemalloc.start()
+    try:
+        documents = pickle.loads(blob)
+        result = build(documents)
+        del documents
+        gc.collect()
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return retained
+
+
+def mapped_memory(blob: bytes) -> int:
+    """Heap a worker holds for a CatalogStore mapped from a snapshot file"""
+    with tempfile.TemporaryDirectory() as directory:
+        snapshots = SnapshotDirectory(directory)
+        version = snapshots.publish({"catalog": CatalogStore.build(pickle.loads(blob))})
+        tracemalloc.start()
+        try:
+            snapshot = snapshots.load(version)
+            retained, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del snapshot
+    return retained
+
+
+def measure_catalog_memory(sizes: List[int], seed: int) -> List[Dict[str, Any]]:
+    """Memory held by the catalog as DogBreed models, a CatalogStore, and a mapped snapshot"""
+    results = []
+    for size in sizes:
+        seed_breeds = server.ALL_BREEDS[:size]
+        generated = BreedGenerator(server.ALL_BREEDS, seed).generate(size - len(seed_breeds))
+        documents = [
+            server.breed_document(server.DogBreed(**breed))
+            for breed in itertools.chain(seed_breeds, generated)
+        ]
+        # Both representations start from their own copy, so neither shares
+        # strings with the generated documents
+        blob = pickle.dumps(documents, pickle.HIGHEST_PROTOCOL)
+        del documents
+        models = retained_memory(lambda docs: [server.DogBreed(**doc) for doc in docs], blob)
+        columnar = retained_memory(CatalogStore.build, blob)
+        # Mapped pages are shared page cache, not counted against any worker
+        mapped = mapped_memory(blob)
+        result = {
+            "catalog_size": size,
+            "models_bytes": models,
+            "columnar_bytes": columnar,
+            "mapped_heap_bytes": mapped,
+            "models_bytes_per_breed": round(models / size),
+            "columnar_bytes_per_breed": round(columnar / size),
+            "ratio": round(models / columnar, 2),
+        }
+        results.append(result)
+        print(
+            f"  {size:>7} breeds  models={models / 2**20:>8.1f}MiB  columnar={columnar / 2**20:>8.1f}MiB  "
+            f"({result['ratio']}x smaller)  mapped heap={mapped / 2**20:.2f}MiB",
+            flush=True,
+        )
+    return results
+
+
+async def run_benchmarks(args) -> List[Dict[str, Any]]:
+    for handler in server.app.router.on_startup:
+        await handler()
+    await server.warmup.wait()
+    print(f"Ready in {server.warmup.time_to_ready:.2f}s", flush=True)
+    results = []
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for size in args.sizes:
+            print(f"Loading {size} synthetic breeds...", flush=True)
+            started = time.perf_counter()
+            ids = await load_catalog(size, args.seed)
+            print(f"  loaded in {time.perf_counter() - started:.2f}s")
+            # populate resets the catalog to the seed data, so it runs last
+            endpoints = sorted(args.endpoints, key=lambda e: e == "populate")
+            for endpoint in endpoints:
+                rng = random.Random(args.seed)
+                make_request = request_factory(endpoint, ids, rng)
+                for _ in range(args.warmup):
+                    await make_request(client)
+                for concurrency in args.concurrency:
+                    total = args.populate_requests if endpoint == "populate" else args.requests
+                    stats = await drive(client, make_request, total, concurrency)
+                    if args.allocations:
+                        stats.update(await measure_allocations(client, make_request, args.allocation_samples))
+                    result = {"endpoint": endpoint, "catalog_size": size, "concurrency": concurrency, **stats}
+                    results.append(result)
+                    print(
+                        f"  {endpoint:<10} c={concurrency:<4} p50={stats['p50_ms']:>9.2f}ms "
+                        f"p95={stats['p95_ms']:>9.2f}ms p99={stats['p99_ms']:>9.2f}ms "
+                        f"rps={stats['rps']:>8.1f} errors={stats['errors']}",
+                        flush=True,
+                    )
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: List[Dict[str, Any]], baseline_path: str, threshold: float) -> bool:
+    """Print per-scenario deltas against a previous run; False on p95 regressions"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    key = lambda r: (r["endpoint"], r["catalog_size"], r["concurrency"])  # noqa: E731
+    previous = {key(r): r for r in baseline["results"]}
+    ok = True
+    print(f"\nComparison against {baseline_path} (commit {baseline['meta'].get('commit')})")
+    for result in current:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        p95_delta = (result["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0.0
+        rps_delta = (result["rps"] - old["rps"]) / old["rps"] * 100 if old["rps"] else 0.0
+        regressed = p95_delta > threshold
+        ok = ok and not regressed
+        print(
+            f"  {'REGRESSION' if regressed else 'ok':<10} {result['endpoint']:<10} "
+            f"n={result['catalog_size']:<7} c={result['concurrency']:<4} "
+            f"p95 {old['p95_ms']:.2f} -> {result['p95_ms']:.2f}ms ({p95_delta:+.1f}%) "
+            f"rps {old['rps']:.1f} -> {result['rps']:.1f} ({rps_delta:+.1f}%)"
+        )
+    return ok
+
+
+def parse_list(value: str, cast=str) -> List[Any]:
+    return [cast(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda v: parse_list(v, int), default=[50, 1000, 10000],
+                        help="catalog sizes to benchmark (50 to 100000)")
+    parser.add_argument("--concurrency", type=lambda v: parse_list(v, int), default=[1, 16])
+    parser.add_argument("--endpoints", type=parse_list, default=DEFAULT_ENDPOINTS,
+                        help=f"comma-separated subset of: {', '.join(ENDPOINTS)}")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--populate-requests", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=5, help="untimed requests per endpoint")
+    parser.add_argument("--allocations", action="store_true", help="also measure per-request allocations")
+    parser.add_argument("--allocation-samples", type=int, default=20)
+    parser.add_argument("--catalog-memory", action="store_true",
+                        help="compare catalog memory as models and as a CatalogStore instead of timing endpoints")
+    parser.add_argument("--backend", choices=["mongomock", "mongod", "url"], default="mongomock")
+    parser.add_argument("--mongo-url", help="MongoDB URL for --backend url")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=20.0,
+                        help="p95 increase (percent) reported as a regression")
+    args = parser.parse_args()
+
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    if args.backend == "url" and not args.mongo_url:
+        parser.error("--backend url requires --mongo-url")
+
+    if args.catalog_memory:
+        print("Catalog memory, models vs columnar store:")
+        output = {
+            "meta": {"commit": git_commit(), "python": platform.python_version(), "seed": args.seed},
+            "catalog_memory": measure_catalog_memory(args.sizes, args.seed),
+        }
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+        print(f"\nResults written to {args.output}")
+        return
+
+    mongod = EphemeralMongod() if args.backend == "mongod" else None
+    if mongod:
+        mongod.__enter__()
+    try:
+        use_database(args.backend, mongod.url if mongod else args.mongo_url)
+        results = asyncio.run(run_benchmarks(args))
+    finally:
+        if mongod:
+            mongod.__exit__()
+
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "requests": args.requests,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare and not compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ from typing import Dict, List, Any, Tuple, Optional
 import os
 import dotenv
 import random
+import re
 
 # Load environment variables from frontend/.env to get the backend URL
 dotenv.load_dotenv('/app/frontend/.env')
@@ -21,6 +22,17 @@ if not BACKEND_URL:
 API_URL = f"{BACKEND_URL}/api"
 print(f"Using API URL: {API_URL}")
 
+# The admin token from backend/.env; breed writes require it, and the suite's
+# own catalog writes send it, which exempts them from rate limits so a run
+# can't exhaust the write budget
+dotenv.load_dotenv('/app/backend/.env')
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+ADMIN_HEADERS = {"X-Admin-Token": ADMIN_TOKEN} if ADMIN_TOKEN else {}
+
+# Backend modules, for tests of structures that need more breeds than the
+# API holds
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
 # Test results tracking
 test_results = {
     "total": 0,
@@ -114,31 +126,40 @@ def test_api_health() -> bool:
         return False
 
 def test_breeds_population() -> bool:
-    """Test the breeds population endpoint"""
+    """Test the breeds population job"""
     try:
-        response = requests.post(f"{API_URL}/breeds/populate")
+        response = requests.post(f"{API_URL}/breeds/populate", headers=ADMIN_HEADERS)
         print(f"Status Code: {response.status_code}")
         print(f"Response: {response.json()}")
         
         # Check status code
-        if response.status_code != 200:
-            print(f"Expected status code 200, got {response.status_code}")
+        if response.status_code != 202:
+            print(f"Expected status code 202, got {response.status_code}")
             return False
         
         # Check response content
-        data = response.json()
-        if "message" not in data or "Successfully populated" not in data["message"]:
-            print(f"Unexpected response content: {data}")
+        job = response.json()
+        if "id" not in job or job.get("kind") != "populate":
+            print(f"Unexpected response content: {job}")
             return False
         
-        # Extract number of breeds populated
-        import re
-        match = re.search(r"Successfully populated (\d+) dog breeds", data["message"])
-        if not match:
-            print(f"Could not extract number of breeds from message: {data['message']}")
+        # Poll the job until it finishes
+        deadline = time.time() + 60
+        while job["status"] in ("queued", "running"):
+            if time.time() > deadline:
+                print(f"Populate job did not finish in time: {job}")
+                return False
+            time.sleep(0.5)
+            job = requests.get(f"{API_URL}/jobs/{job['id']}").json()
+            print(f"Job status: {job['status']}, progress: {job['progress']}")
+        
+        if job["status"] != "succeeded":
+            print(f"Expected the job to succeed, got {job['status']}: {job.get('error')}")
             return False
         
-        num_breeds = int(match.group(1))
+        # Breeds already in the catalog are kept, so count those too
+        result = job["result"]
+        num_breeds = result["inserted"] + result["updated"] + result["unchanged"]
         if num_breeds < 25:
             print(f"Expected at least 25 breeds, got {num_breeds}")
             return False
@@ -326,76 +347,1567 @@ def test_search_functionality(breeds: List[Dict[str, Any]]) -> bool:
         print(f"Error testing search functionality: {e}")
         return False
 
-def test_error_handling() -> bool:
-    """Test error handling for malformed requests"""
+def test_fuzzy_search_functionality() -> bool:
+    """Test the typo-tolerant search mode"""
     try:
-        # Test non-existent endpoint
-        print("Testing non-existent endpoint")
-        response = requests.get(f"{API_URL}/nonexistent")
+        fuzzy_tests = [
+            {"query": "rotwieler", "expected_name": "Rottweiler"},
+            {"query": "huskie", "expected_name": "Siberian Husky"},
+            {"query": "dashund", "expected_name": "Dachshund"},
+            # Aliases are searchable too
+            {"query": "sheltie", "expected_name": "Shetland Sheepdog"}
+        ]
+        
+        for test_case in fuzzy_tests:
+            query = test_case["query"]
+            print(f"\nTesting fuzzy search with query: '{query}'")
+            
+            response = requests.get(f"{API_URL}/breeds/search/{query}", params={"fuzzy": "true"})
+            print(f"Status Code: {response.status_code}")
+            
+            # Check status code
+            if response.status_code != 200:
+                print(f"Expected status code 200, got {response.status_code}")
+                return False
+            
+            results = response.json()
+            if not isinstance(results, list) or not results:
+                print(f"Expected a non-empty list of results for '{query}'")
+                return False
+            
+            # Every fuzzy result carries a match score
+            if any("score" not in breed for breed in results):
+                print("Expected every fuzzy result to carry a score")
+                return False
+            
+            if not any(breed["name"] == test_case["expected_name"] for breed in results):
+                print(f"Expected to find {test_case['expected_name']} for '{query}'")
+                return False
+        
+        print("Successfully tested fuzzy search functionality")
+        return True
+    except Exception as e:
+        print(f"Error testing fuzzy search functionality: {e}")
+        return False
+
+def test_fuzzy_candidates(breeds: List[Dict[str, Any]]) -> bool:
+    """Test that fuzzy search verifies a bounded share of a large catalog"""
+    try:
+        from search_index import FuzzyIndex, bounded_edit_distance, normalize, typo_budget
+        from synthetic import BreedGenerator, stable_id
+        
+        catalog = [
+            dict(breed, id=stable_id(0, index))
+            for index, breed in enumerate(BreedGenerator(breeds).generate(20000))
+        ]
+        index = FuzzyIndex.build(catalog)
+        terms = [index._terms[tid] for tid in range(len(index))]
+        print(f"Indexed {len(catalog)} synthetic breeds under {len(terms)} terms")
+        
+        rng = random.Random(0)
+        counts = []
+        for breed in rng.sample(catalog, 10):
+            name = normalize(breed["name"])
+            # The full name, a dropped first letter and the first word alone
+            for query in (name, name[1:], name.split()[0]):
+                budget = typo_budget(query, 2)
+                candidates = set(index.candidates(query, budget))
+                counts.append(len(candidates))
+                
+                # The filter may only skip terms that are out of reach
+                within = {tid for tid, term in enumerate(terms) if bounded_edit_distance(query, term, budget) is not None}
+                if not within <= candidates:
+                    print(f"Candidates for '{query}' miss {[terms[tid] for tid in within - candidates]}")
+                    return False
+        
+        print(f"Candidates per query: mean {sum(counts) / len(counts):.0f}, max {max(counts)}")
+        if max(counts) > len(terms) * 0.15 or sum(counts) / len(counts) > len(terms) * 0.05:
+            print("Expected the q-gram filter to leave a small share of terms to verify")
+            return False
+        
+        print("Successfully tested fuzzy candidates")
+        return True
+    except Exception as e:
+        print(f"Error testing fuzzy candidates: {e}")
+        return False
+
+def test_suggest_functionality() -> bool:
+    """Test the typeahead suggestion endpoint"""
+    try:
+        suggest_tests = [
+            # Prefix of a breed name
+            {"q": "gold", "expected_text": "Golden Retriever"},
+            # Prefix of a word inside a breed name
+            {"q": "retr", "expected_text": "Labrador Retriever"},
+            # Small typos are tolerated
+            {"q": "rotwieler", "expected_text": "Rottweiler"},
+            {"q": "huskie", "expected_text": "Siberian Husky"}
+        ]
+        
+        for test_case in suggest_tests:
+            q = test_case["q"]
+            print(f"\nTesting suggestions for: '{q}'")
+            
+            response = requests.get(f"{API_URL}/breeds/suggest", params={"q": q})
+            print(f"Status Code: {response.status_code}")
+            
+            # Check status code
+            if response.status_code != 200:
+                print(f"Expected status code 200, got {response.status_code}")
+                return False
+            
+            suggestions = response.json()
+            if not isinstance(suggestions, list):
+                print(f"Expected a list of suggestions, got {type(suggestions)}")
+                return False
+            
+            texts = [suggestion["text"] for suggestion in suggestions]
+            print(f"Suggestions: {texts}")
+            if test_case["expected_text"] not in texts:
+                print(f"Expected '{test_case['expected_text']}' among suggestions for '{q}'")
+                return False
+        
+        print("Successfully tested suggest functionality")
+        return True
+    except Exception as e:
+        print(f"Error testing suggest functionality: {e}")
+        return False
+
+def test_stats_functionality(breeds: List[Dict[str, Any]]) -> bool:
+    """Test the aggregated statistics endpoint"""
+    if not breeds:
+        print("No breeds available for testing")
+        return False
+    
+    try:
+        for group_by in ["all", "size", "breed_group", "origin", "health_issues"]:
+            print(f"\nTesting stats grouped by: '{group_by}'")
+            response = requests.get(f"{API_URL}/breeds/stats", params={"group_by": group_by})
+            print(f"Status Code: {response.status_code}")
+            
+            # Check status code
+            if response.status_code != 200:
+                print(f"Expected status code 200, got {response.status_code}")
+                return False
+            
+            stats = response.json()
+            if stats.get("total_breeds") != len(breeds):
+                print(f"Expected total_breeds={len(breeds)}, got {stats.get('total_breeds')}")
+                return False
+            
+            if not stats.get("groups"):
+                print(f"Expected at least one group for '{group_by}'")
+                return False
+            
+            # Every breed has exactly one size, group and origin
+            if group_by != "health_issues":
+                total = sum(group["count"] for group in stats["groups"])
+                if total != len(breeds):
+                    print(f"Expected group counts to add up to {len(breeds)}, got {total}")
+                    return False
+        
+        # Unknown dimensions are rejected
+        response = requests.get(f"{API_URL}/breeds/stats", params={"group_by": "color"})
+        print(f"Status Code for invalid group_by: {response.status_code}")
+        if response.status_code != 400:
+            print(f"Expected status code 400 for invalid group_by, got {response.status_code}")
+            return False
+        
+        print("Successfully tested stats functionality")
+        return True
+    except Exception as e:
+        print(f"Error testing stats functionality: {e}")
+        return False
+
+def test_conditions_functionality() -> bool:
+    """Test the health condition endpoints"""
+    try:
+        print("Testing condition listing")
+        response = requests.get(f"{API_URL}/conditions")
         print(f"Status Code: {response.status_code}")
         
         # Check status code
-        if response.status_code < 400:
-            print(f"Expected error status code (4xx), got {response.status_code}")
+        if response.status_code != 200:
+            print(f"Expected status code 200, got {response.status_code}")
             return False
         
-        print("Successfully tested error handling")
+        conditions = response.json()
+        if not isinstance(conditions, list) or not conditions:
+            print("Expected a non-empty list of conditions")
+            return False
+        
+        by_id = {condition["id"]: condition for condition in conditions}
+        
+        # Variants are merged into one canonical condition
+        heart = by_id.get("heart-disease")
+        if not heart or "Heart Problems" not in heart["variants"]:
+            print("Expected 'Heart Problems' to be canonicalized as heart-disease")
+            return False
+        
+        hip = by_id.get("hip-dysplasia")
+        if not hip:
+            print("Expected a hip-dysplasia condition")
+            return False
+        
+        print("Testing breeds prone to hip-dysplasia")
+        response = requests.get(f"{API_URL}/conditions/hip-dysplasia/breeds")
+        print(f"Status Code: {response.status_code}")
+        if response.status_code != 200:
+            print(f"Expected status code 200, got {response.status_code}")
+            return False
+        
+        result = response.json()
+        if result["count"] != hip["breed_count"] or len(result["breeds"]) != result["count"]:
+            print(f"Expected {hip['breed_count']} breeds, got {len(result['breeds'])}")
+            return False
+        
+        if not all("Hip Dysplasia" in breed["health_issues"] for breed in result["breeds"]):
+            print("Expected every breed to list Hip Dysplasia")
+            return False
+        
+        # Unknown conditions return 404
+        response = requests.get(f"{API_URL}/conditions/not-a-condition/breeds")
+        print(f"Status Code for unknown condition: {response.status_code}")
+        if response.status_code != 404:
+            print(f"Expected status code 404 for unknown condition, got {response.status_code}")
+            return False
+        
+        print("Successfully tested conditions functionality")
         return True
     except Exception as e:
-        print(f"Error testing error handling: {e}")
+        print(f"Error testing conditions functionality: {e}")
         return False
 
-def print_summary():
-    """Print a summary of test results"""
-    print("\n" + "="*80)
-    print("TEST SUMMARY")
-    print("-"*80)
-    print(f"Total Tests: {test_results['total']}")
-    print(f"Passed: {test_results['passed']}")
-    print(f"Failed: {test_results['failed']}")
-    print(f"Success Rate: {(test_results['passed'] / test_results['total']) * 100:.2f}%")
-    print("="*80)
-    
-    # Print details of failed tests
-    if test_results['failed'] > 0:
-        print("\nFAILED TESTS:")
-        for test in test_results['tests']:
-            if test['status'] != 'PASSED':
-                print(f"- {test['name']}: {test['status']}")
-                if 'error' in test:
-                    print(f"  Error: {test['error']}")
-        print("="*80)
+def test_query_functionality(breeds: List[Dict[str, Any]]) -> bool:
+    """Test the selective query endpoint"""
+    try:
+        breed = breeds[0]
+        query = [{"breed": {"id": breed["id"], "fields": [
+            "name",
+            {"similar": {"limit": 3, "fields": ["id", "name"]}},
+            {"conditions": {"fields": ["id", "breed_count"]}},
+            {"group_stats": {"fields": ["key", "count"]}},
+        ]}}]
+        print(f"Testing query for breed {breed['name']}")
+        response = requests.post(f"{API_URL}/query", json={"query": query})
+        print(f"Status Code: {response.status_code}")
+        if response.status_code != 200:
+            print(f"Expected status code 200, got {response.status_code}")
+            return False
+        
+        result = response.json()["data"]["breed"]
+        # Only the selected fields come back
+        if set(result) != {"name", "similar", "conditions", "group_stats"}:
+            print(f"Expected only the selected fields, got {sorted(result)}")
+            return False
+        
+        if result["name"] != breed["name"] or len(result["similar"]) > 3:
+            print("Expected the breed's name and at most 3 similar breeds")
+            return False
+        
+        if any(similar["id"] == breed["id"] for similar in result["similar"]):
+            print("Expected a breed not to be similar to itself")
+            return False
+        
+        if result["group_stats"]["key"] != breed["breed_group"]:
+            print(f"Expected stats for group {breed['breed_group']}")
+            return False
+        
+        # Queries over the cost limit are rejected before they run
+        expensive = [{"breeds": {"limit": 100, "fields": [{"similar": {"limit": 20, "fields": ["name"]}}]}}]
+        response = requests.post(f"{API_URL}/query", json={"query": expensive})
+        print(f"Status Code for expensive query: {response.status_code}")
+        if response.status_code != 400:
+            print(f"Expected status code 400 for expensive query, got {response.status_code}")
+            return False
+        
+        # Unknown fields are rejected
+        response = requests.post(f"{API_URL}/query", json={"query": ["not_a_field"]})
+        if response.status_code != 400:
+            print(f"Expected status code 400 for unknown field, got {response.status_code}")
+            return False
+        
+        print("Successfully tested query functionality")
+        return True
+    except Exception as e:
+        print(f"Error testing query functionality: {e}")
+        return False
 
-def main():
-    """Run all tests"""
-    print(f"Starting Dog Breeds API Tests against {API_URL}")
-    
-    # Test API health
-    api_health_ok = run_test("API Health Check", test_api_health)
-    if not api_health_ok:
-        print("API health check failed, aborting further tests")
-        print_summary()
-        return
-    
-    # Test breeds population
-    breeds_population_ok = run_test("Breeds Data Population", test_breeds_population)
-    if not breeds_population_ok:
-        print("Breeds population failed, aborting further tests")
-        print_summary()
-        return
-    
-    # Test breeds retrieval
-    breeds_retrieval_ok, breeds = run_test("Breeds Retrieval", test_breeds_retrieval)
-    if not breeds_retrieval_ok or not breeds:
-        print("Breeds retrieval failed, aborting further tests")
-        print_summary()
-        return
-    
-    # Test individual breed retrieval
-    run_test("Individual Breed Retrieval", test_individual_breed_retrieval, breeds)
-    
-    # Test search functionality
-    run_test("Search Functionality", test_search_functionality, breeds)
+def test_change_stream(breeds: List[Dict[str, Any]]) -> bool:
+    """Test catch-up on the catalog change stream"""
+    try:
+        # The response header carries the version the stream starts from
+        with requests.get(f"{API_URL}/breeds/stream", stream=True, timeout=10) as response:
+            print(f"Status Code: {response.status_code}")
+            if response.status_code != 200 or not response.headers["Content-Type"].startswith("text/event-stream"):
+                print("Expected an event stream")
+                return False
+            version = int(response.headers["X-Catalog-Version"])
+        
+        new_breed = {key: value for key, value in breeds[0].items() if key not in ("id", "created_at")}
+        new_breed["name"] = "Stream Test Breed"
+        created = requests.post(f"{API_URL}/breeds", json=new_breed, headers=ADMIN_HEADERS).json()
+        requests.delete(f"{API_URL}/breeds/{created['id']}", headers=ADMIN_HEADERS)
+        
+        # Reconnecting from that version replays both changes
+        print(f"Testing catch-up from version {version}")
+        seen = []
+        with requests.get(f"{API_URL}/breeds/stream", params={"since": version}, stream=True, timeout=10) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("data: "):
+                    change = json.loads(line[len("data: "):])
+                    if change.get("id") == created["id"]:
+                        seen.append(change["op"])
+                if len(seen) == 2:
+                    break
+        
+        if seen != ["create", "delete"]:
+            print(f"Expected create then delete events, got {seen}")
+            return False
+        
+        print("Successfully tested change stream")
+        return True
+    except Exception as e:
+        print(f"Error testing change stream: {e}")
+        return False
+
+def test_delta_sync(breeds: List[Dict[str, Any]]) -> bool:
+    """Test syncing catalog changes since a version"""
+    try:
+        # A full sync pages through the catalog from version 0
+        synced, since, pages = {}, 0, 0
+        while True:
+            response = requests.get(f"{API_URL}/breeds/changes", params={"since": since, "limit": 20})
+            print(f"Status Code: {response.status_code}")
+            if response.status_code != 200:
+                print(f"Expected status code 200, got {response.status_code}")
+                return False
+            page = response.json()
+            synced.update((breed["id"], breed) for breed in page["breeds"])
+            since, pages = page["version"], pages + 1
+            if not page["has_more"]:
+                break
+        
+        if len(synced) != len(breeds):
+            print(f"Expected {len(breeds)} breeds from a full sync, got {len(synced)} in {pages} pages")
+            return False
+        
+        new_breed = {key: value for key, value in breeds[0].items() if key not in ("id", "created_at")}
+        new_breed["name"] = "Delta Sync Test Breed"
+        created = requests.post(f"{API_URL}/breeds", json=new_breed, headers=ADMIN_HEADERS).json()
+        requests.delete(f"{API_URL}/breeds/{created['id']}", headers=ADMIN_HEADERS)
+        changed = dict(new_breed, name=breeds[0]["name"], description=breeds[0]["description"] + " (delta sync test)")
+        updated = requests.put(f"{API_URL}/breeds/{breeds[0]['id']}", json=changed, headers=ADMIN_HEADERS).json()
+        
+        # Changes arrive once the change feed has confirmed them
+        deadline = time.time() + 10
+        while True:
+            delta = requests.get(f"{API_URL}/breeds/changes", params={"since": since}).json()
+            if updated["id"] in {breed["id"] for breed in delta["breeds"]} or time.time() > deadline:
+                break
+            time.sleep(0.5)
+        print(f"Delta since {since}: {len(delta['breeds'])} breeds, {len(delta['deleted'])} deleted")
+        
+        if delta["reset"] or [breed["id"] for breed in delta["breeds"]] != [updated["id"]]:
+            print(f"Expected only the updated breed, got {delta}")
+            return False
+        
+        if delta["deleted"] != [created["id"]]:
+            print(f"Expected the deleted breed's ID, got {delta['deleted']}")
+            return False
+        
+        print("Successfully tested delta sync")
+        return True
+    except Exception as e:
+        print(f"Error testing delta sync: {e}")
+        return False
+
+def test_partitions(breeds: List[Dict[str, Any]]) -> bool:
+    """Test importing and reading a locale partition"""
+    try:
+        # A translation of two breeds, keeping their IDs, in a locale nobody speaks
+        translated = [
+            dict({key: value for key, value in breed.items() if key != "created_at"},
+                 description=f"Translated: {breed['description']}")
+            for breed in breeds[:2]
+        ]
+        response = requests.post(f"{API_URL}/partitions/default/zz/import", json=translated, headers=ADMIN_HEADERS)
+        print(f"Status Code: {response.status_code}")
+        if response.status_code != 202:
+            print(f"Expected status code 202, got {response.status_code}")
+            return False
+        job = response.json()
+        deadline = time.time() + 30
+        while job["status"] in ("queued", "running"):
+            if time.time() > deadline:
+                print(f"Import job did not finish in time: {job}")
+                return False
+            time.sleep(0.5)
+            job = requests.get(f"{API_URL}/jobs/{job['id']}").json()
+        if job["status"] != "succeeded":
+            print(f"Expected the import to succeed, got {job['status']}: {job.get('error')}")
+            return False
+        
+        # Picked by Accept-Language, region falling back to the language
+        response = requests.get(f"{API_URL}/breeds", headers={"Accept-Language": "zz-ZZ, en;q=0.5"})
+        print(f"Content-Language: {response.headers.get('Content-Language')}")
+        if response.headers.get("Content-Language") != "zz" or len(response.json()) != 2:
+            print(f"Expected the two translated breeds, got {len(response.json())}")
+            return False
+        
+        breed = requests.get(f"{API_URL}/breeds/{breeds[0]['id']}", params={"locale": "zz"}).json()
+        if not breed["description"].startswith("Translated: "):
+            print(f"Expected the translated description, got {breed['description']}")
+            return False
+        
+        # A locale the catalog doesn't have falls back to the default one
+        response = requests.get(f"{API_URL}/breeds", params={"locale": "yy"})
+        if response.headers.get("Content-Language") != "en":
+            print(f"Expected the default locale, got {response.headers.get('Content-Language')}")
+            return False
+        
+        partitions = requests.get(f"{API_URL}/partitions").json()
+        if not any(p["registry"] == "default" and p["locale"] == "zz" for p in partitions):
+            print(f"Expected the zz partition to be listed: {partitions}")
+            return False
+        
+        response = requests.get(f"{API_URL}/breeds", params={"registry": "no-such-registry"})
+        if response.status_code != 404:
+            print(f"Expected status code 404 for an unknown registry, got {response.status_code}")
+            return False
+        
+        print("Successfully tested catalog partitions")
+        return True
+    except Exception as e:
+        print(f"Error testing catalog partitions: {e}")
+        return False
+
+def test_route_cache(breeds: List[Dict[str, Any]]) -> bool:
+    """Test that repeated reads are served from the route cache and writes invalidate it"""
+    try:
+        url = f"{API_URL}/breeds/{breeds[1]['id']}"
+        requests.get(url)
+        response = requests.get(url)
+        print(f"Status Code: {response.status_code}")
+        print(f"Server-Timing: {response.headers.get('Server-Timing', '')}")
+        if not response.headers.get("Server-Timing", "").startswith("cache;"):
+            print("Expected the repeated lookup to be a cache hit")
+            return False
+        
+        # Unknown IDs are cached too, and still answer 404
+        for _ in range(2):
+            response = requests.get(f"{API_URL}/breeds/no-such-breed")
+            if response.status_code != 404:
+                print(f"Expected status code 404, got {response.status_code}")
+                return False
+        
+        # A write is visible on the next read
+        changed = {key: value for key, value in breeds[1].items() if key not in ("id", "created_at")}
+        changed["description"] = breeds[1]["description"] + " (route cache test)"
+        requests.put(url, json=changed, headers=ADMIN_HEADERS)
+        if requests.get(url).json()["description"] != changed["description"]:
+            print("Expected the updated breed after a write")
+            return False
+        
+        print("Successfully tested route cache")
+        return True
+    except Exception as e:
+        print(f"Error testing route cache: {e}")
+        return False
+
+def test_search_normalization() -> bool:
+    """Test that case and spacing variants of a query share one cached result"""
+    try:
+        first = requests.get(f"{API_URL}/breeds/search/Golden")
+        print(f"Status Code: {first.status_code}")
+        if first.status_code != 200:
+            print(f"Expected status code 200, got {first.status_code}")
+            return False
+        
+        variant = requests.get(f"{API_URL}/breeds/search/%20%20GOLDEN%20")
+        print(f"Server-Timing: {variant.headers.get('Server-Timing', '')}")
+        if [breed["id"] for breed in variant.json()] != [breed["id"] for breed in first.json()]:
+            print("Expected the same results for both spellings")
+            return False
+        
+        if not variant.headers.get("Server-Timing", "").startswith("cache;"):
+            print("Expected the variant to be served from the search cache")
+            return False
+        
+        print("Successfully tested search normalization")
+        return True
+    except Exception as e:
+        print(f"Error testing search normalization: {e}")
+        return False
+
+def test_bootstrap(breeds: List[Dict[str, Any]]) -> bool:
+    """Test the first-page bootstrap bundle"""
+    try:
+        response = requests.get(f"{API_URL}/bootstrap")
+        print(f"Status Code: {response.status_code}")
+        if response.status_code != 200:
+            print(f"Expected status code 200, got {response.status_code}")
+            return False
+        
+        data = response.json()
+        print(f"Bundle: {data['count']} breeds, {len(response.content)} bytes, facets {sorted(data['facets'])}")
+        if data["count"] != len(breeds) or len(data["breeds"]) != len(breeds):
+            print(f"Expected {len(breeds)} breeds, got {data['count']}")
+            return False
+        
+        rows = [dict(zip(data["fields"], row)) for row in data["breeds"]]
+        if {row["id"] for row in rows} != {breed["id"] for breed in breeds}:
+            print("Bundle breeds don't match GET /api/breeds")
+            return False
+        
+        card = rows[0]["images"]["card"]
+        if card["width"] is not None and (card["width"], card["height"]) != (
+            data["variants"]["card"]["width"], data["variants"]["card"]["height"]
+        ):
+            print(f"Card image dimensions don't match the variant: {card}")
+            return False
+        
+        if sum(value["count"] for value in data["facets"]["size"]) != len(breeds):
+            print("Size facet counts don't add up to the catalog size")
+            return False
+        
+        etag = response.headers.get("ETag")
+        revalidated = requests.get(f"{API_URL}/bootstrap", headers={"If-None-Match": etag})
+        if revalidated.status_code != 304:
+            print(f"Expected 304 for a matching ETag, got {revalidated.status_code}")
+            return False
+        
+        print("Successfully tested bootstrap bundle")
+        return True
+    except Exception as e:
+        print(f"Error testing bootstrap bundle: {e}")
+        return False
+
+def test_readiness() -> bool:
+    """Test the liveness and readiness probes"""
+    try:
+        live = requests.get(f"{API_URL}/health/live")
+        print(f"Liveness Status Code: {live.status_code}")
+        if live.status_code != 200:
+            print(f"Expected status code 200, got {live.status_code}")
+            return False
+        
+        ready = requests.get(f"{API_URL}/health/ready")
+        print(f"Readiness Status Code: {ready.status_code}")
+        print(f"Response: {ready.json()}")
+        # Earlier tests got responses, so warmup has long finished
+        if ready.status_code != 200 or not ready.json().get("ready"):
+            print("Expected the server to report ready")
+            return False
+        
+        data = ready.json()
+        if not isinstance(data.get("time_to_ready_seconds"), (int, float)):
+            print("Expected time_to_ready_seconds to be reported")
+            return False
+        
+        if data.get("database", {}).get("state") != "closed":
+            print(f"Expected the database circuit breaker to be closed, got {data.get('database')}")
+            return False
+        
+        stages = [stage["name"] for stage in data.get("stages", [])]
+        if stages and stages != ["mongo", "catalog", "responses"]:
+            print(f"Unexpected warmup stages: {stages}")
+            return False
+        
+        print("Successfully tested readiness")
+        return True
+    except Exception as e:
+        print(f"Error testing readiness: {e}")
+        return False
+
+def test_server_timing() -> bool:
+    """Test the per-stage Server-Timing breakdown"""
+    try:
+        response = requests.get(f"{API_URL}/breeds")
+        print(f"Status Code: {response.status_code}")
+        
+        # Check status code
+        if response.status_code != 200:
+            print(f"Expected status code 200, got {response.status_code}")
+            return False
+        
+        server_timing = response.headers.get("Server-Timing", "")
+        print(f"Server-Timing: {server_timing}")
+        stages = {entry.split(";")[0].strip() for entry in server_timing.split(",") if entry}
+        # A response served from the route cache skips the database entirely
+        expected = ["handler", "validate", "encode", "total"] + ([] if "cache" in stages else ["db"])
+        for stage in expected:
+            if stage not in stages:
+                print(f"Expected a '{stage}' entry in Server-Timing")
+                return False
+        
+        print("Successfully tested Server-Timing")
+        return True
+    except Exception as e:
+        print(f"Error testing Server-Timing: {e}")
+        return False
+
+def test_rate_limit_headers() -> bool:
+    """Test that rate limited routes report their remaining budget"""
+    try:
+        response = requests.get(f"{API_URL}/breeds/stats")
+        print(f"Status Code: {response.status_code}")
+        
+        # Check status code
+        if response.status_code != 200:
+            print(f"Expected status code 200, got {response.status_code}")
+            return False
+        
+        limit = response.headers.get("X-RateLimit-Limit")
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        print(f"X-RateLimit-Limit: {limit}, X-RateLimit-Remaining: {remaining}")
+        if limit is None or remaining is None:
+            print("Expected X-RateLimit-Limit and X-RateLimit-Remaining headers")
+            return False
+        
+        if int(remaining) >= int(limit):
+            print("Expected the request to have used part of the budget")
+            return False
+        
+        print("Successfully tested rate limit headers")
+        return True
+    except Exception as e:
+        print(f"Error testing rate limit headers: {e}")
+        return False
+
+def test_metrics(breeds: List[Dict[str, Any]]) -> bool:
+    """Test the Prometheus scrape endpoint"""
+    try:
+        # Served outside /api, like a scraper expects
+        response = requests.get(f"{BACKEND_URL}/metrics")
+        print(f"Status Code: {response.status_code}")
+        
+        # Check status code
+        if response.status_code != 200:
+            print(f"Expected status code 200, got {response.status_code}")
+            return False
+        
+        content_type = response.headers.get("Content-Type", "")
+        print(f"Content-Type: {content_type}")
+        if not content_type.startswith("text/plain; version=0.0.4"):
+            print("Expected the Prometheus text exposition format")
+            return False
+        
+        # Every line is a HELP or TYPE comment or a sample
+        label = r'[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*"'
+        sample = re.compile(rf'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{{(?:{label})(?:,{label})*\}})? (\S+)$')
+        typed = set()
+        samples: Dict[str, List[Tuple[str, float]]] = {}
+        for line in response.text.splitlines():
+            if line.startswith("# TYPE "):
+                typed.add(line.split()[2])
+                continue
+            if line.startswith("# HELP ") or not line:
+                continue
+            match = sample.match(line)
+            if not match:
+                print(f"Malformed exposition line: {line}")
+                return False
+            name, labels, value = match.groups()
+            samples.setdefault(name, []).append((labels or "", float(value)))
+        
+        for name in samples:
+            if name not in typed and re.sub(r"_(bucket|count|sum)$", "", name) not in typed:
+                print(f"Expected a TYPE line for {name}")
+                return False
+        
+        # Requests are labelled by route template, not by raw path
+        routes = [labels for labels, _ in samples.get("http_requests_total", [])]
+        if not any('route="/api/breeds/{breed_id}"' in labels for labels in routes):
+            print("Expected an http_requests_total series for the /api/breeds/{breed_id} template")
+            return False
+        if breeds and any(breeds[0]["id"] in labels for labels in routes):
+            print("Expected no route label holding a breed ID")
+            return False
+        
+        # MongoDB operations are timed per collection and operation
+        finds = [
+            count for labels, count in samples.get("mongo_operation_duration_seconds_count", [])
+            if 'collection="dog_breeds"' in labels and 'operation="find"' in labels
+        ]
+        print(f"Timed finds on dog_breeds: {sum(finds):.0f}")
+        if not finds or sum(finds) <= 0:
+            print("Expected timed find operations on the dog_breeds collection")
+            return False
+        
+        print("Successfully tested metrics")
+        return True
+    except Exception as e:
+        print(f"Error testing metrics: {e}")
+        return False
+
+def test_admin_requires_token() -> bool:
+    """Test that admin endpoints reject requests without an admin token"""
+    try:
+        admin_requests = [
+            ("POST", f"{API_URL}/admin/profile?seconds=1"),
+            ("GET", f"{API_URL}/admin/profiles/unknown"),
+            ("GET", f"{API_URL}/admin/slow-queries"),
+            ("DELETE", f"{API_URL}/admin/slow-queries"),
+            ("POST", f"{API_URL}/admin/jobs/reindex"),
+            ("POST", f"{API_URL}/admin/jobs/image-warm"),
+            ("GET", f"{API_URL}/admin/snapshot"),
+            ("DELETE", f"{API_URL}/admin/tombstones"),
+            ("DELETE", f"{API_URL}/admin/partitions/fci/fr"),
+            ("GET", f"{API_URL}/admin/route-cache"),
+            ("DELETE", f"{API_URL}/admin/route-cache"),
+            ("GET", f"{API_URL}/admin/search-queries"),
+            ("POST", f"{API_URL}/breeds"),
+            ("PUT", f"{API_URL}/breeds/unknown"),
+            ("DELETE", f"{API_URL}/breeds/unknown"),
+            ("POST", f"{API_URL}/breeds/populate"),
+            ("POST", f"{API_URL}/breeds/import?replace=true"),
+            ("POST", f"{API_URL}/jobs/unknown/cancel"),
+            ("POST", f"{API_URL}/partitions/default/en/import?replace=true"),
+            ("POST", f"{API_URL}/partitions/fci/fr/import")
+        ]
+        
+        for method, url in admin_requests:
+            print(f"Testing {method} {url} without a token")
+            response = requests.request(method, url)
+            print(f"Status Code: {response.status_code}")
+            
+            if response.status_code != 403:
+                print(f"Expected status code 403, got {response.status_code}")
+                return False
+        
+        print("Successfully tested admin authorization")
+        return True
+    except Exception as e:
+        print(f"Error testing admin authorization: {e}")
+        return False
+
+def test_synthetic_catalog(breeds: List[Dict[str, Any]]) -> bool:
+    """Test that generated catalogs are deterministic and shaped like the seed"""
+    try:
+        import uuid
+        from stats import parse_range
+        from synthetic import BreedGenerator, stable_id
+        
+        generator = BreedGenerator(breeds, seed=7)
+        records = list(generator.generate(2000))
+        
+        # The same seed gives the same records, and any record can be
+        # generated on its own
+        again = list(BreedGenerator(breeds, seed=7).generate(2000))
+        if records != again:
+            print("Expected the same records from the same seed")
+            return False
+        if list(generator.generate(10, start=1000)) != records[1000:1010] or generator.record(1999) != records[1999]:
+            print("Expected records to be independent of which came before")
+            return False
+        other = [breed["name"] for breed in BreedGenerator(breeds, seed=8).generate(50)]
+        if other == [breed["name"] for breed in records[:50]]:
+            print("Expected a different seed to give different records")
+            return False
+        
+        names = [breed["name"] for breed in records]
+        if len(set(names)) != len(names):
+            print("Expected unique names")
+            return False
+        if stable_id(7, 5) != stable_id(7, 5) or uuid.UUID(stable_id(7, 5)).version != 4:
+            print("Expected stable UUID4-shaped IDs")
+            return False
+        
+        # Records carry the seed's fields, values and range formats
+        fields = set(breeds[0]) - {"id", "created_at"}
+        sizes = {breed["size"] for breed in breeds}
+        for breed in records:
+            if set(breed) != fields:
+                print(f"Expected fields {sorted(fields)}, got {sorted(breed)}")
+                return False
+            if breed["size"] not in sizes or not breed["health_issues"]:
+                print(f"Unexpected record: {breed}")
+                return False
+            for field in ("lifespan", "weight", "height"):
+                if parse_range(breed[field]) is None:
+                    print(f"Expected a range in {field}: {breed[field]}")
+                    return False
+        
+        # The API accepts a generated record as a new breed
+        response = requests.post(f"{API_URL}/breeds", json=records[0], headers=ADMIN_HEADERS)
+        print(f"Status Code: {response.status_code}")
+        if response.status_code != 200:
+            print(f"Expected status code 200, got {response.status_code}: {response.text}")
+            return False
+        requests.delete(f"{API_URL}/breeds/{response.json()['id']}", headers=ADMIN_HEADERS)
+        
+        print(f"Generated {len(records)} breeds, e.g. {names[0]}, {names[1]}")
+        print("Successfully tested synthetic catalog")
+        return True
+    except Exception as e:
+        print(f"Error testing synthetic catalog: {e}")
+        return False
+
+def test_static_export(breeds: List[Dict[str, Any]]) -> bool:
+    """Test the static JSON export and its content-hashed file names"""
+    out = None
+    try:
+        import hashlib
+        import shutil
+        import subprocess
+        import tempfile
+        
+        backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+        out = tempfile.mkdtemp(prefix="static-export-")
+        
+        def export(*args: str) -> Tuple[dict, str]:
+            completed = subprocess.run(
+                [sys.executable, "static_export.py", "--out", out, *args],
+                cwd=backend_dir, capture_output=True, text=True, timeout=120,
+            )
+            if completed.returncode != 0:
+                raise RuntimeError(completed.stderr)
+            with open(os.path.join(out, "manifest.json")) as f:
+                return json.load(f), completed.stderr.strip().splitlines()[-1]
+        
+        manifest, summary = export()
+        print(summary)
+        files = manifest["files"]
+        paths = [files["breeds"], files["index"], *files["search"].values(), *files["facets"].values()]
+        
+        # Every file is named after a hash of its content, so the name
+        # doubles as a strong ETag
+        def load(path: str) -> Any:
+            with open(os.path.join(out, path), "rb") as f:
+                data = f.read()
+            digest = path.rsplit(".", 2)[1]
+            if hashlib.sha256(data).hexdigest()[:len(digest)] != digest:
+                raise ValueError(f"{path} does not match its content hash")
+            return json.loads(data)
+        
+        catalog = load(files["breeds"])
+        if len(catalog) != manifest["count"] or set(catalog[0]) != set(breeds[0]):
+            print("Expected the catalog file to hold every breed as the API returns them")
+            return False
+        
+        # Index rows link to per-breed files holding the same breed
+        index = load(files["index"])
+        detail = index["fields"].index("detail")
+        for row in index["breeds"]:
+            paths.append(row[detail])
+            if load(row[detail])["id"] != row[0]:
+                print(f"Expected {row[detail]} to hold breed {row[0]}")
+                return False
+        
+        # Search shards and facets point at exported breeds
+        ids = {breed["id"]: breed for breed in catalog}
+        golden = next(breed for breed in catalog if breed["name"] == "Golden Retriever")
+        if golden["id"] not in load(files["search"]["g"]).get("golden", []):
+            print("Expected 'golden' in search shard g to find the Golden Retriever")
+            return False
+        sizes = load(files["facets"]["size"])
+        if sum(value["count"] for value in sizes["values"]) != len(catalog):
+            print("Expected the size facet to count every breed once")
+            return False
+        if any(breed_id not in ids for value in sizes["values"] for breed_id in value["breeds"]):
+            print("Expected facet values to list exported breeds")
+            return False
+        
+        # Exporting unchanged data writes nothing new and keeps the version
+        again, summary = export()
+        print(summary)
+        if again != manifest or "(0 new of" not in summary:
+            print("Expected a repeated export to reuse every file")
+            return False
+        
+        # --prune removes hashed files the manifest doesn't name
+        stale = os.path.join(out, "breeds.000000000000.json")
+        with open(stale, "w") as f:
+            f.write("[]")
+        export("--prune")
+        if os.path.exists(stale) or not all(os.path.exists(os.path.join(out, path)) for path in paths):
+            print("Expected --prune to remove only files the manifest doesn't name")
+            return False
+        
+        print(f"Exported {manifest['count']} breeds in {len(paths)} files, version {manifest['version']}")
+        print("Successfully tested static export")
+        return True
+    except Exception as e:
+        print(f"Error testing static export: {e}")
+        return False
+    finally:
+        if out is not None:
+            shutil.rmtree(out, ignore_errors=True)
+
+def test_catalog_store(breeds: List[Dict[str, Any]]) -> bool:
+    """Test that the columnar catalog store round-trips breeds and counts facets"""
+    try:
+        from collections import Counter
+        from datetime import datetime
+        from catalog_store import CatalogStore
+        from synthetic import BreedGenerator, stable_id
+        
+        created_at = datetime(2025, 1, 1, 12, 30)
+        catalog = [dict(breed, created_at=datetime.fromisoformat(breed["created_at"])) for breed in breeds]
+        catalog += [
+            dict(breed, id=stable_id(0, index), created_at=created_at)
+            for index, breed in enumerate(BreedGenerator(breeds).generate(2000))
+        ]
+        # Documents missing a field a DogBreed needs are left out
+        incomplete = dict(catalog[0], id="incomplete", description=None)
+        store = CatalogStore.build(catalog + [incomplete])
+        print(f"Stored {len(store)} breeds in {store.nbytes} bytes")
+        
+        if len(store) != len(catalog) or "incomplete" in store or store.get("unknown-id") is not None:
+            print("Expected exactly the complete breeds in the store")
+            return False
+        
+        # Every breed comes back as it went in
+        for breed in catalog:
+            if store.get(breed["id"]) != breed:
+                print(f"Expected {breed['name']} to round-trip, got {store.get(breed['id'])}")
+                return False
+        
+        # Facet counts and rows match a direct count over the breeds
+        for field in ("size", "breed_group", "origin", "health_issues", "temperament"):
+            expected = Counter()
+            for breed in catalog:
+                value = breed[field]
+                tags = value.split(", ") if field == "temperament" else value if isinstance(value, list) else [value]
+                expected.update(set(tags))
+            counts = store.facet_counts(field)
+            if counts != dict(expected):
+                print(f"Expected {field} counts {dict(expected)}, got {counts}")
+                return False
+            value, count = expected.most_common(1)[0]
+            rows = store.rows_where(field, value)
+            if len(rows) != count or any(value not in store.tags(row, field) for row in rows):
+                print(f"Expected {count} rows with {field} {value}")
+                return False
+        
+        # A store rebuilt from its buffers reads the same
+        copy = CatalogStore.from_buffers(store.meta(), store.buffers())
+        if copy.records(copy.rows()) != store.records(store.rows()) or copy.facet_counts("size") != store.facet_counts("size"):
+            print("Expected a store rebuilt from its buffers to match")
+            return False
+        
+        print("Successfully tested catalog store")
+        return True
+    except Exception as e:
+        print(f"Error testing catalog store: {e}")
+        return False
+
+def test_catalog_snapshots(breeds: List[Dict[str, Any]]) -> bool:
+    """Test publishing, loading and swapping memory-mapped catalog snapshots"""
+    directory = None
+    try:
+        import shutil
+        import tempfile
+        from rebuild import SEARCH_STAGES, STAGES
+        from snapshot import POINTER, SnapshotDirectory
+        from synthetic import BreedGenerator, stable_id
+        
+        catalog = [dict(breed, id=stable_id(0, index)) for index, breed in enumerate(BreedGenerator(breeds).generate(500))]
+        built = {name: STAGES[name].build(catalog, {}) for name in SEARCH_STAGES}
+        directory = tempfile.mkdtemp(prefix="catalog-snapshots-")
+        snapshots = SnapshotDirectory(directory, keep=2)
+        
+        # A published snapshot reads like the structures it was written from
+        first = snapshots.publish(built, revision=7)
+        snapshot = snapshots.load_checked(first, 7)
+        print(f"Published {first}: {snapshot.count} breeds, {snapshot.size} bytes")
+        if snapshot is None or snapshots.current_version() != first:
+            print("Expected CURRENT to name the published snapshot")
+            return False
+        mapped = snapshot.structures
+        query, prefix = catalog[0]["name"][1:], catalog[0]["name"][:4]
+        if (
+            mapped["catalog"].records(mapped["catalog"].rows()) != built["catalog"].records(built["catalog"].rows())
+            or mapped["fuzzy"].search(query) != built["fuzzy"].search(query)
+            or mapped["suggest"].suggest(prefix) != built["suggest"].suggest(prefix)
+            or [list(c.breed_ids) for c in mapped["conditions"].ranked()] != [list(c.breed_ids) for c in built["conditions"].ranked()]
+        ):
+            print("Expected the mapped structures to match the built ones")
+            return False
+        
+        # A snapshot built at another change-log revision is stale, even when
+        # it holds as many breeds as the catalog
+        if snapshots.load_checked(first, 8) is not None:
+            print("Expected a snapshot from an older revision to be rejected")
+            return False
+        
+        # Publishing swaps CURRENT; the mapped older version stays readable
+        catalog.append(dict(BreedGenerator(breeds).record(500), id=stable_id(0, 500)))
+        built = {name: STAGES[name].build(catalog, {}) for name in SEARCH_STAGES}
+        second = snapshots.publish(built, revision=8)
+        if snapshots.current_version() != second or second <= first:
+            print(f"Expected CURRENT to move from {first} to {second}")
+            return False
+        with open(os.path.join(directory, POINTER)) as f:
+            print(f"CURRENT: {f.read()}")
+        if snapshots.load_checked(second, 8) is None or len(snapshot.structures["catalog"]) != len(catalog) - 1:
+            print("Expected both versions to be readable")
+            return False
+        
+        # Only the newest keep versions stay on disk
+        third = snapshots.publish(built)
+        if snapshots.versions() != [second, third]:
+            print(f"Expected versions {[second, third]}, got {snapshots.versions()}")
+            return False
+        
+        print("Successfully tested catalog snapshots")
+        return True
+    except Exception as e:
+        print(f"Error testing catalog snapshots: {e}")
+        return False
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def test_mongo_circuit_breaker() -> bool:
+    """Test that stale data marked X-Catalog-Stale is served while the breaker is open"""
+    try:
+        import asyncio
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+        from pymongo.errors import ServerSelectionTimeoutError
+        from resilience import STALE_HEADER, CircuitBreaker, MongoGuard, MongoUnavailable, StalenessMiddleware, mark_stale
+        from route_cache import RouteCache
+        
+        # The live server's breaker is closed while MongoDB answers
+        response = requests.get(f"{API_URL}/health/ready")
+        database = response.json().get("database", {})
+        print(f"Live breaker: {database}")
+        if database.get("state") != "closed":
+            print(f"Expected the live server's breaker to be closed, got {database}")
+            return False
+        
+        # A guarded, cached read route like the server's, over a MongoDB
+        # that can be taken down
+        guard = MongoGuard(CircuitBreaker(failure_threshold=2, reset_timeout=60), read_timeout=1)
+        cache = RouteCache(lambda params: 0, stale_on=(MongoUnavailable,))
+        mongo = {"up": True, "calls": 0}
+        
+        async def find(name: str) -> dict:
+            mongo["calls"] += 1
+            if not mongo["up"]:
+                raise ServerSelectionTimeoutError("No servers available")
+            return {"name": name, "source": "mongo"}
+        
+        async def fallback(name: str) -> dict:
+            mark_stale(30, "catalog_store")
+            return {"name": name, "source": "fallback"}
+        
+        @cache.cached("breed", ttl=0.05, fallback=fallback)
+        async def lookup(name: str) -> dict:
+            return await guard.run("find", lambda: find(name))
+        
+        app = FastAPI()
+        app.add_middleware(StalenessMiddleware)
+        
+        @app.get("/breeds/{name}")
+        async def get_breed(name: str):
+            return await lookup(name=name)
+        
+        client = TestClient(app)
+        fresh = client.get("/breeds/rex")
+        if fresh.json()["source"] != "mongo" or STALE_HEADER in fresh.headers:
+            print(f"Expected a fresh response without {STALE_HEADER}, got {fresh.json()} {dict(fresh.headers)}")
+            return False
+        
+        # MongoDB goes down: the expired cached response is served, marked stale
+        mongo["up"] = False
+        time.sleep(0.1)
+        cached = client.get("/breeds/rex")
+        print(f"Cached while down: {cached.json()}, {STALE_HEADER}: {cached.headers.get(STALE_HEADER)}")
+        if (
+            cached.json()["source"] != "mongo" or STALE_HEADER not in cached.headers
+            or cached.headers.get("cache-control") != "no-store"
+        ):
+            print(f"Expected the cached response marked stale and no-store, got {dict(cached.headers)}")
+            return False
+        
+        # Without a cached response the fallback answers; the second
+        # consecutive failure opens the breaker
+        fallback_response = client.get("/breeds/fido")
+        if fallback_response.json()["source"] != "fallback" or fallback_response.headers.get(STALE_HEADER) != "30":
+            print(f"Expected the fallback marked 30s stale, got {fallback_response.json()} {dict(fallback_response.headers)}")
+            return False
+        if guard.status()["state"] != "open":
+            print(f"Expected the breaker to open after 2 failures, got {guard.status()}")
+            return False
+        
+        # While open, MongoDB isn't called at all and stale data is still served
+        calls = mongo["calls"]
+        for name in ("rex", "fido"):
+            response = client.get(f"/breeds/{name}")
+            if STALE_HEADER not in response.headers:
+                print(f"Expected a stale response for {name} while the breaker is open")
+                return False
+        if mongo["calls"] != calls:
+            print(f"Expected no MongoDB calls while the breaker is open, got {mongo['calls'] - calls}")
+            return False
+        try:
+            asyncio.run(guard.run("find", lambda: find("rex")))
+            print("Expected the open breaker to reject calls")
+            return False
+        except MongoUnavailable as exc:
+            if exc.retry_after <= 0:
+                print(f"Expected a retry delay from the open breaker, got {exc.retry_after}")
+                return False
+        
+        # After reset_timeout a trial call goes through and closes the breaker
+        guard.breaker.opened_at -= guard.breaker.reset_timeout
+        mongo["up"] = True
+        recovered = client.get("/breeds/rex")
+        if recovered.json()["source"] != "mongo" or STALE_HEADER in recovered.headers or guard.status()["state"] != "closed":
+            print(f"Expected a fresh response and a closed breaker, got {recovered.json()} {guard.status()}")
+            return False
+        
+        print("Successfully tested the MongoDB circuit breaker")
+        return True
+    except Exception as e:
+        print(f"Error testing MongoDB circuit breaker: {e}")
+        return False
+
+def test_profiler() -> bool:
+    """Test worker and per-request profiles in the collapsed-stack format"""
+    try:
+        collapsed_line = re.compile(r"^\S.* \d+$")
+        
+        # Sampling the worker returns one "frame;frame count" line per stack
+        response = requests.post(
+            f"{API_URL}/admin/profile", params={"seconds": 0.5, "interval_ms": 2, "mode": "wall"}, headers=ADMIN_HEADERS,
+        )
+        print(f"Status Code: {response.status_code}, samples: {response.headers.get('X-Profile-Samples')}")
+        if response.status_code != 200 or int(response.headers.get("X-Profile-Samples", 0)) <= 0:
+            print(f"Expected a profile with samples, got {response.status_code}: {response.text[:200]}")
+            return False
+        lines = response.text.splitlines()
+        if not lines or not all(collapsed_line.match(line) for line in lines):
+            print(f"Expected collapsed stacks, got {lines[:3]}")
+            return False
+        # Wall mode also records where pending tasks are suspended
+        if not any("[suspended]" in line for line in lines):
+            print("Expected suspended task stacks in a wall-mode profile")
+            return False
+        
+        # X-Profile without the admin token is ignored
+        response = requests.get(f"{API_URL}/breeds", headers={"X-Profile": "1"})
+        if "X-Profile-Id" in response.headers:
+            print("Expected X-Profile to need the admin token")
+            return False
+        
+        # With it, the request's profile is kept for the admin API
+        response = requests.get(f"{API_URL}/breeds", headers={**ADMIN_HEADERS, "X-Profile": "1"})
+        profile_id = response.headers.get("X-Profile-Id")
+        print(f"Request profile: {profile_id}, samples: {response.headers.get('X-Profile-Samples')}")
+        if response.status_code != 200 or not profile_id:
+            print(f"Expected an X-Profile-Id header, got {dict(response.headers)}")
+            return False
+        profile = requests.get(f"{API_URL}/admin/profiles/{profile_id}", headers=ADMIN_HEADERS)
+        if profile.status_code != 200 or not all(collapsed_line.match(line) for line in profile.text.splitlines()):
+            print(f"Expected the request's collapsed stacks, got {profile.status_code}: {profile.text[:200]}")
+            return False
+        missing = requests.get(f"{API_URL}/admin/profiles/unknown", headers=ADMIN_HEADERS)
+        if missing.status_code != 404:
+            print(f"Expected 404 for an unknown profile, got {missing.status_code}")
+            return False
+        
+        print("Successfully tested the profiler")
+        return True
+    except Exception as e:
+        print(f"Error testing profiler: {e}")
+        return False
+
+def test_slow_query_log() -> bool:
+    """Test that only commands over the threshold are logged, with their filter shapes"""
+    try:
+        from types import SimpleNamespace
+        from slow_queries import SlowQueryLog
+        
+        # The live log reports its threshold and records, newest first
+        response = requests.get(f"{API_URL}/admin/slow-queries", params={"limit": 5}, headers=ADMIN_HEADERS)
+        print(f"Status Code: {response.status_code}")
+        body = response.json()
+        if response.status_code != 200 or "threshold_ms" not in body or not isinstance(body.get("records"), list):
+            print(f"Expected the slow-query log, got {body}")
+            return False
+        
+        # Fed pymongo's command events directly
+        log = SlowQueryLog(threshold_ms=50, capacity=2)
+        request_ids = iter(range(1, 100))
+        
+        def run_command(name: str, command: dict, duration_ms: float, failure: Optional[str] = None):
+            event = SimpleNamespace(
+                command_name=name, command=command, database_name="test_database",
+                connection_id=("localhost", 27017), request_id=next(request_ids),
+                duration_micros=int(duration_ms * 1000), failure=failure,
+            )
+            log.started(event)
+            if failure:
+                log.failed(event)
+            else:
+                log.succeeded(event)
+        
+        run_command("find", {"find": "dog_breeds", "filter": {"name": "Beagle"}}, 5)
+        run_command("ping", {"ping": 1}, 500)
+        if log.records():
+            print(f"Expected fast and ignored commands to be left out, got {log.records()}")
+            return False
+        
+        run_command("find", {"find": "dog_breeds", "filter": {"size": {"$in": ["Large", "Giant"]}, "lifespan": 12}}, 120)
+        run_command("count", {"count": "dog_breeds", "query": {"origin": "Germany"}}, 80, failure="interrupted")
+        records = log.records()
+        print(f"Slow records: {records}")
+        if [record["operation"] for record in records] != ["count", "find"]:
+            print("Expected both slow commands, newest first")
+            return False
+        find = records[1]
+        if (
+            find["collection"] != "dog_breeds" or find["duration_ms"] != 120
+            or find["filter_shape"] != {"size": {"$in": ["<str>"]}, "lifespan": "<int>"}
+        ):
+            print(f"Expected the find's collection, duration and filter shape, got {find}")
+            return False
+        if records[0]["error"] != "interrupted":
+            print(f"Expected the failed count's error, got {records[0]}")
+            return False
+        
+        # The ring buffer keeps the newest capacity records
+        run_command("distinct", {"distinct": "dog_breeds", "key": "origin", "query": {}}, 60)
+        if [record["operation"] for record in log.records()] != ["distinct", "count"]:
+            print(f"Expected the oldest record dropped, got {log.records()}")
+            return False
+        log.clear()
+        if log.records():
+            print("Expected clear() to empty the log")
+            return False
+        
+        print("Successfully tested the slow-query log")
+        return True
+    except Exception as e:
+        print(f"Error testing slow-query log: {e}")
+        return False
+
+def test_jobs() -> bool:
+    """Test job status transitions, cancellation and one-at-a-time job groups"""
+    try:
+        import asyncio
+        from mongomock_motor import AsyncMongoMockClient
+        from jobs import JobQueue
+        
+        # A live job goes from queued through running to succeeded
+        response = requests.post(f"{API_URL}/admin/jobs/reindex", headers=ADMIN_HEADERS)
+        print(f"Status Code: {response.status_code}, Location: {response.headers.get('Location')}")
+        if response.status_code != 202 or response.json()["status"] not in ("queued", "running"):
+            print(f"Expected a queued job, got {response.status_code}: {response.text}")
+            return False
+        job_id = response.json()["id"]
+        if response.headers.get("Location") != f"/api/jobs/{job_id}":
+            print("Expected a Location header naming the job")
+            return False
+        for _ in range(60):
+            job = requests.get(f"{API_URL}/jobs/{job_id}").json()
+            if job["status"] not in ("queued", "running"):
+                break
+            time.sleep(0.5)
+        print(f"Finished job: {job}")
+        if job["status"] != "succeeded" or not (job["created_at"] <= job["started_at"] <= job["finished_at"]):
+            print(f"Expected the job to succeed with ordered timestamps, got {job}")
+            return False
+        # Cancelling a finished job changes nothing
+        response = requests.post(f"{API_URL}/jobs/{job_id}/cancel", headers=ADMIN_HEADERS)
+        if response.status_code != 200 or response.json()["status"] != "succeeded":
+            print(f"Expected the finished job to stay succeeded, got {response.text}")
+            return False
+        if requests.get(f"{API_URL}/jobs/unknown").status_code != 404:
+            print("Expected 404 for an unknown job")
+            return False
+        
+        # A queue of its own, with handlers that wait to be released
+        async def scenario() -> bool:
+            database = AsyncMongoMockClient()["job_test"]
+            queue = JobQueue(workers=2, poll_interval=0.05)
+            release = asyncio.Event()
+            
+            async def blocking(context):
+                await release.wait()
+                await context.progress(1, 1)
+                return {"released": True}
+            
+            async def quick(context):
+                return {"quick": True}
+            
+            async def broken(context):
+                raise ValueError("broken handler")
+            
+            queue.register("first", blocking, group="catalog")
+            queue.register("second", blocking, group="catalog")
+            queue.register("quick", quick)
+            queue.register("broken", broken)
+            queue.start(database.jobs, database.job_locks)
+            
+            async def wait_for(job_id: str, statuses) -> dict:
+                for _ in range(100):
+                    job = await queue.get(job_id)
+                    if job["status"] in statuses:
+                        return job
+                    await asyncio.sleep(0.02)
+                return job
+            
+            try:
+                first = await queue.submit("first")
+                second = await queue.submit("second")
+                first = await wait_for(first["id"], ("running",))
+                await asyncio.sleep(0.2)
+                second = await queue.get(second["id"])
+                lock = await database.job_locks.find_one({"_id": "catalog"})
+                print(f"First: {first['status']}, second: {second['status']}, lock: {lock and lock['job_id'] == first['id']}")
+                # Two free workers, but one group runs one job at a time
+                if first["status"] != "running" or second["status"] != "queued" or not lock or lock["job_id"] != first["id"]:
+                    print("Expected the second catalog job to wait for the first")
+                    return False
+                
+                # Other groups aren't held up
+                quick_job = await wait_for((await queue.submit("quick"))["id"], ("succeeded",))
+                broken_job = await wait_for((await queue.submit("broken"))["id"], ("failed",))
+                if quick_job["result"] != {"quick": True} or broken_job["error"] != "broken handler":
+                    print(f"Expected one succeeded and one failed job, got {quick_job} {broken_job}")
+                    return False
+                
+                # A queued job is cancelled outright
+                second = await queue.cancel(second["id"])
+                if second["status"] != "cancelled" or second["finished_at"] is None:
+                    print(f"Expected the queued job cancelled, got {second}")
+                    return False
+                
+                # A running one only stops at its next progress report
+                first = await queue.cancel(first["id"])
+                if first["status"] != "running" or not first["cancel_requested"]:
+                    print(f"Expected the running job asked to stop, got {first}")
+                    return False
+                release.set()
+                first = await wait_for(first["id"], ("cancelled", "succeeded", "failed"))
+                if first["status"] != "cancelled" or first["result"] is not None:
+                    print(f"Expected the running job cancelled at its checkpoint, got {first}")
+                    return False
+                await asyncio.sleep(0.1)
+                if await database.job_locks.count_documents({}):
+                    print("Expected the group lock released")
+                    return False
+                return True
+            finally:
+                await queue.stop()
+        
+        if not asyncio.run(scenario()):
+            return False
+        
+        print("Successfully tested jobs")
+        return True
+    except Exception as e:
+        print(f"Error testing jobs: {e}")
+        return False
+
+def test_pool_rebuild(breeds: List[Dict[str, Any]]) -> bool:
+    """Test that structures built in the process pool match ones built inline"""
+    pipeline = None
+    try:
+        import asyncio
+        from metrics import REBUILD_DURATION
+        from rebuild import STAGES, RebuildPipeline
+        from synthetic import BreedGenerator, stable_id
+        
+        catalog = [dict(breed, id=stable_id(0, index)) for index, breed in enumerate(BreedGenerator(breeds).generate(600))]
+        pipeline = RebuildPipeline(workers=2, min_breeds=500)
+        
+        def process_builds() -> int:
+            return sum(sum(REBUILD_DURATION.labels(name, "process").counts) for name in STAGES)
+        
+        before = process_builds()
+        started = time.time()
+        pooled = asyncio.run(pipeline.run(catalog))
+        print(f"Built {sorted(pooled)} in the pool in {time.time() - started:.2f}s")
+        if process_builds() - before != len(STAGES):
+            print(f"Expected every stage built in the pool, got {process_builds() - before}")
+            return False
+        
+        # Below min_breeds the pool isn't used
+        before = process_builds()
+        asyncio.run(pipeline.run(catalog[:100], ["suggest"]))
+        if process_builds() != before:
+            print("Expected a small catalog to be built inline")
+            return False
+        
+        inline = RebuildPipeline(workers=0)._run_inline(catalog, list(STAGES))
+        query, prefix = catalog[0]["name"][1:], catalog[0]["name"][:4]
+        checks = {
+            "catalog": lambda built: built.records(built.rows()),
+            "fuzzy": lambda built: built.search(query),
+            "suggest": lambda built: built.suggest(prefix),
+            "conditions": lambda built: [(c.id, list(c.breed_ids)) for c in built.ranked()],
+            # Rollups are built from slices in separate processes and merged,
+            # so their cells come out in another order
+            "rollups": lambda built: sorted(built.to_documents(), key=lambda document: document["_id"]),
+        }
+        for name, read in checks.items():
+            if read(pooled[name]) != read(inline[name]):
+                print(f"Expected the pooled {name} to match the inline one")
+                return False
+        
+        print("Successfully tested pool rebuilds")
+        return True
+    except Exception as e:
+        print(f"Error testing pool rebuild: {e}")
+        return False
+    finally:
+        if pipeline is not None:
+            pipeline.shutdown()
+
+def test_error_handling() -> bool:
+    """Test error handling for malformed requests"""
+    try:
+        # Test non-existent endpoint
+        print("Testing non-existent endpoint")
+        response = requests.get(f"{API_URL}/nonexistent")
+        print(f"Status Code: {response.status_code}")
+        
+        # Check status code
+        if response.status_code < 400:
+            print(f"Expected error status code (4xx), got {response.status_code}")
+            return False
+        
+        print("Successfully tested error handling")
+        return True
+    except Exception as e:
+        print(f"Error testing error handling: {e}")
+        return False
+
+def print_summary():
+    """Print a summary of test results"""
+    print("\n" + "="*80)
+    print("TEST SUMMARY")
+    print("-"*80)
+    print(f"Total Tests: {test_results['total']}")
+    print(f"Passed: {test_results['passed']}")
+    print(f"Failed: {test_results['failed']}")
+    print(f"Success Rate: {(test_results['passed'] / test_results['total']) * 100:.2f}%")
+    print("="*80)
+    
+    # Print details of failed tests
+    if test_results['failed'] > 0:
+        print("\nFAILED TESTS:")
+        for test in test_results['tests']:
+            if test['status'] != 'PASSED':
+                print(f"- {test['name']}: {test['status']}")
+                if 'error' in test:
+                    print(f"  Error: {test['error']}")
+        print("="*80)
+
+def main():
+    """Run all tests"""
+    print(f"Starting Dog Breeds API Tests against {API_URL}")
+    
+    # Test API health
+    api_health_ok = run_test("API Health Check", test_api_health)
+    if not api_health_ok:
+        print("API health check failed, aborting further tests")
+        print_summary()
+        return
+    
+    # Test breeds population
+    breeds_population_ok = run_test("Breeds Data Population", test_breeds_population)
+    if not breeds_population_ok:
+        print("Breeds population failed, aborting further tests")
+        print_summary()
+        return
+    
+    # Test breeds retrieval
+    breeds_retrieval_ok, breeds = run_test("Breeds Retrieval", test_breeds_retrieval)
+    if not breeds_retrieval_ok or not breeds:
+        print("Breeds retrieval failed, aborting further tests")
+        print_summary()
+        return
+    
+    # Test individual breed retrieval
+    run_test("Individual Breed Retrieval", test_individual_breed_retrieval, breeds)
+    
+    # Test search functionality
+    run_test("Search Functionality", test_search_functionality, breeds)
+    
+    # Test fuzzy search
+    run_test("Fuzzy Search Functionality", test_fuzzy_search_functionality)
+    
+    # Test fuzzy candidate filtering at scale
+    run_test("Fuzzy Candidates", test_fuzzy_candidates, breeds)
+    
+    # Test typeahead suggestions
+    run_test("Suggest Functionality", test_suggest_functionality)
+    
+    # Test aggregated statistics
+    run_test("Stats Functionality", test_stats_functionality, breeds)
+    
+    # Test health conditions
+    run_test("Conditions Functionality", test_conditions_functionality)
+    
+    # Test selective queries
+    run_test("Query Functionality", test_query_functionality, breeds)
+    
+    # Test change streaming
+    run_test("Change Stream", test_change_stream, breeds)
+    
+    # Test delta sync
+    run_test("Delta Sync", test_delta_sync, breeds)
+    
+    # Test registry and locale partitions
+    run_test("Catalog Partitions", test_partitions, breeds)
+    
+    # Test the route cache
+    run_test("Route Cache", test_route_cache, breeds)
+    
+    # Test search query normalization
+    run_test("Search Normalization", test_search_normalization)
+    
+    # Test first-page bootstrap bundle
+    run_test("Bootstrap Bundle", test_bootstrap, breeds)
+    
+    # Test health probes
+    run_test("Readiness", test_readiness)
+    
+    # Test request tracing
+    run_test("Server-Timing Breakdown", test_server_timing)
+    
+    # Test rate limiting
+    run_test("Rate Limit Headers", test_rate_limit_headers)
+    
+    # Test admin authorization
+    run_test("Admin Authorization", test_admin_requires_token)
+    
+    # Test the Prometheus scrape endpoint
+    run_test("Metrics", test_metrics, breeds)
+    
+    # Test synthetic catalog generation
+    run_test("Synthetic Catalog", test_synthetic_catalog, breeds)
+    
+    # Test the static JSON export
+    run_test("Static Export", test_static_export, breeds)
+    
+    # Test the columnar catalog store
+    run_test("Catalog Store", test_catalog_store, breeds)
+    
+    # Test memory-mapped catalog snapshots
+    run_test("Catalog Snapshots", test_catalog_snapshots, breeds)
+    
+    # Test rebuilds in the process pool
+    run_test("Pool Rebuild", test_pool_rebuild, breeds)
+    
+    # Test background jobs
+    run_test("Jobs", test_jobs)
+    
+    # Test the sampling profiler
+    run_test("Profiler", test_profiler)
+    
+    # Test the slow-query log
+    run_test("Slow Query Log", test_slow_query_log)
+    
+    # Test stale responses behind an open circuit breaker
+    run_test("MongoDB Circuit Breaker", test_mongo_circuit_breaker)
     
     # Test error handling
     run_test("Error Handling", test_error_handling)
@@ -4,6 +4,38 @@ import axios from "axios";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+// Set to serve the catalog from files written by backend/static_export.py
+const STATIC_API_URL = process.env.REACT_APP_STATIC_API_URL;
+
+// Only manifest.json keeps its name between exports; the files it names
+// are content-hashed and can be cached forever
+const fetchStaticBreeds = async () => {
+  const { data: manifest } = await axios.get(`${STATIC_API_URL}/manifest.json`);
+  const { data } = await axios.get(`${STATIC_API_URL}/${manifest.files.breeds}`);
+  return data;
+};
+
+// Everything the first render needs in one request: summary rows, facet
+// counts and sized image variants. Details are fetched when a breed opens.
+const fetchBootstrap = async () => {
+  const { data } = await axios.get(`${API}/bootstrap`);
+  const breeds = data.breeds.map((row) =>
+    Object.fromEntries(data.fields.map((field, index) => [field, row[index]]))
+  );
+  return { breeds, facets: data.facets };
+};
+
+// Bootstrap rows carry CDN-resized variants; other breeds only image_url
+const cardImage = (breed) => {
+  if (!breed.images) return { src: breed.image_url };
+  const { card, card_2x: retina } = breed.images;
+  return {
+    src: card.url,
+    srcSet: `${card.url} 1x, ${retina.url} 2x`,
+    width: card.width || undefined,
+    height: card.height || undefined,
+  };
+};
 
 function App() {
   const [breeds, setBreeds] = useState([]);
@@ -13,30 +45,58 @@ function App() {
   const [filteredBreeds, setFilteredBreeds] = useState([]);
   const [filterSize, setFilterSize] = useState("all");
   const [showModal, setShowModal] = useState(false);
+  const [sizeCounts, setSizeCounts] = useState({});
 
   useEffect(() => {
     fetchBreeds();
   }, []);
 
+  // Apply catalog changes as the server pushes them instead of re-fetching
+  useEffect(() => {
+    if (STATIC_API_URL || typeof EventSource === "undefined") return;
+    const source = new EventSource(`${API}/breeds/stream`);
+    const apply = (handler) => (event) => handler(JSON.parse(event.data));
+    source.addEventListener("create", apply((change) =>
+      setBreeds((current) => [...current.filter((breed) => breed.id !== change.id), change.breed])
+    ));
+    source.addEventListener("update", apply((change) =>
+      setBreeds((current) => current.map((breed) =>
+        breed.id === change.id
+          ? { ...breed, ...change.fields, ...(change.fields.image_url ? { images: undefined } : {}) }
+          : breed
+      ))
+    ));
+    source.addEventListener("delete", apply((change) =>
+      setBreeds((current) => current.filter((breed) => breed.id !== change.id))
+    ));
+    source.addEventListener("reset", () => {
+      fetchBootstrap()
+        .then(applyBootstrap)
+        .catch((error) => console.error("Error re-fetching breeds:", error));
+    });
+    return () => source.close();
+  }, []);
+
   useEffect(() => {
     filterBreeds();
   }, [breeds, searchTerm, filterSize]);
 
+  const applyBootstrap = ({ breeds, facets }) => {
+    setBreeds(breeds);
+    setSizeCounts(Object.fromEntries(facets.size.map(({ value, count }) => [value.toLowerCase(), count])));
+  };
+
+  // The server populates an empty catalog before answering the bootstrap
   const fetchBreeds = async () => {
     try {
       setLoading(true);
-      const response = await axios.get(`${API}/breeds`);
-      setBreeds(response.data);
+      if (STATIC_API_URL) {
+        setBreeds(await fetchStaticBreeds());
+        return;
+      }
+      applyBootstrap(await fetchBootstrap());
     } catch (error) {
       console.error("Error fetching breeds:", error);
-      // Try to populate breeds if empty
-      try {
-        await axios.post(`${API}/breeds/populate`);
-        const response = await axios.get(`${API}/breeds`);
-        setBreeds(response.data);
-      } catch (populateError) {
-        console.error("Error populating breeds:", populateError);
-      }
     } finally {
       setLoading(false);
     }
@@ -68,6 +128,14 @@ function App() {
     setSelectedBreed(breed);
     setShowModal(true);
     document.body.style.overflow = 'hidden';
+    // Bootstrap rows hold only what a card shows
+    if (!STATIC_API_URL && breed.description === undefined) {
+      axios.get(`${API}/breeds/${breed.id}`)
+        .then((response) => setSelectedBreed((current) =>
+          current && current.id === breed.id ? { ...current, ...response.data } : current
+        ))
+        .catch((error) => console.error("Error fetching breed details:", error));
+    }
   };
 
   const closeModal = () => {
@@ -150,10 +218,12 @@ function App() {
                 className="w-full px-4 py-3 border-2 border-gray-200 rounded-xl focus:border-indigo-500 focus:outline-none transition-colors duration-200"
               >
                 <option value="all">All Sizes</option>
-                <option value="small">Small</option>
-                <option value="medium">Medium</option>
-                <option value="large">Large</option>
-                <option value="giant">Giant</option>
+                {["small", "medium", "large", "giant"].map((size) => (
+                  <option key={size} value={size}>
+                    {size.charAt(0).toUpperCase() + size.slice(1) +
+                      (sizeCounts[size] !== undefined ? ` (${sizeCounts[size]})` : "")}
+                  </option>
+                ))}
               </select>
             </div>
           </div>
@@ -177,10 +247,11 @@ function App() {
             >
               <div className="relative overflow-hidden h-48">
                 <img
-                  src={breed.image_url}
+                  {...cardImage(breed)}
                   alt={breed.name}
                   className="w-full h-full object-cover transition-transform duration-300 group-hover:scale-110"
                   onError={(e) => {
+                    e.target.removeAttribute('srcset');
                     e.target.src = 'https://images.unsplash.com/photo-1558788353-f76d92427f16';
                   }}
                 />
@@ -249,7 +320,7 @@ function App() {
               
               <div className="relative h-64 md:h-80 overflow-hidden rounded-t-2xl">
                 <img
-                  src={selectedBreed.image_url}
+                  src={selectedBreed.images ? selectedBreed.images.detail.url : selectedBreed.image_url}
                   alt={selectedBreed.name}
                   className="w-full h-full object-cover"
                   onError={(e) => {